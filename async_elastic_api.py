@@ -0,0 +1,553 @@
+import asyncio
+import random
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from elastic_api import (IDEMPOTENT_METHODS, RETRY_STATUS_CODES,
+                         ElasticConnection, get_retry_after)
+from rate_limit import TokenBucket
+
+
+class AsyncElasticConnection():
+    """
+    The requests are retried as the ones of ElasticConnection:
+    the throttled ones (429) after the Retry-After delay, the idempotent
+    ones also on 503 and on the connection errors with a jittered
+    exponential backoff. With sync_connection the access token (shared
+    through Redis), the rate limiter, the retry settings and the request
+    stats are the ones of the synchronous connection, so both clients
+    of the process stay within one rate limit.
+    """
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        *,
+        base_url: str = 'https://api.moltin.com',
+        timeout: float = 30,
+        pool_maxsize: int = 100,
+        pool_maxsize_per_host: int = 0,
+        keepalive_timeout: float = 15,
+        sync_connection: Optional[ElasticConnection] = None,
+        requests_per_second: float = 0,
+        requests_burst: int = 1,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 30,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_token = ""
+        self.access_token_expiration_timestamp = 0
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.pool_maxsize_per_host = pool_maxsize_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.access_token_lock: Optional[asyncio.Lock] = None
+        self.sync_connection = sync_connection
+        self.rate_limiter = None
+        if sync_connection:
+            self.rate_limiter = sync_connection.rate_limiter
+            max_retries = sync_connection.max_retries
+            backoff_factor = sync_connection.backoff_factor
+            max_backoff = sync_connection.max_backoff
+        elif requests_per_second:
+            self.rate_limiter = TokenBucket(
+                rate=requests_per_second,
+                capacity=requests_burst,
+            )
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.request_stats = {
+            'requests': 0,
+            'retries': 0,
+            'throttled_responses': 0,
+            'rate_limit_wait_seconds': 0.0,
+            'retry_wait_seconds': 0.0,
+        }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions are bound to the running event loop,
+        # so the session is created on the first request
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_maxsize,
+                limit_per_host=self.pool_maxsize_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def update_request_stats(self, **increments) -> None:
+        if self.sync_connection:
+            self.sync_connection.update_request_stats(**increments)
+            return
+        for name, increment in increments.items():
+            self.request_stats[name] += increment
+
+    def get_request_stats(self) -> Dict:
+        if self.sync_connection:
+            return self.sync_connection.get_request_stats()
+        return dict(self.request_stats)
+
+    def get_backoff_delay(self, attempt: int) -> float:
+        # "Full jitter": a random delay up to the exponential backoff
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, backoff)
+
+    def get_retry_delay(
+        self,
+        method: str,
+        response: aiohttp.ClientResponse,
+        attempt: int,
+    ) -> Optional[float]:
+        """
+        Returns the delay before the retry or None if the response is final.
+        """
+        if response.status not in RETRY_STATUS_CODES:
+            return None
+        self.update_request_stats(throttled_responses=1)
+        retry_is_safe = response.status == 429 or method in IDEMPOTENT_METHODS
+        if not retry_is_safe or attempt >= self.max_retries:
+            return None
+        retry_delay = get_retry_after(response)
+        if retry_delay is None:
+            return self.get_backoff_delay(attempt)
+        if retry_delay > self.max_backoff:
+            return None
+        return retry_delay
+
+    async def send(self, method: str, url: str, **kwargs) -> Optional[Dict]:
+        """
+        Sends the request within the rate limit, retries it
+        as ElasticConnection.send does and returns the JSON response.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                rate_limit_wait = self.rate_limiter.reserve()
+                if rate_limit_wait:
+                    await asyncio.sleep(rate_limit_wait)
+                self.update_request_stats(
+                    rate_limit_wait_seconds=rate_limit_wait
+                )
+            self.update_request_stats(requests=1)
+
+            try:
+                async with self.get_session().request(
+                    method,
+                    url,
+                    **kwargs,
+                ) as response:
+                    retry_delay = self.get_retry_delay(
+                        method,
+                        response,
+                        attempt,
+                    )
+                    if retry_delay is None:
+                        response.raise_for_status()
+                        if response.content_type != 'application/json':
+                            return None
+                        return await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if (
+                    method not in IDEMPOTENT_METHODS
+                    or attempt >= self.max_retries
+                ):
+                    raise
+                retry_delay = self.get_backoff_delay(attempt)
+
+            attempt += 1
+            self.update_request_stats(
+                retries=1,
+                retry_wait_seconds=retry_delay,
+            )
+            await asyncio.sleep(retry_delay)
+
+    async def set_access_token(self):
+        if self.sync_connection:
+            await self.adopt_sync_access_token()
+            return
+        if self.access_token_lock is None:
+            self.access_token_lock = asyncio.Lock()
+        async with self.access_token_lock:
+            if self.access_token:
+                current_timestamp = datetime.now().timestamp()
+                if current_timestamp < self.access_token_expiration_timestamp:
+                    return
+            payload = {
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials',
+            }
+            token_card = await self.send(
+                'POST',
+                f'{self.base_url}/oauth/access_token/',
+                data=payload,
+            )
+
+            self.access_token = token_card['access_token']
+            self.access_token_expiration_timestamp = token_card['expires']
+
+    async def adopt_sync_access_token(self) -> None:
+        connection = self.sync_connection
+        expiration_timestamp = connection.access_token_expiration_timestamp
+        if (
+            not connection.access_token
+            or datetime.now().timestamp() >= expiration_timestamp
+        ):
+            # The token is requested once for the process
+            # (or taken from Redis) in a thread, the loop goes on
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                connection.set_access_token,
+            )
+        self.access_token = connection.access_token
+
+    async def request(self, method: str, url: str, **kwargs) -> Optional[Dict]:
+        await self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+        return await self.send(
+            method,
+            f'{self.base_url}{url}',
+            headers=headers,
+            **kwargs,
+        )
+
+    async def get_products(self):
+        return await self.request('GET', '/pcm/products/')
+
+    async def get_products_page(
+            self,
+            page_limit: int,
+            page_offset: int
+    ):
+        payload = {
+            'page[limit]': str(page_limit),
+            'page[offset]': str(page_offset),
+        }
+        return await self.request('GET', '/pcm/products/', params=payload)
+
+    async def get_product(self, product_id):
+        return await self.request('GET', f'/catalog/products/{product_id}/')
+
+    async def get_node_products(
+            self,
+            catalog_id: str,
+            node_id: str
+    ):
+        return await self.request(
+            'GET',
+            (
+                f'/pcm/catalogs/{catalog_id}/'
+                f'releases/latest/nodes/{node_id}/relationships/products/'
+            ),
+        )
+
+    async def get_file_link(self, file_id):
+        file_response = await self.request('GET', f'/v2/files/{file_id}/')
+        return file_response['data']['link']['href']
+
+    async def add_product_to_cart(self, cart_id, product_id, quantity):
+        payload = {
+            "data": {
+                "id": product_id,
+                "type": "cart_item",
+                "quantity": quantity,
+            }
+        }
+        return await self.request(
+            'POST',
+            f'/v2/carts/{cart_id}/items/',
+            json=payload,
+        )
+
+    async def get_cart(self, cart_id):
+        return await self.request('GET', f'/v2/carts/{cart_id}/')
+
+    async def get_cart_items(self, cart_id):
+        return await self.request('GET', f'/v2/carts/{cart_id}/items/')
+
+    async def remove_cart_item(self, cart_id, item_id):
+        return await self.request(
+            'DELETE',
+            f'/v2/carts/{cart_id}/items/{item_id}/',
+        )
+
+    async def create_customer(self, name, email):
+        payload = {
+            'data': {
+                'type': 'customer',
+                'name': name,
+                'email': email,
+            }
+        }
+        return await self.request('POST', '/v2/customers/', json=payload)
+
+    async def create_product(
+        self,
+        name: str,
+        sku: str,
+        description: str
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'product',
+                'attributes': {
+                    'name': name,
+                    'sku': sku,
+                    'description': description,
+                    'status': 'live',
+                    'commodity_type': 'physical',
+                },
+            },
+        }
+        return await self.request('POST', '/pcm/products/', json=payload)
+
+    async def create_products_relationships(
+            self,
+            hierarchy_id: str,
+            node_id: str,
+            products_ids: List
+    ) -> Dict:
+        products = [
+            {'type': 'product', 'id': product_id}
+            for product_id in products_ids
+        ]
+        payload = {'data': products}
+        return await self.request(
+            'POST',
+            (
+                f'/pcm/hierarchies/{hierarchy_id}/'
+                f'nodes/{node_id}/relationships/products/'
+            ),
+            json=payload,
+        )
+
+    async def create_file(self, file_location: str) -> Dict:
+        payload = aiohttp.FormData()
+        payload.add_field('file_location', file_location)
+        return await self.request('POST', '/v2/files/', data=payload)
+
+    async def create_product_file_relationships(
+        self,
+        product_id: str,
+        files_ids: List
+    ) -> None:
+        files = [{'type': 'file', 'id': file_id} for file_id in files_ids]
+        payload = {'data': files}
+        await self.request(
+            'POST',
+            f'/pcm/products/{product_id}/relationships/files/',
+            json=payload,
+        )
+
+    async def create_main_image_relationships(
+            self,
+            product_id: str,
+            file_id: str
+    ) -> None:
+        payload = {'data': {'type': 'file', 'id': file_id}}
+        await self.request(
+            'POST',
+            f'/pcm/products/{product_id}/relationships/main_image/',
+            json=payload,
+        )
+
+    async def create_flow(
+        self,
+        enabled: bool,
+        description: str,
+        slug: str,
+        name: str
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'flow',
+                'name': name,
+                'slug': slug,
+                'description': description,
+                'enabled': enabled,
+            }
+        }
+        return await self.request('POST', '/v2/flows/', json=payload)
+
+    async def create_field(
+            self,
+            *,
+            name: str,
+            slug: str,
+            field_type: str,
+            description: str,
+            required: bool,
+            enabled: bool,
+            flow_id: str
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'field',
+                'name': name,
+                'slug': slug,
+                'field_type': field_type,
+                'description': description,
+                'required': required,
+                'enabled': enabled,
+                'relationships': {
+                    'flow': {
+                        'data': {
+                            'type': 'flow',
+                            'id': flow_id,
+                        },
+                    },
+                },
+            },
+        }
+        return await self.request('POST', '/v2/fields/', json=payload)
+
+    async def create_pizzeria(
+        self,
+        address: str,
+        alias: str,
+        longitude: float,
+        latitude: float,
+        courier_tg_id: int,
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'entry',
+                'address': address,
+                'alias': alias,
+                'longitude': longitude,
+                'latitude': latitude,
+            }
+        }
+        if courier_tg_id:
+            payload['data']['courier_tg_id'] = courier_tg_id
+
+        return await self.request(
+            'POST',
+            '/v2/flows/pizzerias/entries/',
+            json=payload,
+        )
+
+    async def create_product_price(
+            self,
+            price_book_id: str,
+            product_sku: str,
+            currency_code: str,
+            amount: int
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'product-price',
+                'attributes': {
+                    'sku': product_sku,
+                    'currencies': {
+                        currency_code: {'amount': amount}
+                    },
+                }
+            }
+        }
+        return await self.request(
+            'POST',
+            f'/pcm/pricebooks/{price_book_id}/prices/',
+            json=payload,
+        )
+
+    async def get_custom_flow_entries(self, slug: str) -> Dict:
+        return await self.request('GET', f'/v2/flows/{slug}/entries')
+
+    async def get_customers_by_name(self, name: str) -> Dict:
+        payload = {
+            'filter': f'eq(name,{name})'
+        }
+        return await self.request('GET', '/v2/customers/', params=payload)
+
+    async def update_customer_email(
+        self,
+        customer_id: str,
+        email: str
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'customer',
+                'email': email,
+            }
+        }
+        return await self.request(
+            'PUT',
+            f'/v2/customers/{customer_id}/',
+            json=payload,
+        )
+
+    async def update_customer_location(
+        self,
+        customer_id: str,
+        latitude: float,
+        longitude: float,
+    ) -> Dict:
+        payload = {
+            'data': {
+                'type': 'customer',
+                'latitude': latitude,
+                'longitude': longitude,
+            }
+        }
+        return await self.request(
+            'PUT',
+            f'/v2/customers/{customer_id}/',
+            json=payload,
+        )
+
+    async def get_nodes(
+            self,
+            catalog_id: str,
+    ):
+        return await self.request(
+            'GET',
+            f'/pcm/catalogs/{catalog_id}/releases/latest/nodes',
+        )
+
+    async def get_node_children(
+            self,
+            catalog_id: str,
+            node_id: str,
+    ):
+        return await self.request(
+            'GET',
+            (
+                f'/pcm/catalogs/{catalog_id}/releases/'
+                f'latest/nodes/{node_id}/relationships/children'
+            ),
+        )
+
+    async def get_latest_catalog_release(
+        self,
+        catalog_id: str,
+    ):
+        return await self.request(
+            'GET',
+            f'/pcm/catalogs/{catalog_id}/releases/latest',
+        )
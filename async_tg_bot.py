@@ -0,0 +1,537 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import aiohttp
+from environs import Env
+from redis.asyncio import Redis
+from telegram import TelegramObject, Update
+from telegram.error import RetryAfter
+from telegram.ext import Dispatcher
+
+from async_elastic_api import AsyncElasticConnection
+from chat_scheduler import ChatScheduler
+from menu_pages import MenuPages
+from product_cards import ProductCards
+from send_queue import INTERACTIVE, SendQueue
+from tg_bot import (ADDED_TO_CART_TEXT, create_updater, get_cart_message,
+                    get_email_request_message, get_menu_message,
+                    get_page_offset, get_product_message, setup_logging)
+
+logger = logging.getLogger(__file__)
+
+
+class TelegramApiError(Exception):
+    pass
+
+
+# The same methods as the ones of QueuedBot: new messages wait
+# for the limit of their chat, the edits and the deletions only
+# for the global one
+CHAT_LIMITED_METHODS = ('sendMessage', 'sendPhoto', 'sendLocation',
+                        'sendInvoice')
+GLOBAL_LIMITED_METHODS = ('editMessageText', 'editMessageReplyMarkup',
+                          'deleteMessage')
+
+
+class AsyncTelegramBot():
+    """
+    Telegram Bot API client on a pooled aiohttp session.
+    With the send queue the messages go through the same rate limits
+    as the ones of the synchronous bot.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        *,
+        base_url: str = 'https://api.telegram.org',
+        timeout: float = 30,
+        pool_maxsize: int = 100,
+        send_queue: Optional[SendQueue] = None,
+    ):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.send_queue = send_queue
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(
+        self,
+        method: str,
+        request_timeout: Optional[float] = None,
+        **params,
+    ) -> Any:
+        async with self.get_session().post(
+            f'{self.base_url}/bot{self.token}/{method}',
+            json={
+                name: (
+                    value.to_dict() if isinstance(value, TelegramObject)
+                    else value
+                )
+                for name, value in params.items()
+                if value is not None
+            },
+            timeout=aiohttp.ClientTimeout(
+                total=request_timeout or self.timeout,
+            ),
+        ) as response:
+            content = await response.json()
+        if not content.get('ok'):
+            retry_after = content.get('parameters', {}).get('retry_after')
+            if retry_after:
+                raise RetryAfter(retry_after)
+            raise TelegramApiError(content.get('description'))
+        return content['result']
+
+    async def call(
+        self,
+        method: str,
+        request_timeout: Optional[float] = None,
+        priority: int = INTERACTIVE,
+        **params,
+    ) -> Any:
+        is_queued = method in CHAT_LIMITED_METHODS + GLOBAL_LIMITED_METHODS
+        if not self.send_queue or not is_queued:
+            return await self.request(method, request_timeout, **params)
+        chat_id = None
+        if method in CHAT_LIMITED_METHODS:
+            chat_id = params.get('chat_id')
+        loop = asyncio.get_running_loop()
+
+        def send():
+            # The send queue thread waits for the request on the event loop
+            return asyncio.run_coroutine_threadsafe(
+                self.request(method, request_timeout, **params),
+                loop,
+            ).result()
+
+        return await asyncio.wrap_future(
+            self.send_queue.submit(chat_id, send, priority=priority)
+        )
+
+
+def get_chat_id(update: Dict) -> int:
+    if 'message' in update:
+        return update['message']['chat']['id']
+    for update_type in ('callback_query', 'pre_checkout_query'):
+        if update_type in update:
+            return update[update_type]['from']['id']
+    raise ValueError(f'Unsupported update: {update["update_id"]}')
+
+
+class AsyncPipeline():
+    """
+    The states of the menu and the cart (the most frequent ones)
+    are handled by coroutines with async Redis, Elastic and Telegram
+    clients, so one process keeps thousands of conversations in flight.
+    The messages are built by the same functions as the ones of tg_bot,
+    the menu pages and the product cards come from the same caches.
+    The other states (email, payment, delivery) are rare and are passed
+    to the synchronous dispatcher of tg_bot in a thread pool.
+    """
+
+    def __init__(
+        self,
+        bot: AsyncTelegramBot,
+        elastic_connection: AsyncElasticConnection,
+        redis_connection: Redis,
+        menu_pages: MenuPages,
+        product_cards: ProductCards,
+        dispatcher: Optional[Dispatcher] = None,
+        chat_scheduler: Optional[ChatScheduler] = None,
+        sync_workers: int = 8,
+        max_concurrency: int = 1000,
+    ):
+        self.bot = bot
+        self.elastic_connection = elastic_connection
+        self.redis_connection = redis_connection
+        self.menu_pages = menu_pages
+        self.product_cards = product_cards
+        self.dispatcher = dispatcher
+        self.chat_scheduler = chat_scheduler
+        self.executor = ThreadPoolExecutor(
+            max_workers=sync_workers,
+            thread_name_prefix='sync-handlers',
+        )
+        self.max_concurrency = max_concurrency
+        self.chat_locks = {}
+        self.states_functions = {
+            'START': self.start,
+            'HANDLE_MENU': self.handle_menu,
+            'HANDLE_DESCRIPTION': self.handle_description,
+            'HANDLE_CART': self.handle_cart,
+        }
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        await self.bot.close()
+        await self.elastic_connection.close()
+        await self.redis_connection.close()
+
+    async def run_synchronously(self, function: Callable, *args, **kwargs):
+        # The caches are synchronous, a miss waits for Elastic in a thread
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            functools.partial(function, *args, **kwargs),
+        )
+
+    async def get_menu_message(
+        self,
+        page_offset: int = 0,
+        prefetch: bool = False,
+    ) -> Dict:
+        return await self.run_synchronously(
+            get_menu_message,
+            self.menu_pages,
+            page_offset=page_offset,
+            prefetch=prefetch,
+        )
+
+    async def get_cart_message(self, chat_id: int) -> Dict:
+        cart, cart_items = await asyncio.gather(
+            self.elastic_connection.get_cart(cart_id=chat_id),
+            self.elastic_connection.get_cart_items(cart_id=chat_id),
+        )
+        return get_cart_message(cart, cart_items)
+
+    async def send_product_photo(
+        self,
+        chat_id: int,
+        image_id: str,
+        **kwargs,
+    ) -> Dict:
+        file_id = await self.redis_connection.get(f'tg_photo_{image_id}')
+        if file_id:
+            try:
+                return await self.bot.call(
+                    'sendPhoto',
+                    chat_id=chat_id,
+                    photo=file_id,
+                    **kwargs,
+                )
+            except TelegramApiError:
+                await self.redis_connection.delete(f'tg_photo_{image_id}')
+
+        image_link = await self.elastic_connection.get_file_link(image_id)
+        message = await self.bot.call(
+            'sendPhoto',
+            chat_id=chat_id,
+            photo=image_link,
+            **kwargs,
+        )
+        await self.redis_connection.set(
+            f'tg_photo_{image_id}',
+            message['photo'][-1]['file_id'],
+        )
+        return message
+
+    async def start(self, update: Dict, chat_id: int) -> str:
+        await self.bot.call(
+            'sendMessage',
+            chat_id=chat_id,
+            **await self.get_menu_message(),
+        )
+        return 'HANDLE_MENU'
+
+    async def handle_menu(self, update: Dict, chat_id: int) -> str:
+        query = update.get('callback_query')
+        if not query:
+            return 'HANDLE_MENU'
+        message_id = query['message']['message_id']
+        answering = asyncio.ensure_future(
+            self.bot.call('answerCallbackQuery', callback_query_id=query['id'])
+        )
+        try:
+            if query['data'] == 'Cart':
+                await self.bot.call(
+                    'editMessageText',
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    **await self.get_cart_message(chat_id),
+                )
+                return 'HANDLE_CART'
+
+            page_offset = get_page_offset(query['data'])
+            if page_offset is not None:
+                await self.bot.call(
+                    'editMessageText',
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    **await self.get_menu_message(
+                        page_offset=page_offset,
+                        prefetch=True,
+                    ),
+                )
+                return 'HANDLE_MENU'
+
+            product_card = await self.run_synchronously(
+                self.product_cards.get_card,
+                query['data'],
+            )
+            await self.send_product_photo(
+                chat_id=chat_id,
+                image_id=product_card.image_id,
+                **get_product_message(product_card),
+            )
+            await self.bot.call(
+                'deleteMessage',
+                chat_id=chat_id,
+                message_id=message_id,
+            )
+            return 'HANDLE_DESCRIPTION'
+        finally:
+            await answering
+
+    async def handle_description(self, update: Dict, chat_id: int) -> str:
+        query = update.get('callback_query')
+        if not query:
+            return 'HANDLE_DESCRIPTION'
+        message_id = query['message']['message_id']
+
+        if query['data'] not in ('Back', 'Cart'):
+            await self.elastic_connection.add_product_to_cart(
+                cart_id=chat_id,
+                product_id=query['data'],
+                quantity=1,
+            )
+            await self.bot.call(
+                'answerCallbackQuery',
+                callback_query_id=query['id'],
+                text=ADDED_TO_CART_TEXT,
+            )
+            return 'HANDLE_DESCRIPTION'
+
+        answering = asyncio.ensure_future(
+            self.bot.call('answerCallbackQuery', callback_query_id=query['id'])
+        )
+        try:
+            if query['data'] == 'Back':
+                message = await self.get_menu_message()
+                next_state = 'HANDLE_MENU'
+            else:
+                message = await self.get_cart_message(chat_id)
+                next_state = 'HANDLE_CART'
+            await self.bot.call('sendMessage', chat_id=chat_id, **message)
+            await self.bot.call(
+                'deleteMessage',
+                chat_id=chat_id,
+                message_id=message_id,
+            )
+            return next_state
+        finally:
+            await answering
+
+    async def handle_cart(self, update: Dict, chat_id: int) -> str:
+        query = update.get('callback_query')
+        if not query:
+            return 'HANDLE_CART'
+        message_id = query['message']['message_id']
+        answering = asyncio.ensure_future(
+            self.bot.call('answerCallbackQuery', callback_query_id=query['id'])
+        )
+        try:
+            if query['data'] == 'To menu':
+                await self.bot.call(
+                    'editMessageText',
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    **await self.get_menu_message(),
+                )
+                return 'HANDLE_MENU'
+
+            if query['data'] == 'Order':
+                await self.bot.call(
+                    'editMessageText',
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    **get_email_request_message(),
+                )
+                return 'WAITING_EMAIL'
+
+            await self.elastic_connection.remove_cart_item(
+                cart_id=chat_id,
+                item_id=query['data'],
+            )
+            await self.bot.call(
+                'editMessageText',
+                chat_id=chat_id,
+                message_id=message_id,
+                **await self.get_cart_message(chat_id),
+            )
+            return 'HANDLE_CART'
+        finally:
+            await answering
+
+    async def handle_update(self, update: Dict) -> None:
+        chat_id = get_chat_id(update)
+        redis_customer_id = f'pizza_shop_{chat_id}'
+        message_text = update.get('message', {}).get('text')
+        if message_text == '/start':
+            user_state = 'START'
+        else:
+            user_state = await self.redis_connection.get(redis_customer_id)
+        if not user_state:
+            user_state = 'START'
+
+        state_function = self.states_functions.get(user_state)
+        if not state_function:
+            await self.handle_update_synchronously(update)
+            return
+        next_state = await state_function(update, chat_id)
+        await self.redis_connection.set(redis_customer_id, next_state)
+
+    async def handle_update_synchronously(self, update: Dict) -> None:
+        if not self.dispatcher:
+            logger.warning(
+                'The update %s has no async handler',
+                update['update_id'],
+            )
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            self.dispatcher.process_update,
+            Update.de_json(update, self.dispatcher.bot),
+        )
+        if self.chat_scheduler:
+            # The dispatcher only queues the handler to the chat scheduler,
+            # the next task of the chat starts after the handler is done
+            await asyncio.wrap_future(
+                self.chat_scheduler.submit(get_chat_id(update), lambda: None)
+            )
+
+    async def handle_update_safely(
+        self,
+        update: Dict,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        # The updates of one chat wait for each other (asyncio.Lock
+        # wakes the waiters in order), the other chats go in parallel
+        try:
+            chat_id = get_chat_id(update)
+        except ValueError:
+            logger.warning('The update %s is skipped', update['update_id'])
+            semaphore.release()
+            return
+        chat_lock, chat_updates = self.chat_locks.get(
+            chat_id,
+            (asyncio.Lock(), 0),
+        )
+        self.chat_locks[chat_id] = (chat_lock, chat_updates + 1)
+        try:
+            async with chat_lock:
+                await self.handle_update(update)
+        except Exception:
+            logger.exception('The update %s is not handled', update)
+        finally:
+            chat_lock, chat_updates = self.chat_locks[chat_id]
+            if chat_updates == 1:
+                del self.chat_locks[chat_id]
+            else:
+                self.chat_locks[chat_id] = (chat_lock, chat_updates - 1)
+            semaphore.release()
+
+    async def run_polling(self, polling_timeout: int = 30) -> None:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = set()
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.call(
+                    'getUpdates',
+                    request_timeout=polling_timeout + 10,
+                    offset=offset,
+                    timeout=polling_timeout,
+                )
+            except RetryAfter as error:
+                logger.warning('Flood wait %s s for the updates',
+                               error.retry_after)
+                await asyncio.sleep(error.retry_after)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    TelegramApiError):
+                logger.exception('The updates are not received')
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update['update_id'] + 1
+                await semaphore.acquire()
+                task = asyncio.create_task(
+                    self.handle_update_safely(update, semaphore)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+
+async def run_bot(env: Env) -> None:
+    updater, close_bot = create_updater(env)
+    updater.job_queue.start()
+    with env.prefixed('REDIS_'):
+        redis_connection = Redis(
+            host=env('HOST'),
+            port=env('PORT'),
+            password=env('PASSWORD'),
+            decode_responses=True
+        )
+    bot_data = updater.dispatcher.bot_data
+    with env.prefixed('ELASTIC_'):
+        elastic_connection = AsyncElasticConnection(
+            client_id=env('PATH_CLIENT_ID'),
+            client_secret=env('PATH_CLIENT_SECRET'),
+            timeout=env.float('TIMEOUT', 30),
+            pool_maxsize=env.int('POOL_MAXSIZE', 100),
+            sync_connection=bot_data['elastic_connection'],
+        )
+    bot = AsyncTelegramBot(
+        env('PIZZA_BOT_TOKEN'),
+        send_queue=bot_data['send_queue'],
+    )
+    with env.prefixed('ASYNC_'):
+        pipeline = AsyncPipeline(
+            bot=bot,
+            elastic_connection=elastic_connection,
+            redis_connection=redis_connection,
+            menu_pages=bot_data['menu_pages'],
+            product_cards=bot_data['product_cards'],
+            dispatcher=updater.dispatcher,
+            chat_scheduler=bot_data['chat_scheduler'],
+            sync_workers=env.int('SYNC_WORKERS', 8),
+            max_concurrency=env.int('MAX_CONCURRENCY', 1000),
+        )
+    try:
+        await pipeline.run_polling()
+    finally:
+        updater.job_queue.stop()
+        # The send queue waits for the requests on the event loop,
+        # so it is drained in a thread before the session is closed
+        await asyncio.get_running_loop().run_in_executor(None, close_bot)
+        await pipeline.close()
+
+
+def main():
+    env = Env()
+    env.read_env()
+    setup_logging(env)
+    try:
+        asyncio.run(run_bot(env))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import queue
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from telegram import Bot, Update
+from telegram.ext import CallbackQueryHandler, Dispatcher
+
+from async_elastic_api import AsyncElasticConnection
+from async_tg_bot import AsyncPipeline, AsyncTelegramBot
+from bench_elastic_pool import print_latencies
+from elastic_api import ElasticConnection
+from menu_pages import MenuPages
+from tg_bot import handle_users_reply
+
+BOT_TOKEN = '123456:stand-in-token'
+
+
+async def answer_as_elastic(request):
+    if request.path.startswith('/oauth/'):
+        return web.json_response(
+            {
+                'access_token': 'stand-in-token',
+                'expires': time.time() + 3600,
+            }
+        )
+    await asyncio.sleep(request.app['elastic_latency'])
+    products = [
+        {'id': f'product-{number}', 'attributes': {'name': 'Пицца'}}
+        for number in range(8)
+    ]
+    return web.json_response(
+        {'data': products, 'meta': {'results': {'total': 20}}}
+    )
+
+
+async def answer_as_telegram(request):
+    await request.read()
+    await asyncio.sleep(request.app['telegram_latency'])
+    result = True
+    if request.match_info['method'] != 'answerCallbackQuery':
+        result = {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'menu',
+        }
+    return web.json_response({'ok': True, 'result': result})
+
+
+def run_stand_in_server(sock, elastic_latency, telegram_latency):
+    """
+    Answers as the Elastic store and the Telegram Bot API
+    with the given latencies. The server has its own process,
+    so it does not compete with the measured handlers for the GIL.
+    """
+    app = web.Application()
+    app['elastic_latency'] = elastic_latency
+    app['telegram_latency'] = telegram_latency
+    app.router.add_post('/bot{token}/{method}', answer_as_telegram)
+    app.router.add_route('*', '/{path:.*}', answer_as_elastic)
+    web.run_app(app, sock=sock, print=None, access_log=None)
+
+
+def generate_updates(chats_number, taps_number):
+    return [
+        {
+            'update_id': tap * chats_number + chat_id,
+            'callback_query': {
+                'id': str(tap * chats_number + chat_id),
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'A'},
+                'chat_instance': str(chat_id),
+                'data': 'pagination: 8',
+                'message': {
+                    'message_id': 1,
+                    'date': 0,
+                    'chat': {'id': chat_id, 'type': 'private'},
+                },
+            },
+        }
+        for tap in range(taps_number)
+        for chat_id in range(1, chats_number + 1)
+    ]
+
+
+def reset_states(redis_connection, chats_number):
+    redis_connection.mset(
+        {
+            f'pizza_shop_{chat_id}': 'HANDLE_MENU'
+            for chat_id in range(1, chats_number + 1)
+        }
+    )
+
+
+def run_sync(base_url, redis_url, updates, workers):
+    """
+    The tg_bot handlers on a pool of threads,
+    the dispatcher of the bot itself handles the updates one by one.
+    """
+    redis_connection = Redis.from_url(redis_url, decode_responses=True)
+    elastic_connection = ElasticConnection(
+        'client_id',
+        'client_secret',
+        base_url=base_url,
+        pool_maxsize=workers,
+    )
+    bot = Bot(BOT_TOKEN, base_url=f'{base_url}/bot')
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=1)
+    menu_pages = MenuPages(elastic_connection, prefetch_workers=0)
+    dispatcher.add_handler(
+        CallbackQueryHandler(
+            functools.partial(
+                handle_users_reply,
+                redis_connection=redis_connection,
+                elastic_connection=elastic_connection,
+                geocoder=None,
+                order_reminders=None,
+                payment_token='',
+                pizzerias_registry=None,
+                delivery_zones=None,
+                menu_pages=menu_pages,
+                photo_file_ids=None,
+                product_cards=None,
+            )
+        )
+    )
+    latencies = []
+
+    def handle(update):
+        started_at = time.perf_counter()
+        dispatcher.process_update(Update.de_json(update, bot))
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(handle, updates))
+    elapsed_time = time.perf_counter() - started_at
+    elastic_connection.close()
+    redis_connection.close()
+    return elapsed_time, latencies
+
+
+async def run_async(base_url, redis_url, updates, concurrency):
+    elastic_connection = ElasticConnection(
+        'client_id',
+        'client_secret',
+        base_url=base_url,
+    )
+    pipeline = AsyncPipeline(
+        bot=AsyncTelegramBot(BOT_TOKEN, base_url=base_url),
+        elastic_connection=AsyncElasticConnection(
+            'client_id',
+            'client_secret',
+            base_url=base_url,
+        ),
+        redis_connection=AsyncRedis.from_url(
+            redis_url,
+            decode_responses=True,
+        ),
+        menu_pages=MenuPages(elastic_connection, prefetch_workers=0),
+        product_cards=None,
+        max_concurrency=concurrency,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def handle(update):
+        async with semaphore:
+            started_at = time.perf_counter()
+            await pipeline.handle_update(update)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(handle(update) for update in updates))
+    elapsed_time = time.perf_counter() - started_at
+    await pipeline.close()
+    elastic_connection.close()
+    return elapsed_time, latencies
+
+
+def create_parser():
+    description = (
+        'The script is a load test of the menu pagination taps: '
+        'the synchronous tg_bot handlers on a pool of threads '
+        'against the asyncio pipeline. The Elastic store and Telegram '
+        'are simulated by a local server with the given latencies, '
+        'the states are kept in Redis.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--redis_url',
+        metavar='{redis url}',
+        help='Redis for the states, default: redis://localhost:6379/0',
+        default='redis://localhost:6379/0',
+    )
+    parser.add_argument(
+        '--chats',
+        type=int,
+        metavar='{chats number}',
+        help='number of chats, default: 500',
+        default=500,
+    )
+    parser.add_argument(
+        '--taps',
+        type=int,
+        metavar='{taps number}',
+        help='number of taps in every chat, default: 2',
+        default=2,
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        metavar='{threads number}',
+        help='threads of the synchronous handlers, default: 1 4 16',
+        default=[1, 4, 16],
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        nargs='+',
+        metavar='{updates number}',
+        help='updates in flight of the asyncio pipeline, default: 100 1000',
+        default=[100, 1000],
+    )
+    parser.add_argument(
+        '--elastic_latency',
+        type=float,
+        metavar='{seconds}',
+        help='latency of the Elastic store, default: 0.05',
+        default=0.05,
+    )
+    parser.add_argument(
+        '--telegram_latency',
+        type=float,
+        metavar='{seconds}',
+        help='latency of Telegram, default: 0.03',
+        default=0.03,
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1024)
+    server_process = multiprocessing.Process(
+        target=run_stand_in_server,
+        args=(sock, args.elastic_latency, args.telegram_latency),
+        daemon=True,
+    )
+    server_process.start()
+    host, port = sock.getsockname()
+    base_url = f'http://{host}:{port}'
+
+    redis_connection = Redis.from_url(args.redis_url, decode_responses=True)
+    updates = generate_updates(args.chats, args.taps)
+    print(f'{len(updates)} taps from {args.chats} chats')
+    for workers in args.workers:
+        reset_states(redis_connection, args.chats)
+        elapsed_time, latencies = run_sync(
+            base_url,
+            args.redis_url,
+            updates,
+            workers,
+        )
+        print_latencies(
+            f'sync, {workers} threads: {len(updates) / elapsed_time:.0f}/s',
+            latencies,
+        )
+    for concurrency in args.concurrency:
+        reset_states(redis_connection, args.chats)
+        elapsed_time, latencies = asyncio.run(
+            run_async(base_url, args.redis_url, updates, concurrency)
+        )
+        print_latencies(
+            f'async, {concurrency} in flight: '
+            f'{len(updates) / elapsed_time:.0f}/s',
+            latencies,
+        )
+    server_process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from delivery_zones import DeliveryZone, DeliveryZones
+
+
+def generate_zones(zones_number):
+    zones = []
+    for zone_number in range(zones_number):
+        center_latitude = 55.75 + random.uniform(-0.5, 0.5)
+        center_longitude = 37.62 + random.uniform(-0.8, 0.8)
+        radius = random.uniform(0.005, 0.03)
+        vertices_number = random.randint(8, 40)
+        ring = [
+            (
+                center_longitude + radius * 1.8 * math.cos(angle)
+                * random.uniform(0.6, 1),
+                center_latitude + radius * math.sin(angle)
+                * random.uniform(0.6, 1),
+            )
+            for angle in np.linspace(0, 2 * math.pi, vertices_number, False)
+        ]
+        ring.append(ring[0])
+        zones.append(
+            DeliveryZone(
+                name=f'Zone {zone_number}',
+                pizzeria_alias=f'Pizzeria {zone_number % 100}',
+                fee=random.choice([0, 100, 200, 300]),
+                rings=[np.array(ring)],
+            )
+        )
+    return zones
+
+
+def find_linearly(zones, latitude, longitude):
+    found_zones = [
+        zone for zone in zones
+        if zone.contains(longitude, latitude)
+    ]
+    found_zones.sort(key=lambda zone: zone.fee)
+    return found_zones
+
+
+def create_parser():
+    description = (
+        'The script compares the R-tree of the delivery zones '
+        'with the point-in-polygon test of every zone on random zones.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        metavar='{zones number}',
+        help='numbers of zones, default: 1000 10000 50000',
+        default=[1000, 10000, 50000],
+    )
+    parser.add_argument(
+        '--points',
+        type=int,
+        metavar='{points number}',
+        help='number of random points to look up, default: 1000',
+        default=1000,
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    random.seed(0)
+    points = [
+        (
+            55.75 + random.uniform(-0.5, 0.5),
+            37.62 + random.uniform(-0.8, 0.8),
+        )
+        for _ in range(args.points)
+    ]
+
+    print(
+        f'{"zones":>8} {"build":>9} {"r-tree":>11} {"linear":>12} '
+        f'{"speedup":>9} {"zones per point":>16}'
+    )
+    for zones_number in args.sizes:
+        zones = generate_zones(zones_number)
+        started_at = time.perf_counter()
+        delivery_zones = DeliveryZones(zones)
+        build_time = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        found_zones = [
+            delivery_zones.find(latitude, longitude)
+            for latitude, longitude in points
+        ]
+        rtree_time = (time.perf_counter() - started_at) / len(points)
+
+        linear_points = points[:max(1, 100000 // zones_number)]
+        started_at = time.perf_counter()
+        linearly_found_zones = [
+            find_linearly(zones, latitude, longitude)
+            for latitude, longitude in linear_points
+        ]
+        linear_time = (time.perf_counter() - started_at) / len(linear_points)
+
+        for rtree_zones, linear_zones in zip(
+            found_zones,
+            linearly_found_zones,
+        ):
+            assert {id(zone) for zone in rtree_zones} == {
+                id(zone) for zone in linear_zones
+            }
+        zones_per_point = sum(map(len, found_zones)) / len(points)
+        print(
+            f'{zones_number:>8} {build_time:>7.2f} s '
+            f'{rtree_time * 1000000:>8.1f} µs '
+            f'{linear_time * 1000:>9.2f} ms '
+            f'{linear_time / rtree_time:>8.0f}x '
+            f'{zones_per_point:>16.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import random
+import time
+
+import numpy as np
+from geopy.distance import distance
+
+from geo_distances import PizzeriasArray
+
+
+def generate_pizzerias(pizzerias_number):
+    return [
+        {
+            'latitude': 55.75 + random.uniform(-0.5, 0.5),
+            'longitude': 37.62 + random.uniform(-0.8, 0.8),
+        }
+        for _ in range(pizzerias_number)
+    ]
+
+
+def measure_geopy_loop(pizzerias, latitude, longitude):
+    started_at = time.perf_counter()
+    distances = [
+        distance(
+            (latitude, longitude),
+            (pizzeria['latitude'], pizzeria['longitude'])
+        ).km
+        for pizzeria in pizzerias
+    ]
+    return time.perf_counter() - started_at, np.array(distances)
+
+
+def measure(call, repeats):
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        result = call()
+    return (time.perf_counter() - started_at) / repeats, result
+
+
+def create_parser():
+    description = (
+        'The script compares the geopy loop that computes the distances '
+        'from a customer to all the pizzerias with the vectorized NumPy '
+        'distances on random pizzerias.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        metavar='{pizzerias number}',
+        help='numbers of pizzerias, default: 100 10000 100000',
+        default=[100, 10000, 100000],
+    )
+    parser.add_argument(
+        '--customers',
+        type=int,
+        metavar='{customers number}',
+        help=(
+            'number of customers for the many-to-many distances, '
+            'default: 1000'
+        ),
+        default=1000,
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    random.seed(0)
+    latitude, longitude = 55.7, 37.5
+    customers = generate_pizzerias(args.customers)
+    customers_latitudes = [customer['latitude'] for customer in customers]
+    customers_longitudes = [customer['longitude'] for customer in customers]
+
+    print(
+        f'{"pizzerias":>10} {"geopy loop":>12} {"lambert":>12} '
+        f'{"haversine":>12} {"speedup":>9} {"max error":>10} '
+        f'{"matrix":>14}'
+    )
+    for pizzerias_number in args.sizes:
+        pizzerias = generate_pizzerias(pizzerias_number)
+        pizzerias_array = PizzeriasArray(pizzerias)
+        geopy_time, geopy_distances = measure_geopy_loop(
+            pizzerias,
+            latitude,
+            longitude,
+        )
+        repeats = max(1, 1000000 // pizzerias_number)
+        lambert_time, lambert_distances = measure(
+            lambda: pizzerias_array.get_distances_km(latitude, longitude),
+            repeats,
+        )
+        haversine_time, _ = measure(
+            lambda: pizzerias_array.get_distances_km(
+                latitude,
+                longitude,
+                ellipsoidal=False,
+            ),
+            repeats,
+        )
+        max_error_km = np.max(np.abs(lambert_distances - geopy_distances))
+        started_at = time.perf_counter()
+        for _ in pizzerias_array.get_distances_matrix_km(
+            customers_latitudes,
+            customers_longitudes,
+        ):
+            pass
+        matrix_time = time.perf_counter() - started_at
+        print(
+            f'{pizzerias_number:>10} {geopy_time * 1000:>9.2f} ms '
+            f'{lambert_time * 1000:>9.3f} ms '
+            f'{haversine_time * 1000:>9.3f} ms '
+            f'{geopy_time / lambert_time:>8.0f}x '
+            f'{max_error_km * 1000:>8.2f} m '
+            f'{matrix_time:>11.2f} s'
+        )
+    print(
+        f'matrix - the distances from {args.customers} customers '
+        'to all the pizzerias (lambert)'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from elastic_api import ElasticConnection
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_json({'data': [], 'meta': {'results': {'total': 0}}})
+
+    def do_POST(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(content_length)
+        self.send_json(
+            {
+                'access_token': 'stand-in-token',
+                'expires': time.time() + 3600,
+            }
+        )
+
+    def send_json(self, content):
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'http://{host}:{port}'
+
+
+def measure(call, calls_number):
+    latencies = []
+    for _ in range(calls_number):
+        started_at = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return latencies
+
+
+def print_latencies(title, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f'{title:<28} mean {statistics.mean(latencies):7.3f} ms   '
+        f'median {statistics.median(latencies):7.3f} ms   '
+        f'p95 {p95:7.3f} ms'
+    )
+
+
+def create_parser():
+    description = (
+        'The script compares the latency of the Elastic API calls '
+        'with a fresh connection per call and with the pooled session. '
+        'The calls are made against a local stand-in server '
+        'unless the base URL is provided.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--calls',
+        type=int,
+        metavar='{calls number}',
+        help='number of calls in each mode, default: 500',
+        default=500,
+    )
+    parser.add_argument(
+        '--base_url',
+        metavar='{base URL}',
+        help='URL of the server to call, default: a local stand-in server',
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_stand_in_server()
+
+    with ElasticConnection(
+        client_id='stand-in',
+        client_secret='stand-in',
+        base_url=base_url,
+    ) as elastic_connection:
+        elastic_connection.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {elastic_connection.access_token}',
+        }
+
+        def call_without_pool():
+            response = requests.get(
+                f'{base_url}/pcm/products/',
+                headers=headers,
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        print(f'{args.calls} calls of get_products against {base_url}')
+        print_latencies(
+            'Fresh connection per call',
+            measure(call_without_pool, args.calls),
+        )
+        print_latencies(
+            'Pooled keep-alive session',
+            measure(elastic_connection.get_products, args.calls),
+        )
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class CatalogCache():
+    """
+    LRU cache of the catalog reads.
+    The entries are valid while the latest catalog release stays the same.
+    The release id is checked at most once in release_check_interval seconds,
+    a new release clears the cache.
+    The cached responses are shared, the callers must not modify them.
+    """
+
+    def __init__(
+        self,
+        fetch_release_id: Callable[[], str],
+        maxsize: int = 1024,
+        release_check_interval: float = 60,
+    ):
+        self.fetch_release_id = fetch_release_id
+        self.maxsize = maxsize
+        self.release_check_interval = release_check_interval
+        self.release_id = None
+        self.release_checked_at = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.release_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_release_id(self) -> str:
+        if time.monotonic() - self.release_checked_at < (
+            self.release_check_interval
+        ):
+            return self.release_id
+
+        with self.release_lock:
+            # Another thread could check the release while this one waited
+            if time.monotonic() - self.release_checked_at < (
+                self.release_check_interval
+            ):
+                return self.release_id
+            release_id = self.fetch_release_id()
+            with self.lock:
+                if release_id != self.release_id:
+                    if self.entries:
+                        self.invalidations += 1
+                    self.entries.clear()
+                    self.release_id = release_id
+                self.release_checked_at = time.monotonic()
+        return release_id
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        release_id = self.get_release_id()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        value = fetch()
+
+        with self.lock:
+            if release_id != self.release_id:
+                return value
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.release_checked_at = 0
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'release_id': self.release_id,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def create_expiring_cache(
+    maxsize: int = 1024,
+    ttl: float = 60,
+) -> CatalogCache:
+    """
+    The cache for the callers that do not follow the catalog releases:
+    all the entries are dropped every ttl seconds.
+    """
+    return CatalogCache(
+        fetch_release_id=lambda: int(time.time() // ttl),
+        maxsize=maxsize,
+        release_check_interval=min(ttl, 1),
+    )
@@ -0,0 +1,132 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+from redis import Redis
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__file__)
+
+
+class ChatScheduler():
+    """
+    Runs the tasks of one chat one by one in the order of submission,
+    the tasks of different chats run in parallel on the worker pool.
+    A chat takes a worker for one task at a time, then it goes
+    to the end of the pool queue, so a busy chat does not starve others.
+    With a Redis connection every task also holds a Redis lock of the chat,
+    so the tasks of one chat never run at the same time in different
+    processes. The lock is not fair: the waiting processes take it
+    in any order, so only the tasks of one process keep their order.
+    To keep the order of all the updates of a chat, route the chat
+    to one process (tg_shards.py).
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        redis_connection: Optional[Redis] = None,
+        lock_timeout: float = 60,
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='chat-scheduler',
+        )
+        self.redis_connection = redis_connection
+        self.lock_timeout = lock_timeout
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        # The running chats submit their next tasks to the pool,
+        # so the pool is shut down after the queues are drained
+        with self.idle:
+            self.idle.wait_for(lambda: not self.queues, timeout=timeout)
+        self.executor.shutdown(wait=True)
+
+    def submit(
+        self,
+        chat_id: Hashable,
+        function: Callable,
+        *args,
+        **kwargs,
+    ) -> Future:
+        future = Future()
+        with self.lock:
+            self.submitted += 1
+            chat_queue = self.queues.get(chat_id)
+            is_idle = chat_queue is None
+            if is_idle:
+                chat_queue = self.queues[chat_id] = deque()
+            chat_queue.append((future, function, args, kwargs))
+        if is_idle:
+            self.executor.submit(self.run_next, chat_id)
+        return future
+
+    def run_next(self, chat_id: Hashable) -> None:
+        with self.lock:
+            future, function, args, kwargs = self.queues[chat_id].popleft()
+
+        if future.set_running_or_notify_cancel():
+            try:
+                result = self.run_locked(chat_id, function, args, kwargs)
+            except Exception as error:
+                logger.exception('The task of the chat %s failed', chat_id)
+                future.set_exception(error)
+                with self.lock:
+                    self.failed += 1
+            else:
+                future.set_result(result)
+                with self.lock:
+                    self.completed += 1
+
+        with self.lock:
+            if not self.queues[chat_id]:
+                del self.queues[chat_id]
+                if not self.queues:
+                    self.idle.notify_all()
+                return
+        self.executor.submit(self.run_next, chat_id)
+
+    def run_locked(
+        self,
+        chat_id: Hashable,
+        function: Callable,
+        args: tuple,
+        kwargs: dict,
+    ):
+        if not self.redis_connection:
+            return function(*args, **kwargs)
+        lock = self.redis_connection.lock(
+            f'pizza_shop_lock_{chat_id}',
+            timeout=self.lock_timeout,
+        )
+        lock.acquire()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # The task is done anyway, but it outlived the lock,
+                # so another process could handle the chat meanwhile
+                logger.warning(
+                    'The lock of the chat %s expired before the task ended',
+                    chat_id,
+                )
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'busy_chats': len(self.queues),
+                'queued_tasks': sum(map(len, self.queues.values())),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
@@ -0,0 +1,337 @@
+import argparse
+import bisect
+import math
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from environs import Env
+
+from elastic_api import ElasticConnection
+from geo_distances import (DELIVERY_TIERS_KM, PizzeriasArray,
+                           get_delivery_tiers, get_distance_km)
+from pizzerias_index import fetch_pizzerias, get_pizzerias_fingerprint
+
+KM_PER_DEGREE = 111.32
+# Covers the difference between the ellipsoidal and the spherical
+# cell sizes and the error of Lambert's formula
+CELL_SIZE_ERROR = 1.01
+UNKNOWN_TIER = -1
+# About 60 MB of the grid arrays, the default cell size gives
+# this many cells for the pizzerias spread over 1000 x 1000 km
+MAX_CELLS = 4000000
+
+
+def get_delivery_tier(distance_km: float) -> int:
+    """
+    0 - up to 0.5 km, 1 - up to 5 km, 2 - up to 20 km, 3 - no delivery.
+    """
+    return bisect.bisect_left(DELIVERY_TIERS_KM, distance_km)
+
+
+class DeliveryGrid():
+    """
+    The service area tiled into cells. For every cell the grid keeps
+    the pizzerias that can be the nearest ones for a point in the cell
+    and the delivery tier if it is the same for the whole cell.
+    """
+
+    def __init__(
+        self,
+        pizzerias: List[Dict],
+        fingerprint: str,
+        origin: Tuple[float, float],
+        steps: Tuple[float, float],
+        shape: Tuple[int, int],
+        offsets: np.ndarray,
+        candidates: np.ndarray,
+        tiers: np.ndarray,
+    ):
+        self.pizzerias = pizzerias
+        self.fingerprint = fingerprint
+        self.origin_latitude, self.origin_longitude = origin
+        self.latitude_step, self.longitude_step = steps
+        self.rows, self.columns = shape
+        self.offsets = offsets
+        self.candidates = candidates
+        self.tiers = tiers
+
+    @classmethod
+    def build(
+        cls,
+        pizzerias: List[Dict],
+        cell_size_km: float = 0.5,
+        margin_km: float = DELIVERY_TIERS_KM[-1],
+        chunk_size: int = 1024,
+        max_cells: int = MAX_CELLS,
+    ) -> 'DeliveryGrid':
+        """
+        Raises ValueError if there are no pizzerias or the grid
+        would have more than max_cells cells.
+        """
+        if not pizzerias:
+            raise ValueError('There are no pizzerias to build the grid')
+        pizzerias_array = PizzeriasArray(pizzerias)
+        latitudes = np.degrees(pizzerias_array.latitudes)
+        longitudes = np.degrees(pizzerias_array.longitudes)
+        middle_latitude = math.radians(float(np.mean(latitudes)))
+
+        latitude_step = cell_size_km / KM_PER_DEGREE
+        longitude_step = cell_size_km / (
+            KM_PER_DEGREE * math.cos(middle_latitude)
+        )
+        latitude_margin = margin_km / KM_PER_DEGREE
+        origin_latitude = float(latitudes.min()) - latitude_margin
+        max_latitude = float(latitudes.max()) + latitude_margin
+        # The cells are the widest at the latitude nearest to the equator
+        # and the narrowest at the farthest one
+        widest_latitude = 0
+        if origin_latitude * max_latitude > 0:
+            widest_latitude = min(abs(origin_latitude), abs(max_latitude))
+        narrowest_latitude = max(abs(origin_latitude), abs(max_latitude))
+        longitude_margin = margin_km / (
+            KM_PER_DEGREE * math.cos(math.radians(narrowest_latitude))
+        )
+        origin_longitude = float(longitudes.min()) - longitude_margin
+        max_longitude = float(longitudes.max()) + longitude_margin
+        rows = math.ceil((max_latitude - origin_latitude) / latitude_step)
+        columns = math.ceil(
+            (max_longitude - origin_longitude) / longitude_step
+        )
+        if rows * columns > max_cells:
+            raise ValueError(
+                f'The grid of {rows} x {columns} cells is larger than '
+                f'{max_cells} cells, increase the cell size'
+            )
+        half_diagonal_km = CELL_SIZE_ERROR * math.hypot(
+            latitude_step * KM_PER_DEGREE,
+            longitude_step * KM_PER_DEGREE
+            * math.cos(math.radians(widest_latitude)),
+        ) / 2
+
+        centers_latitudes = (
+            origin_latitude + (np.arange(rows) + 0.5) * latitude_step
+        )
+        centers_longitudes = (
+            origin_longitude + (np.arange(columns) + 0.5) * longitude_step
+        )
+        centers_latitudes, centers_longitudes = np.meshgrid(
+            centers_latitudes,
+            centers_longitudes,
+            indexing='ij',
+        )
+
+        counts = []
+        candidates = []
+        tiers = []
+        for distances in pizzerias_array.get_distances_matrix_km(
+            centers_latitudes.ravel(),
+            centers_longitudes.ravel(),
+            chunk_size=chunk_size,
+        ):
+            nearest_distances = distances.min(axis=1)
+            # Any pizzeria that is the nearest one for a point in the cell
+            # is within this distance from the center of the cell
+            is_candidate = distances <= (
+                nearest_distances + 2 * half_diagonal_km
+            )[:, None]
+            counts.append(is_candidate.sum(axis=1))
+            candidates.append(np.nonzero(is_candidate)[1])
+
+            nearest_tiers = get_delivery_tiers(
+                np.maximum(nearest_distances - half_diagonal_km, 0)
+            )
+            farthest_tiers = get_delivery_tiers(
+                nearest_distances + half_diagonal_km
+            )
+            tiers.append(
+                np.where(
+                    nearest_tiers == farthest_tiers,
+                    nearest_tiers,
+                    UNKNOWN_TIER,
+                )
+            )
+
+        offsets = np.zeros(rows * columns + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(counts), out=offsets[1:])
+        return cls(
+            pizzerias=pizzerias,
+            fingerprint=get_pizzerias_fingerprint(pizzerias),
+            origin=(origin_latitude, origin_longitude),
+            steps=(latitude_step, longitude_step),
+            shape=(rows, columns),
+            offsets=offsets,
+            candidates=np.concatenate(candidates).astype(np.int32),
+            tiers=np.concatenate(tiers).astype(np.int8),
+        )
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            fingerprint=np.array(self.fingerprint),
+            origin=np.array([self.origin_latitude, self.origin_longitude]),
+            steps=np.array([self.latitude_step, self.longitude_step]),
+            shape=np.array([self.rows, self.columns]),
+            offsets=self.offsets,
+            candidates=self.candidates,
+            tiers=self.tiers,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        pizzerias: List[Dict],
+    ) -> Optional['DeliveryGrid']:
+        """
+        Returns None if the grid was built for other pizzerias.
+        """
+        with np.load(path) as grid_file:
+            fingerprint = str(grid_file['fingerprint'])
+            if fingerprint != get_pizzerias_fingerprint(pizzerias):
+                return None
+            return cls(
+                pizzerias=pizzerias,
+                fingerprint=fingerprint,
+                origin=tuple(grid_file['origin']),
+                steps=tuple(grid_file['steps']),
+                shape=tuple(int(size) for size in grid_file['shape']),
+                offsets=grid_file['offsets'],
+                candidates=grid_file['candidates'],
+                tiers=grid_file['tiers'],
+            )
+
+    def get_memory_size(self) -> int:
+        return self.offsets.nbytes + self.candidates.nbytes + self.tiers.nbytes
+
+    def resolve(
+        self,
+        latitude: float,
+        longitude: float,
+    ) -> Optional[Tuple[float, Dict, int]]:
+        """
+        Returns the distance in km (Lambert's formula)
+        to the nearest pizzeria,
+        the pizzeria and the delivery tier,
+        or None if the point is outside the grid.
+        """
+        row = int((latitude - self.origin_latitude) // self.latitude_step)
+        column = int(
+            (longitude - self.origin_longitude) // self.longitude_step
+        )
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            return None
+        cell = row * self.columns + column
+        start = int(self.offsets[cell])
+        end = int(self.offsets[cell + 1])
+
+        nearest_distance_km = nearest_pizzeria = None
+        for index in self.candidates[start:end].tolist():
+            pizzeria = self.pizzerias[index]
+            distance_km = get_distance_km(
+                latitude,
+                longitude,
+                float(pizzeria['latitude']),
+                float(pizzeria['longitude']),
+            )
+            if (
+                nearest_distance_km is None
+                or distance_km < nearest_distance_km
+            ):
+                nearest_distance_km = distance_km
+                nearest_pizzeria = pizzeria
+
+        tier = int(self.tiers[cell])
+        if tier == UNKNOWN_TIER:
+            tier = get_delivery_tier(nearest_distance_km)
+        return nearest_distance_km, nearest_pizzeria, tier
+
+
+def create_parser():
+    description = (
+        'The script builds the delivery grid for the pizzerias '
+        'of the Elastic store and saves it to a file.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--output',
+        metavar='{file path}',
+        help='path to the grid file, default: upload/delivery_grid.npz',
+        default='upload/delivery_grid.npz',
+    )
+    parser.add_argument(
+        '--cell_size',
+        type=float,
+        metavar='{cell size in km}',
+        help='size of a grid cell in km, default: 0.5',
+        default=0.5,
+    )
+    parser.add_argument(
+        '--max_cells',
+        type=int,
+        metavar='{number of cells}',
+        help=f'maximum number of grid cells, default: {MAX_CELLS}',
+        default=MAX_CELLS,
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    env = Env()
+    env.read_env()
+    with env.prefixed('ELASTIC_'):
+        elastic_connection = ElasticConnection(
+            client_id=env('PATH_CLIENT_ID'),
+            client_secret=env('PATH_CLIENT_SECRET'),
+        )
+    pizzerias = fetch_pizzerias(elastic_connection)
+    elastic_connection.close()
+    if not pizzerias:
+        sys.exit('There are no pizzerias with coordinates in the store')
+
+    started_at = time.perf_counter()
+    try:
+        delivery_grid = DeliveryGrid.build(
+            pizzerias=pizzerias,
+            cell_size_km=args.cell_size,
+            max_cells=args.max_cells,
+        )
+    except ValueError as error:
+        sys.exit(str(error))
+    build_time = time.perf_counter() - started_at
+    delivery_grid.save(args.output)
+
+    cells_number = delivery_grid.rows * delivery_grid.columns
+    print(
+        f'{len(pizzerias)} pizzerias, '
+        f'{delivery_grid.rows} x {delivery_grid.columns} cells, '
+        f'{len(delivery_grid.candidates) / cells_number:.2f} candidates '
+        'per cell'
+    )
+    print(
+        f'Built in {build_time:.2f} s, '
+        f'memory: {delivery_grid.get_memory_size() / 1024:.0f} KiB'
+    )
+
+    latitudes = [float(pizzeria['latitude']) for pizzeria in pizzerias]
+    longitudes = [float(pizzeria['longitude']) for pizzeria in pizzerias]
+    points = [
+        (
+            random.uniform(min(latitudes), max(latitudes)),
+            random.uniform(min(longitudes), max(longitudes)),
+        )
+        for _ in range(10000)
+    ]
+    started_at = time.perf_counter()
+    for latitude, longitude in points:
+        delivery_grid.resolve(latitude, longitude)
+    lookup_time = (time.perf_counter() - started_at) / len(points)
+    print(f'Lookup: {lookup_time * 1000000:.1f} µs')
+
+
+if __name__ == '__main__':
+    main()
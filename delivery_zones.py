@@ -0,0 +1,200 @@
+import json
+import math
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+NODE_SIZE = 16
+# NumPy is faster than the loop for the rings with more vertices
+VECTORIZED_RING_SIZE = 100
+
+
+class DeliveryZone():
+    """
+    Polygon or multipolygon (longitude, latitude rings) where
+    the pizzeria delivers for the fee. The point is inside
+    if a ray from it crosses the rings an odd number of times,
+    so the holes are handled as well.
+    """
+
+    __slots__ = ('name', 'pizzeria_alias', 'fee', 'rings', 'box')
+
+    def __init__(
+        self,
+        name: str,
+        pizzeria_alias: str,
+        fee: float,
+        rings: List[np.ndarray],
+    ):
+        self.name = name
+        self.pizzeria_alias = pizzeria_alias
+        self.fee = fee
+        self.rings = rings
+        vertices = np.concatenate(rings)
+        self.box = (
+            *vertices.min(axis=0),
+            *vertices.max(axis=0),
+        )
+
+    def __repr__(self):
+        return (
+            f'DeliveryZone(name={self.name!r}, '
+            f'pizzeria_alias={self.pizzeria_alias!r}, fee={self.fee!r})'
+        )
+
+    def contains(self, longitude: float, latitude: float) -> bool:
+        crossings = 0
+        for ring in self.rings:
+            if len(ring) > VECTORIZED_RING_SIZE:
+                crossings += count_crossings_vectorized(
+                    ring,
+                    longitude,
+                    latitude,
+                )
+                continue
+            vertices = ring.tolist()
+            longitude_1, latitude_1 = vertices[0]
+            for longitude_2, latitude_2 in vertices[1:]:
+                if (latitude_1 > latitude) != (latitude_2 > latitude) and (
+                    longitude < longitude_1 + (latitude - latitude_1)
+                    * (longitude_2 - longitude_1) / (latitude_2 - latitude_1)
+                ):
+                    crossings += 1
+                longitude_1, latitude_1 = longitude_2, latitude_2
+        return crossings % 2 == 1
+
+
+def count_crossings_vectorized(
+    ring: np.ndarray,
+    longitude: float,
+    latitude: float,
+) -> int:
+    longitudes_1, latitudes_1 = ring[:-1, 0], ring[:-1, 1]
+    longitudes_2, latitudes_2 = ring[1:, 0], ring[1:, 1]
+    is_crossed = (latitudes_1 > latitude) != (latitudes_2 > latitude)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing_longitudes = longitudes_1 + (
+            (latitude - latitudes_1)
+            * (longitudes_2 - longitudes_1)
+            / (latitudes_2 - latitudes_1)
+        )
+    return int(
+        np.count_nonzero(is_crossed & (longitude < crossing_longitudes))
+    )
+
+
+def get_rings(geometry: Dict) -> List[np.ndarray]:
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError(f'Unsupported geometry type: {geometry["type"]}')
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            ring = np.array(ring, dtype=np.float64)[:, :2]
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            rings.append(ring)
+    return rings
+
+
+def get_str_order(boxes: np.ndarray, node_size: int) -> np.ndarray:
+    """
+    Sort-Tile-Recursive order: the boxes are sorted by the longitude
+    of the center into vertical slices, then by the latitude
+    inside every slice, so every node_size neighbours are close.
+    """
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    leaves_number = math.ceil(len(boxes) / node_size)
+    slice_size = node_size * max(math.ceil(math.sqrt(leaves_number)), 1)
+    order = np.argsort(centers[:, 0], kind='stable')
+    for start in range(0, len(order), slice_size):
+        slice_order = order[start:start + slice_size]
+        order[start:start + slice_size] = slice_order[
+            np.argsort(centers[slice_order, 1], kind='stable')
+        ]
+    return order
+
+
+class DeliveryZones():
+    """
+    Packed R-tree of the delivery zones bounding boxes.
+    The nodes of every level are groups of NODE_SIZE consecutive
+    boxes of the level below, so the tree is a list of NumPy arrays
+    and a query checks the boxes of the visited nodes at once.
+    The polygons are tested only for the boxes that contain the point.
+    """
+
+    def __init__(self, zones: Sequence[DeliveryZone]):
+        boxes = np.array(
+            [zone.box for zone in zones],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        order = get_str_order(boxes, NODE_SIZE)
+        self.zones = [zones[index] for index in order]
+        self.levels = [boxes[order]]
+        while len(self.levels[-1]) > NODE_SIZE:
+            level = self.levels[-1]
+            starts = np.arange(0, len(level), NODE_SIZE)
+            self.levels.append(
+                np.hstack([
+                    np.minimum.reduceat(level[:, :2], starts),
+                    np.maximum.reduceat(level[:, 2:], starts),
+                ])
+            )
+
+    def __len__(self):
+        return len(self.zones)
+
+    @classmethod
+    def from_geojson(cls, path: str) -> 'DeliveryZones':
+        """
+        Every feature is a zone, the properties are
+        "pizzeria" (alias of the pizzeria), "fee" and optional "name".
+        """
+        with open(path, 'r', encoding='UTF-8') as zones_file:
+            features = json.load(zones_file)['features']
+        return cls(
+            [
+                DeliveryZone(
+                    name=feature['properties'].get(
+                        'name',
+                        feature['properties']['pizzeria'],
+                    ),
+                    pizzeria_alias=feature['properties']['pizzeria'],
+                    fee=feature['properties']['fee'],
+                    rings=get_rings(feature['geometry']),
+                )
+                for feature in features
+            ]
+        )
+
+    def search_boxes(self, longitude: float, latitude: float) -> np.ndarray:
+        nodes = np.arange(len(self.levels[-1]))
+        for level_number in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[level_number][nodes]
+            nodes = nodes[
+                (boxes[:, 0] <= longitude) & (longitude <= boxes[:, 2])
+                & (boxes[:, 1] <= latitude) & (latitude <= boxes[:, 3])
+            ]
+            if not level_number or not len(nodes):
+                break
+            children = (
+                nodes[:, None] * NODE_SIZE + np.arange(NODE_SIZE)
+            ).ravel()
+            nodes = children[children < len(self.levels[level_number - 1])]
+        return nodes
+
+    def find(self, latitude: float, longitude: float) -> List[DeliveryZone]:
+        """
+        Returns the zones that contain the point, the cheapest first.
+        """
+        zones = [
+            self.zones[index]
+            for index in self.search_boxes(longitude, latitude)
+            if self.zones[index].contains(longitude, latitude)
+        ]
+        zones.sort(key=lambda zone: zone.fee)
+        return zones
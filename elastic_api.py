@@ -1,52 +1,404 @@
+import functools
+import inspect
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import requests
+from redis import Redis
+from redis.exceptions import RedisError
+from requests.adapters import HTTPAdapter
+
+from catalog_cache import CatalogCache
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__file__)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+RETRY_STATUS_CODES = {429, 503}
+
+
+def create_session(
+    pool_connections: int = 10,
+    pool_maxsize: int = 10,
+    pool_block: bool = False,
+    keep_alive: bool = True,
+) -> requests.Session:
+    """
+    Creates a session whose connections are reused by all the requests.
+    pool_connections is the number of hosts to keep pools for,
+    pool_maxsize is the number of connections kept per host.
+    If pool_block is set, the callers wait for a free connection
+    instead of opening a throwaway one.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def cached_catalog_read(method):
+    """
+    Serves the method from the catalog cache if the cache is enabled.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.catalog_cache:
+            return method(self, *args, **kwargs)
+        arguments = signature.bind(self, *args, **kwargs).arguments
+        key = (
+            method.__name__,
+            *(value for name, value in arguments.items() if name != 'self'),
+        )
+        return self.catalog_cache.get_or_fetch(
+            key,
+            functools.partial(method, self, *args, **kwargs),
+        )
+
+    return wrapper
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - datetime.now().timestamp(), 0)
+
+
+def get_page_payload(
+    page_limit: Optional[int],
+    page_offset: Optional[int],
+) -> Dict:
+    payload = {}
+    if page_limit is not None:
+        payload['page[limit]'] = page_limit
+    if page_offset is not None:
+        payload['page[offset]'] = page_offset
+    return payload
 
 
 class ElasticConnection():
-    def __init__(self, client_id, client_secret):
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        *,
+        base_url: str = 'https://api.moltin.com',
+        timeout: Union[float, Tuple[float, float]] = 30,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        keep_alive: bool = True,
+        redis_connection: Optional[Redis] = None,
+        access_token_renewal_margin: float = 60,
+        requests_per_second: float = 0,
+        requests_burst: int = 1,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 30,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.access_token = ""
         self.access_token_expiration_timestamp = 0
+        self.access_token_lock = threading.Lock()
+        self.access_token_renewal_margin = access_token_renewal_margin
+        self.access_token_renewal_thread = None
+        self.access_token_renewal_stopped = threading.Event()
+        self.redis_connection = redis_connection
+        self.redis_access_token_key = f'elastic_access_token_{client_id}'
+        self.catalog_cache: Optional[CatalogCache] = None
+        self.rate_limiter = None
+        if requests_per_second:
+            # One bucket is shared by all the threads using the connection
+            self.rate_limiter = TokenBucket(
+                rate=requests_per_second,
+                capacity=requests_burst,
+            )
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.request_stats_lock = threading.Lock()
+        self.request_stats = {
+            'requests': 0,
+            'retries': 0,
+            'throttled_responses': 0,
+            'rate_limit_wait_seconds': 0.0,
+            'retry_wait_seconds': 0.0,
+        }
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = create_session(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            keep_alive=keep_alive,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self.stop_access_token_renewal()
+        self.session.close()
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends the request within the rate limit.
+        Throttled requests (429) are retried after the Retry-After delay.
+        Idempotent requests are also retried on 503 and on the connection
+        errors with a jittered exponential backoff.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                rate_limit_wait = self.rate_limiter.acquire()
+                self.update_request_stats(
+                    rate_limit_wait_seconds=rate_limit_wait
+                )
+            self.update_request_stats(requests=1)
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if (
+                    method not in IDEMPOTENT_METHODS
+                    or attempt >= self.max_retries
+                ):
+                    raise
+                retry_delay = self.get_backoff_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                self.update_request_stats(throttled_responses=1)
+                retry_is_safe = (
+                    response.status_code == 429
+                    or method in IDEMPOTENT_METHODS
+                )
+                if not retry_is_safe or attempt >= self.max_retries:
+                    return response
+                retry_delay = get_retry_after(response)
+                if retry_delay is None:
+                    retry_delay = self.get_backoff_delay(attempt)
+                elif retry_delay > self.max_backoff:
+                    return response
+                response.close()
+
+            attempt += 1
+            logger.debug(
+                'Retry %s of %s %s in %.2f s',
+                attempt,
+                method,
+                url,
+                retry_delay,
+            )
+            self.update_request_stats(
+                retries=1,
+                retry_wait_seconds=retry_delay,
+            )
+            time.sleep(retry_delay)
+
+    def get_backoff_delay(self, attempt: int) -> float:
+        # "Full jitter": a random delay up to the exponential backoff
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, backoff)
+
+    def update_request_stats(self, **increments) -> None:
+        with self.request_stats_lock:
+            for name, increment in increments.items():
+                self.request_stats[name] += increment
+
+    def get_request_stats(self) -> Dict:
+        with self.request_stats_lock:
+            return dict(self.request_stats)
+
+    def enable_catalog_cache(
+        self,
+        catalog_id: str,
+        maxsize: int = 1024,
+        release_check_interval: float = 60,
+    ) -> CatalogCache:
+        """
+        Caches the catalog reads until a new catalog release is published.
+        """
+        def fetch_release_id():
+            release = self.get_latest_catalog_release(catalog_id=catalog_id)
+            return release['data']['id']
+
+        self.catalog_cache = CatalogCache(
+            fetch_release_id=fetch_release_id,
+            maxsize=maxsize,
+            release_check_interval=release_check_interval,
+        )
+        return self.catalog_cache
 
     def set_access_token(self):
         if self.access_token:
             current_timestamp = datetime.now().timestamp()
             if current_timestamp < self.access_token_expiration_timestamp:
                 return
+        with self.access_token_lock:
+            # The token could be refreshed by another thread
+            # while this one was waiting for the lock
+            if self.access_token:
+                current_timestamp = datetime.now().timestamp()
+                if current_timestamp < self.access_token_expiration_timestamp:
+                    return
+            self.refresh_access_token()
+
+    def refresh_access_token(self) -> None:
+        """
+        Must be called with the access_token_lock acquired.
+        If a Redis connection is provided, the token is shared through Redis
+        and only one process requests a new one.
+        """
+        if not self.redis_connection:
+            self.adopt_access_token(self.request_access_token())
+            return
+
+        token_card = self.load_shared_access_token()
+        if token_card:
+            self.adopt_access_token(token_card)
+            return
+
+        shared_lock = self.redis_connection.lock(
+            f'{self.redis_access_token_key}_lock',
+            timeout=30,
+            blocking_timeout=30,
+        )
+        with shared_lock:
+            token_card = self.load_shared_access_token()
+            if not token_card:
+                token_card = self.request_access_token()
+                token_lifetime = int(
+                    token_card['expires'] - datetime.now().timestamp()
+                )
+                if token_lifetime > 0:
+                    self.redis_connection.set(
+                        self.redis_access_token_key,
+                        json.dumps(token_card),
+                        ex=token_lifetime,
+                    )
+        self.adopt_access_token(token_card)
+
+    def request_access_token(self) -> Dict:
         payload = {
             'client_id': self.client_id,
             'client_secret': self.client_secret,
             'grant_type': 'client_credentials',
         }
 
-        response = requests.post(
-            'https://api.moltin.com/oauth/access_token/',
+        response = self.send(
+            'POST',
+            f'{self.base_url}/oauth/access_token/',
             data=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
-        token_card = response.json()
+        return response.json()
+
+    def load_shared_access_token(self) -> Optional[Dict]:
+        token_card = self.redis_connection.get(self.redis_access_token_key)
+        if not token_card:
+            return None
+        token_card = json.loads(token_card)
+        renewal_timestamp = (
+            token_card['expires'] - self.access_token_renewal_margin
+        )
+        if datetime.now().timestamp() >= renewal_timestamp:
+            return None
+        return token_card
 
+    def adopt_access_token(self, token_card: Dict) -> None:
         self.access_token = token_card['access_token']
         self.access_token_expiration_timestamp = token_card['expires']
 
+    def start_access_token_renewal(self) -> None:
+        """
+        Starts a daemon thread that renews the access token
+        access_token_renewal_margin seconds before it expires,
+        so the requests don't wait for the token.
+        """
+        if self.access_token_renewal_thread:
+            return
+        self.access_token_renewal_stopped.clear()
+        self.access_token_renewal_thread = threading.Thread(
+            target=self.renew_access_token,
+            name='elastic-access-token-renewal',
+            daemon=True,
+        )
+        self.access_token_renewal_thread.start()
+
+    def stop_access_token_renewal(self) -> None:
+        if not self.access_token_renewal_thread:
+            return
+        self.access_token_renewal_stopped.set()
+        self.access_token_renewal_thread.join()
+        self.access_token_renewal_thread = None
+
+    def renew_access_token(self) -> None:
+        while not self.access_token_renewal_stopped.is_set():
+            renewal_timestamp = (
+                self.access_token_expiration_timestamp
+                - self.access_token_renewal_margin
+            )
+            delay = renewal_timestamp - datetime.now().timestamp()
+            if delay > 0:
+                if self.access_token_renewal_stopped.wait(delay):
+                    return
+            try:
+                with self.access_token_lock:
+                    self.refresh_access_token()
+            except (requests.RequestException, RedisError):
+                logger.exception('The access token renewal failed')
+                self.access_token_renewal_stopped.wait(5)
+                continue
+            # Protects from spinning if the token lives
+            # less than the renewal margin
+            self.access_token_renewal_stopped.wait(1)
+
     def get_products(self):
         self.set_access_token()
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
 
-        response = requests.get(
-            'https://api.moltin.com/pcm/products/',
+        response = self.send(
+            'GET',
+            f'{self.base_url}/pcm/products/',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_products_page(
             self,
             page_limit: int,
@@ -57,29 +409,33 @@ class ElasticConnection():
             'Authorization': f'Bearer {self.access_token}',
         }
         payload = {'page[limit]': page_limit, 'page[offset]': page_offset}
-        response = requests.get(
-            'https://api.moltin.com/pcm/products/',
+        response = self.send(
+            'GET',
+            f'{self.base_url}/pcm/products/',
             headers=headers,
             params=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_product(self, product_id):
         self.set_access_token()
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
 
-        response = requests.get(
-            f'https://api.moltin.com/catalog/products/{product_id}/',
+        response = self.send(
+            'GET',
+            f'{self.base_url}/catalog/products/{product_id}/',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_node_products(
             self,
             catalog_id: str,
@@ -89,27 +445,30 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
+        response = self.send(
+            'GET',
             url=(
-                f'https://api.moltin.com/pcm/catalogs/{catalog_id}/'
+                f'{self.base_url}/pcm/catalogs/{catalog_id}/'
                 f'releases/latest/nodes/{node_id}/relationships/products/'
             ),
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_file_link(self, file_id):
         self.set_access_token()
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
 
-        response = requests.get(
-            f'https://api.moltin.com/v2/files/{file_id}/',
+        response = self.send(
+            'GET',
+            f'{self.base_url}/v2/files/{file_id}/',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()['data']['link']['href']
@@ -128,11 +487,12 @@ class ElasticConnection():
             }
         }
 
-        response = requests.post(
-            f'https://api.moltin.com/v2/carts/{cart_id}/items/',
+        response = self.send(
+            'POST',
+            f'{self.base_url}/v2/carts/{cart_id}/items/',
             headers=headers,
             json=payload,
-            timeout=30
+            timeout=self.timeout
         )
         response.raise_for_status()
         return response.json()
@@ -142,10 +502,11 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
-            url=f'https://api.moltin.com/v2/carts/{cart_id}/',
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/v2/carts/{cart_id}/',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -155,10 +516,11 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
-            url=f'https://api.moltin.com/v2/carts/{cart_id}/items/',
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/v2/carts/{cart_id}/items/',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -168,13 +530,14 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.delete(
+        response = self.send(
+            'DELETE',
             url=(
-                f'https://api.moltin.com/v2/carts/{cart_id}/items/'
+                f'{self.base_url}/v2/carts/{cart_id}/items/'
                 f'{item_id}/'
             ),
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -191,11 +554,12 @@ class ElasticConnection():
                 'email': email,
             }
         }
-        response = requests.post(
-            url='https://api.moltin.com/v2/customers/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/v2/customers/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -219,11 +583,12 @@ class ElasticConnection():
             },
         }
 
-        response = requests.post(
-            url='https://api.moltin.com/pcm/products/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/pcm/products/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -246,14 +611,15 @@ class ElasticConnection():
 
         payload = {'data': products}
 
-        response = requests.post(
+        response = self.send(
+            'POST',
             url=(
-                f'https://api.moltin.com/pcm/hierarchies/{hierarchy_id}/'
+                f'{self.base_url}/pcm/hierarchies/{hierarchy_id}/'
                 f'nodes/{node_id}/relationships/products/'
             ),
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -267,11 +633,12 @@ class ElasticConnection():
         payload = {
             'file_location': (None, file_location),
         }
-        response = requests.post(
-            url='https://api.moltin.com/v2/files/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/v2/files/',
             headers=headers,
             files=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -288,14 +655,15 @@ class ElasticConnection():
 
         files = [{'type': 'file', 'id': file_id} for file_id in files_ids]
         payload = {'data': files}
-        response = requests.post(
+        response = self.send(
+            'POST',
             url=(
-                f'https://api.moltin.com/pcm/products/{product_id}/'
+                f'{self.base_url}/pcm/products/{product_id}/'
                 'relationships/files/'
             ),
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
@@ -310,14 +678,15 @@ class ElasticConnection():
         }
 
         payload = {'data': {'type': 'file', 'id': file_id}}
-        response = requests.post(
+        response = self.send(
+            'POST',
             url=(
-                f'https://api.moltin.com/pcm/products/{product_id}/'
+                f'{self.base_url}/pcm/products/{product_id}/'
                 'relationships/main_image/'
             ),
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
@@ -341,11 +710,12 @@ class ElasticConnection():
                 'enabled': enabled,
             }
         }
-        response = requests.post(
-            url='https://api.moltin.com/v2/flows/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/v2/flows/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -384,11 +754,12 @@ class ElasticConnection():
                 },
             },
         }
-        response = requests.post(
-            url='https://api.moltin.com/v2/fields/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/v2/fields/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -417,11 +788,12 @@ class ElasticConnection():
         if courier_tg_id:
             payload['data']['courier_tg_id'] = courier_tg_id
 
-        response = requests.post(
-            url='https://api.moltin.com/v2/flows/pizzerias/entries/',
+        response = self.send(
+            'POST',
+            url=f'{self.base_url}/v2/flows/pizzerias/entries/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -448,50 +820,330 @@ class ElasticConnection():
                 }
             }
         }
-        response = requests.post(
+        response = self.send(
+            'POST',
             url=(
-                'https://api.moltin.com/pcm/pricebooks/'
+                f'{self.base_url}/pcm/pricebooks/'
                 f'{price_book_id}/prices/'
             ),
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
-    def get_custom_flow_entries(self, slug: str) -> Dict:
+    def update_product(
+        self,
+        product_id: str,
+        name: str,
+        description: str,
+    ) -> Dict:
         self.set_access_token()
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
+        payload = {
+            'data': {
+                'type': 'product',
+                'id': product_id,
+                'attributes': {
+                    'name': name,
+                    'description': description,
+                },
+            },
+        }
+        response = self.send(
+            'PUT',
+            url=f'{self.base_url}/pcm/products/{product_id}',
+            headers=headers,
+            json=payload,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
 
-        response = requests.get(
-            url=f'https://api.moltin.com/v2/flows/{slug}/entries',
+    def delete_product(self, product_id: str) -> None:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+        response = self.send(
+            'DELETE',
+            url=f'{self.base_url}/pcm/products/{product_id}',
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def get_files_page(
+        self,
+        page_limit: int,
+        page_offset: int,
+    ) -> Dict:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+        payload = {'page[limit]': page_limit, 'page[offset]': page_offset}
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/v2/files/',
+            headers=headers,
+            params=payload,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
-    def get_customers_by_name(self, name: str) -> Dict:
+    def get_product_prices_page(
+        self,
+        price_book_id: str,
+        page_limit: int,
+        page_offset: int,
+    ) -> Dict:
         self.set_access_token()
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
+        payload = {'page[limit]': page_limit, 'page[offset]': page_offset}
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/pcm/pricebooks/{price_book_id}/prices',
+            headers=headers,
+            params=payload,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
 
+    def update_product_price(
+        self,
+        price_book_id: str,
+        price_id: str,
+        currency_code: str,
+        amount: int,
+    ) -> Dict:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
         payload = {
-            'filter': f'eq(name,{name})'
+            'data': {
+                'type': 'product-price',
+                'id': price_id,
+                'attributes': {
+                    'currencies': {
+                        currency_code: {'amount': amount}
+                    },
+                }
+            }
         }
-        response = requests.get(
-            url='https://api.moltin.com/v2/customers/',
+        response = self.send(
+            'PUT',
+            url=(
+                f'{self.base_url}/pcm/pricebooks/'
+                f'{price_book_id}/prices/{price_id}'
+            ),
+            headers=headers,
+            json=payload,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def delete_product_price(self, price_book_id: str, price_id: str) -> None:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+        response = self.send(
+            'DELETE',
+            url=(
+                f'{self.base_url}/pcm/pricebooks/'
+                f'{price_book_id}/prices/{price_id}'
+            ),
+            headers=headers,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def get_custom_flow_entries(
+        self,
+        slug: str,
+        page_limit: Optional[int] = None,
+        page_offset: Optional[int] = None,
+    ) -> Dict:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+
+        payload = get_page_payload(page_limit, page_offset)
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/v2/flows/{slug}/entries',
             headers=headers,
             params=payload,
-            timeout=30,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_customers_by_name(
+        self,
+        name: str,
+        page_limit: Optional[int] = None,
+        page_offset: Optional[int] = None,
+    ) -> Dict:
+        self.set_access_token()
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+        }
+
+        payload = {
+            'filter': f'eq(name,{name})',
+            **get_page_payload(page_limit, page_offset),
+        }
+        response = self.send(
+            'GET',
+            url=f'{self.base_url}/v2/customers/',
+            headers=headers,
+            params=payload,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    def iter_pages(
+        self,
+        get_page: Callable[[int, int], Dict],
+        page_limit: int,
+        prefetch: bool,
+    ) -> Iterator[Dict]:
+        """
+        Yields the items of all the pages, one page is kept in memory.
+        If prefetch is set, the next page is requested
+        while the current one is consumed.
+        """
+        executor = None
+        if prefetch:
+            executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page_offset = 0
+            page_response = get_page(page_limit, page_offset)
+            while True:
+                items = page_response['data']
+                total = (
+                    page_response.get('meta', {})
+                    .get('results', {})
+                    .get('total')
+                )
+                next_page_offset = page_offset + len(items)
+                if total is not None:
+                    # The server can cap the page size below page_limit,
+                    # so a short page is not the last one while
+                    # the total is not reached
+                    is_last_page = not items or next_page_offset >= total
+                else:
+                    is_last_page = len(items) < page_limit
+                next_page = None
+                if executor and not is_last_page:
+                    next_page = executor.submit(
+                        get_page,
+                        page_limit,
+                        next_page_offset,
+                    )
+
+                yield from items
+
+                if is_last_page:
+                    return
+                page_offset = next_page_offset
+                if next_page:
+                    page_response = next_page.result()
+                else:
+                    page_response = get_page(page_limit, page_offset)
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_products(
+        self,
+        page_limit: int = 100,
+        prefetch: bool = False,
+    ) -> Iterator[Dict]:
+        return self.iter_pages(
+            get_page=lambda limit, offset: self.get_products_page(
+                page_limit=limit,
+                page_offset=offset,
+            ),
+            page_limit=page_limit,
+            prefetch=prefetch,
+        )
+
+    def iter_custom_flow_entries(
+        self,
+        slug: str,
+        page_limit: int = 100,
+        prefetch: bool = False,
+    ) -> Iterator[Dict]:
+        return self.iter_pages(
+            get_page=lambda limit, offset: self.get_custom_flow_entries(
+                slug=slug,
+                page_limit=limit,
+                page_offset=offset,
+            ),
+            page_limit=page_limit,
+            prefetch=prefetch,
+        )
+
+    def iter_customers_by_name(
+        self,
+        name: str,
+        page_limit: int = 100,
+        prefetch: bool = False,
+    ) -> Iterator[Dict]:
+        return self.iter_pages(
+            get_page=lambda limit, offset: self.get_customers_by_name(
+                name=name,
+                page_limit=limit,
+                page_offset=offset,
+            ),
+            page_limit=page_limit,
+            prefetch=prefetch,
+        )
+
+    def iter_files(
+        self,
+        page_limit: int = 100,
+        prefetch: bool = False,
+    ) -> Iterator[Dict]:
+        return self.iter_pages(
+            get_page=lambda limit, offset: self.get_files_page(
+                page_limit=limit,
+                page_offset=offset,
+            ),
+            page_limit=page_limit,
+            prefetch=prefetch,
+        )
+
+    def iter_product_prices(
+        self,
+        price_book_id: str,
+        page_limit: int = 100,
+        prefetch: bool = False,
+    ) -> Iterator[Dict]:
+        return self.iter_pages(
+            get_page=lambda limit, offset: self.get_product_prices_page(
+                price_book_id=price_book_id,
+                page_limit=limit,
+                page_offset=offset,
+            ),
+            page_limit=page_limit,
+            prefetch=prefetch,
+        )
+
     def update_customer_email(self, customer_id: str, email: str) -> Dict:
         self.set_access_token()
         headers = {
@@ -504,11 +1156,12 @@ class ElasticConnection():
                 'email': email,
             }
         }
-        response = requests.put(
-            url=f'https://api.moltin.com/v2/customers/{customer_id}/',
+        response = self.send(
+            'PUT',
+            url=f'{self.base_url}/v2/customers/{customer_id}/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -531,15 +1184,17 @@ class ElasticConnection():
                 'longitude': longitude,
             }
         }
-        response = requests.put(
-            url=f'https://api.moltin.com/v2/customers/{customer_id}/',
+        response = self.send(
+            'PUT',
+            url=f'{self.base_url}/v2/customers/{customer_id}/',
             headers=headers,
             json=payload,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_nodes(
             self,
             catalog_id: str,
@@ -548,17 +1203,19 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
+        response = self.send(
+            'GET',
             url=(
-                f'https://api.moltin.com/pcm/catalogs/{catalog_id}/releases/'
+                f'{self.base_url}/pcm/catalogs/{catalog_id}/releases/'
                 'latest/nodes'
             ),
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
 
+    @cached_catalog_read
     def get_node_children(
             self,
             catalog_id: str,
@@ -568,13 +1225,14 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
+        response = self.send(
+            'GET',
             url=(
-                f'https://api.moltin.com/pcm/catalogs/{catalog_id}/releases/'
+                f'{self.base_url}/pcm/catalogs/{catalog_id}/releases/'
                 f'latest/nodes/{node_id}/relationships/children'
             ),
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -587,13 +1245,14 @@ class ElasticConnection():
         headers = {
             'Authorization': f'Bearer {self.access_token}',
         }
-        response = requests.get(
+        response = self.send(
+            'GET',
             url=(
-                f'https://api.moltin.com/pcm/catalogs/{catalog_id}/'
+                f'{self.base_url}/pcm/catalogs/{catalog_id}/'
                 'releases/latest'
             ),
             headers=headers,
-            timeout=30,
+            timeout=self.timeout,
         )
         response.raise_for_status()
         return response.json()
@@ -16,21 +16,35 @@ env.read_env()
 with env.prefixed('FACEBOOK_'):
     FACEBOOK_PAGE_ACCESS_TOKEN = env("PAGE_ACCESS_TOKEN")
     FACEBOOK_VERIFY_TOKEN = env("VERIFY_TOKEN")
+with env.prefixed('REDIS_'):
+    redis_connection = Redis(
+        host=env('HOST'),
+        port=env('PORT'),
+        password=env('PASSWORD'),
+        decode_responses=True
+    )
 with env.prefixed('ELASTIC_'):
     elastic_connection = ElasticConnection(
         client_id=env('PATH_CLIENT_ID'),
         client_secret=env('PATH_CLIENT_SECRET'),
+        timeout=env.float('TIMEOUT', 30),
+        pool_maxsize=env.int('POOL_MAXSIZE', 10),
+        redis_connection=redis_connection,
+        requests_per_second=env.float('REQUESTS_PER_SECOND', 0),
+        requests_burst=env.int('REQUESTS_BURST', 1),
+        max_retries=env.int('MAX_RETRIES', 3),
     )
+    elastic_connection.start_access_token_renewal()
+    catalog_cache_size = env.int('CATALOG_CACHE_SIZE', 0)
+    if catalog_cache_size:
+        elastic_connection.enable_catalog_cache(
+            catalog_id=env('CATALOG_ID'),
+            maxsize=catalog_cache_size,
+            release_check_interval=env.float('CATALOG_CACHE_TTL', 60),
+        )
     ELASTIC_CATALOG_ID = env('CATALOG_ID')
     ELASTIC_MAIN_NODE_ID = env('MAIN_NODE_ID')
     ELASTIC_OTHERS_NODE_ID = env('OTHERS_NODE_ID')
-with env.prefixed('REDIS_'):
-    redis_connection = Redis(
-        host=env('HOST'),
-        port=env('PORT'),
-        password=env('PASSWORD'),
-        decode_responses=True
-    )
 
 LOGO_URL = env('LOGO_URL')
 ADDITIONAL_LOGO_URL = env('ADDITIONAL_LOGO_URL')
@@ -260,6 +274,15 @@ def send_menu(recipient_id, menu_subtitle, node_id):
     else:
         menu_items = menu_cash['menu_items']
         logger.debug('The menu items are got from the cash')
+    logger.debug(
+        'Elastic requests stats: %s',
+        elastic_connection.get_request_stats(),
+    )
+    if elastic_connection.catalog_cache:
+        logger.debug(
+            'Catalog cache stats: %s',
+            elastic_connection.catalog_cache.get_stats(),
+        )
 
     request_content = {
         "recipient": {
@@ -0,0 +1,194 @@
+import math
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+WGS84_SEMI_MAJOR_AXIS_KM = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+# The bounds of the delivery tiers: pickup or free delivery,
+# 100 RUB delivery, 300 RUB delivery, no delivery beyond the last one
+DELIVERY_TIERS_KM = (0.5, 5, 20)
+
+
+class PizzeriasArray():
+    """
+    Coordinates of the pizzerias in contiguous float64 arrays (radians),
+    the pizzerias themselves are kept in the same order.
+    """
+
+    def __init__(self, pizzerias: List[Dict]):
+        self.pizzerias = pizzerias
+        coordinates = np.array(
+            [
+                (float(pizzeria['latitude']), float(pizzeria['longitude']))
+                for pizzeria in pizzerias
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        self.latitudes = np.ascontiguousarray(np.radians(coordinates[:, 0]))
+        self.longitudes = np.ascontiguousarray(np.radians(coordinates[:, 1]))
+        self.reduced_latitudes = get_reduced_latitudes(self.latitudes)
+
+    def __len__(self):
+        return len(self.pizzerias)
+
+    def get_distances_km(
+        self,
+        latitude: float,
+        longitude: float,
+        ellipsoidal: bool = True,
+    ) -> np.ndarray:
+        """
+        Distances from the point (in degrees) to all the pizzerias.
+        """
+        latitude = np.radians(latitude)
+        longitude = np.radians(longitude)
+        if not ellipsoidal:
+            return haversine_km(
+                latitude,
+                longitude,
+                self.latitudes,
+                self.longitudes,
+            )
+        return lambert_km(
+            get_reduced_latitudes(latitude),
+            longitude,
+            self.reduced_latitudes,
+            self.longitudes,
+        )
+
+    def get_distances_matrix_km(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        ellipsoidal: bool = True,
+        chunk_size: int = 1024,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yields (points chunk x pizzerias) distances matrices,
+        so the memory is bounded by chunk_size * len(pizzerias).
+        """
+        latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+        for start in range(0, len(latitudes), chunk_size):
+            chunk_latitudes = latitudes[start:start + chunk_size, None]
+            chunk_longitudes = longitudes[start:start + chunk_size, None]
+            if not ellipsoidal:
+                yield haversine_km(
+                    chunk_latitudes,
+                    chunk_longitudes,
+                    self.latitudes[None, :],
+                    self.longitudes[None, :],
+                )
+                continue
+            yield lambert_km(
+                get_reduced_latitudes(chunk_latitudes),
+                chunk_longitudes,
+                self.reduced_latitudes[None, :],
+                self.longitudes[None, :],
+            )
+
+
+def get_reduced_latitudes(latitudes):
+    return np.arctan((1 - WGS84_FLATTENING) * np.tan(latitudes))
+
+
+def get_central_angles(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    half_angles = np.sqrt(
+        np.sin((latitudes_2 - latitudes_1) / 2) ** 2
+        + np.cos(latitudes_1) * np.cos(latitudes_2)
+        * np.sin((longitudes_2 - longitudes_1) / 2) ** 2
+    )
+    return 2 * np.arcsin(np.minimum(half_angles, 1))
+
+
+def haversine_km(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    """
+    Great-circle distances on the mean sphere, the angles are in radians.
+    """
+    return EARTH_RADIUS_KM * get_central_angles(
+        latitudes_1,
+        longitudes_1,
+        latitudes_2,
+        longitudes_2,
+    )
+
+
+def lambert_km(
+    reduced_latitudes_1,
+    longitudes_1,
+    reduced_latitudes_2,
+    longitudes_2,
+):
+    """
+    Lambert's formula for the distances on the WGS-84 ellipsoid,
+    the error is about 10 m for thousands of kilometers.
+    The latitudes are reduced ones, the angles are in radians.
+    """
+    angles = get_central_angles(
+        reduced_latitudes_1,
+        longitudes_1,
+        reduced_latitudes_2,
+        longitudes_2,
+    )
+    p = (reduced_latitudes_1 + reduced_latitudes_2) / 2
+    q = (reduced_latitudes_2 - reduced_latitudes_1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (
+            (angles - np.sin(angles)) * np.sin(p) ** 2 * np.cos(q) ** 2
+            / np.cos(angles / 2) ** 2
+        )
+        y = (
+            (angles + np.sin(angles)) * np.cos(p) ** 2 * np.sin(q) ** 2
+            / np.sin(angles / 2) ** 2
+        )
+        distances = WGS84_SEMI_MAJOR_AXIS_KM * (
+            angles - WGS84_FLATTENING / 2 * (x + y)
+        )
+    return np.where(angles > 0, distances, 0.0)
+
+
+def get_distance_km(
+    latitude_1: float,
+    longitude_1: float,
+    latitude_2: float,
+    longitude_2: float,
+) -> float:
+    """
+    Lambert's formula for a single pair of points (in degrees)
+    without NumPy overhead.
+    """
+    reduced_latitude_1 = math.atan(
+        (1 - WGS84_FLATTENING) * math.tan(math.radians(latitude_1))
+    )
+    reduced_latitude_2 = math.atan(
+        (1 - WGS84_FLATTENING) * math.tan(math.radians(latitude_2))
+    )
+    half_angle = math.sqrt(
+        math.sin((reduced_latitude_2 - reduced_latitude_1) / 2) ** 2
+        + math.cos(reduced_latitude_1) * math.cos(reduced_latitude_2)
+        * math.sin(math.radians(longitude_2 - longitude_1) / 2) ** 2
+    )
+    angle = 2 * math.asin(min(half_angle, 1))
+    if not angle:
+        return 0.0
+    p = (reduced_latitude_1 + reduced_latitude_2) / 2
+    q = (reduced_latitude_2 - reduced_latitude_1) / 2
+    x = (
+        (angle - math.sin(angle)) * math.sin(p) ** 2 * math.cos(q) ** 2
+        / math.cos(angle / 2) ** 2
+    )
+    y = (
+        (angle + math.sin(angle)) * math.cos(p) ** 2 * math.sin(q) ** 2
+        / math.sin(angle / 2) ** 2
+    )
+    return WGS84_SEMI_MAJOR_AXIS_KM * (angle - WGS84_FLATTENING / 2 * (x + y))
+
+
+def get_delivery_tiers(distances_km: np.ndarray) -> np.ndarray:
+    """
+    Index of the delivery tier for every distance:
+    0 - up to 0.5 km, 1 - up to 5 km, 2 - up to 20 km, 3 - no delivery.
+    """
+    return np.searchsorted(DELIVERY_TIERS_KM, distances_km, side='left')
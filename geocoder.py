@@ -0,0 +1,133 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from redis import Redis
+
+from elastic_api import create_session
+
+
+def normalize_address(address: str) -> str:
+    address = address.lower().replace('ё', 'е')
+    address = re.sub(r'[^\w\s/-]', ' ', address)
+    return ' '.join(address.split())
+
+
+class Geocoder():
+    """
+    Yandex geocoder with a two-level cache of the coordinates:
+    a small in-process LRU in front of Redis. The "not found" results
+    are cached too, for negative_ttl seconds on both levels.
+    """
+
+    def __init__(
+        self,
+        apikey: str,
+        redis_connection: Optional[Redis] = None,
+        ttl: int = 30 * 24 * 3600,
+        negative_ttl: int = 24 * 3600,
+        maxsize: int = 4096,
+        timeout: float = 10,
+    ):
+        self.apikey = apikey
+        self.redis_connection = redis_connection
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.session = create_session()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def request_coordinates(
+        self,
+        address: str,
+    ) -> Optional[Tuple[float, float]]:
+        base_url = "https://geocode-maps.yandex.ru/1.x"
+        response = self.session.get(
+            base_url,
+            params={
+                "geocode": address,
+                "apikey": self.apikey,
+                "format": "json",
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        found_response = response.json()['response']
+        found_places = found_response['GeoObjectCollection']['featureMember']
+
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+        return float(lat), float(lon)
+
+    def remember(
+        self,
+        key: str,
+        coordinates: Optional[Tuple[float, float]],
+        ttl: Optional[float] = None,
+    ) -> None:
+        full_ttl = self.ttl if coordinates else self.negative_ttl
+        if ttl is None or ttl > full_ttl:
+            ttl = full_ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, coordinates)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def fetch_coordinates(
+        self,
+        address: str,
+    ) -> Optional[Tuple[float, float]]:
+        normalized_address = normalize_address(address)
+        if not normalized_address:
+            return None
+        key = hashlib.sha1(normalized_address.encode()).hexdigest()
+
+        with self.lock:
+            if key in self.entries:
+                expires_at, coordinates = self.entries[key]
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return coordinates
+                del self.entries[key]
+
+        redis_key = f'geocode_{key}'
+        if self.redis_connection:
+            pipeline = self.redis_connection.pipeline(transaction=False)
+            pipeline.get(redis_key)
+            pipeline.pttl(redis_key)
+            cached_coordinates, ttl_ms = pipeline.execute()
+            if cached_coordinates is not None:
+                coordinates = json.loads(cached_coordinates)
+                if coordinates:
+                    coordinates = tuple(coordinates)
+                # The entry lives in the memory no longer than in Redis,
+                # a key without expiration has a negative PTTL
+                self.remember(
+                    key,
+                    coordinates,
+                    ttl=ttl_ms / 1000 if ttl_ms >= 0 else None,
+                )
+                return coordinates
+
+        coordinates = self.request_coordinates(address)
+        self.remember(key, coordinates)
+        if self.redis_connection:
+            self.redis_connection.set(
+                redis_key,
+                json.dumps(coordinates),
+                ex=self.ttl if coordinates else self.negative_ttl,
+            )
+        return coordinates
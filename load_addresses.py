@@ -1,9 +1,16 @@
 import argparse
 import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
 
+import requests
 from environs import Env
+from redis import Redis
 
 from elastic_api import ElasticConnection
+from pizzerias_registry import publish_pizzerias_invalidation
 
 
 def create_parser():
@@ -28,31 +35,180 @@ def create_parser():
         help=('Courier telegram ID '),
         default=0
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='{workers number}',
+        help='number of parallel requests, default: 1',
+        default=1,
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        metavar='{requests per second}',
+        help=(
+            'maximum number of requests per second, '
+            'default: 0 - no limit'
+        ),
+        default=0,
+    )
+    parser.add_argument(
+        '--progress_step',
+        type=int,
+        metavar='{pizzerias number}',
+        help=(
+            'print the progress after every N loaded pizzerias, '
+            '0 - no progress, default: 10'
+        ),
+        default=10,
+    )
 
     return parser
 
 
+def get_pizzeria_keys(
+    alias: Optional[str],
+    longitude: Optional[float],
+    latitude: Optional[float],
+) -> Set[Tuple]:
+    keys = set()
+    if alias and alias.strip():
+        keys.add(('alias', alias.strip().lower()))
+    if longitude is not None and latitude is not None:
+        # About 10 cm precision, so the same place
+        # with differently formatted coordinates matches
+        keys.add(('coordinates', round(longitude, 6), round(latitude, 6)))
+    return keys
+
+
+def get_new_addresses(
+    elastic_connection: ElasticConnection,
+    addresses: List[Dict],
+) -> List[Dict]:
+    """
+    Drops the addresses whose alias or coordinates
+    are already in the store or earlier in the file.
+    """
+    known_keys = set()
+    for pizzeria in elastic_connection.iter_custom_flow_entries(
+        slug='pizzerias',
+        prefetch=True,
+    ):
+        try:
+            longitude = float(pizzeria['longitude'])
+            latitude = float(pizzeria['latitude'])
+        except (KeyError, TypeError, ValueError):
+            print(
+                f'The loaded pizzeria {pizzeria.get("alias")} '
+                'has no coordinates, only its alias is compared'
+            )
+            longitude = latitude = None
+        known_keys.update(
+            get_pizzeria_keys(
+                alias=pizzeria.get('alias'),
+                longitude=longitude,
+                latitude=latitude,
+            )
+        )
+
+    new_addresses = []
+    for address in addresses:
+        coordinates = address['coordinates']
+        keys = get_pizzeria_keys(
+            alias=address['alias'],
+            longitude=float(coordinates['lon']),
+            latitude=float(coordinates['lat']),
+        )
+        if known_keys.intersection(keys):
+            continue
+        known_keys.update(keys)
+        new_addresses.append(address)
+    return new_addresses
+
+
 def main():
     env = Env()
     env.read_env()
+    parser = create_parser()
+    args = parser.parse_args()
+    if args.progress_step < 0:
+        parser.error('--progress_step should not be negative')
     with env.prefixed('ELASTIC_'):
         elastic_connection = ElasticConnection(
             client_id=env('PATH_CLIENT_ID'),
             client_secret=env('PATH_CLIENT_SECRET'),
+            pool_maxsize=args.workers,
+            requests_per_second=args.rate,
         )
-    parser = create_parser()
-    args = parser.parse_args()
     with open(args.file, 'r', encoding="UTF-8") as file:
         addresses = json.load(file)
 
-    for address in addresses:
-        coordinates = address['coordinates']
-        elastic_connection.create_pizzeria(
-            address=address['address']['full'],
-            alias=address['alias'],
-            longitude=float(coordinates['lon']),
-            latitude=float(coordinates['lat']),
-            courier_tg_id=args.courier_tg_id,
+    started_at = time.monotonic()
+    new_addresses = get_new_addresses(
+        elastic_connection=elastic_connection,
+        addresses=addresses,
+    )
+    print(
+        f'{len(addresses)} addresses in the file, '
+        f'{len(addresses) - len(new_addresses)} are already loaded'
+    )
+
+    loaded_number = failed_number = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for address in new_addresses:
+            coordinates = address['coordinates']
+            future = executor.submit(
+                elastic_connection.create_pizzeria,
+                address=address['address']['full'],
+                alias=address['alias'],
+                longitude=float(coordinates['lon']),
+                latitude=float(coordinates['lat']),
+                courier_tg_id=args.courier_tg_id,
+            )
+            futures[future] = address['alias']
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except requests.RequestException as error:
+                failed_number += 1
+                print(f'The pizzeria {futures[future]} is not loaded: {error}')
+                continue
+            loaded_number += 1
+            if args.progress_step and loaded_number % args.progress_step == 0:
+                elapsed_time = time.monotonic() - started_at
+                print(
+                    f'Loaded {loaded_number} of {len(new_addresses)}, '
+                    f'{loaded_number / elapsed_time:.2f} pizzerias/s'
+                )
+
+    elapsed_time = max(time.monotonic() - started_at, 1e-6)
+    request_stats = elastic_connection.get_request_stats()
+    print(
+        f'Loaded {loaded_number} pizzerias in {elapsed_time:.1f} s: '
+        f'{loaded_number / elapsed_time:.2f} pizzerias/s, '
+        f'{request_stats["requests"] / elapsed_time:.2f} requests/s'
+    )
+    print(
+        f'Rate limit wait: {request_stats["rate_limit_wait_seconds"]:.1f} s, '
+        f'retries: {request_stats["retries"]}'
+    )
+    elastic_connection.close()
+    if loaded_number and env('REDIS_HOST', None):
+        # The running bots reload the pizzerias
+        with env.prefixed('REDIS_'):
+            redis_connection = Redis(
+                host=env('HOST'),
+                port=env('PORT'),
+                password=env('PASSWORD'),
+                decode_responses=True
+            )
+        publish_pizzerias_invalidation(redis_connection)
+    if failed_number:
+        sys.exit(
+            f'{failed_number} pizzerias are not loaded, '
+            'run the script again to load them'
         )
 
 
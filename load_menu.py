@@ -1,6 +1,15 @@
 import argparse
 import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                as_completed, wait)
+from typing import Dict, List, Optional, Tuple
 
+import requests
 from environs import Env
 
 from elastic_api import ElasticConnection
@@ -38,63 +47,535 @@ def create_parser():
             'is omitted, the prices of the products will not be loaded'
         ),
     )
+    parser.add_argument(
+        '--journal',
+        metavar='{journal path}',
+        help=(
+            'path to the journal of the completed steps, '
+            'default: the JSON file path with the .journal suffix'
+        ),
+    )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help=(
+            'compare the file with the store by SKU and make only '
+            'the needed changes: load the new products, update the changed '
+            'names, descriptions, images and prices'
+        ),
+    )
+    parser.add_argument(
+        '--delete_missing',
+        action='store_true',
+        help=(
+            'in the sync mode, delete the store products '
+            'that are absent from the file'
+        ),
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='{workers number}',
+        help='number of parallel requests, default: 1',
+        default=1,
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        metavar='{requests per second}',
+        help=(
+            'maximum number of requests per second, '
+            'default: 0 - no limit'
+        ),
+        default=0,
+    )
 
     return parser
 
 
-def main():
-    env = Env()
-    env.read_env()
-    with env.prefixed('ELASTIC_'):
-        elastic_connection = ElasticConnection(
-            client_id=env('PATH_CLIENT_ID'),
-            client_secret=env('PATH_CLIENT_SECRET'),
-        )
-    parser = create_parser()
-    args = parser.parse_args()
+class Journal():
+    """
+    Append-only journal of the completed loading steps.
+    Each line is a JSON object with the product SKU, the step name
+    and the id of the created entity.
+    """
 
-    with open(args.file, 'r', encoding="UTF-8") as file:
-        menu = json.load(file)
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = defaultdict(dict)
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='UTF-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line could be cut off by a crash
+                        continue
+                    if record['step'] == 'reset':
+                        self.steps.pop(record['sku'], None)
+                        continue
+                    self.steps[record['sku']][record['step']] = record['id']
+        self.file = open(path, 'a', encoding='UTF-8')
+
+    def get_steps(self, sku: str) -> Dict[str, Optional[str]]:
+        return dict(self.steps.get(sku, {}))
+
+    def record(self, sku: str, step: str, entity_id: Optional[str]) -> None:
+        with self.lock:
+            if step == 'reset':
+                self.steps.pop(sku, None)
+            else:
+                self.steps[sku][step] = entity_id
+            self.file.write(
+                json.dumps({'sku': sku, 'step': step, 'id': entity_id}) + '\n'
+            )
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def load_products(
+    elastic_connection: ElasticConnection,
+    menu: List[Dict],
+    price_book_id: Optional[str],
+    workers: int,
+    journal: Journal,
+    store_products_ids: Dict[str, str],
+) -> Tuple[List[str], int]:
+    """
+    Pipelines the products creation steps through a thread pool:
+    the product, its image and its price are created at once,
+    the image relationships are created when both the product
+    and the image are ready.
+    The steps recorded in the journal are skipped. The products found
+    in the store and absent in the journal are considered loaded.
+    Returns the products ids in the menu order and the number
+    of the failed steps.
+    """
+    failed_steps_number = 0
+    products_ids = {}
+    images_ids = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending_steps = {}
+
+        def submit(step, sku, function, /, **kwargs):
+            future = executor.submit(function, **kwargs)
+            pending_steps[future] = (step, sku)
+
+        def submit_relationships(sku):
+            steps = journal.get_steps(sku)
+            if not (sku in products_ids and sku in images_ids):
+                return
+            if 'files_relationship' not in steps:
+                submit(
+                    'files_relationship',
+                    sku,
+                    elastic_connection.create_product_file_relationships,
+                    product_id=products_ids[sku],
+                    files_ids=[images_ids[sku]],
+                )
+            if 'main_image_relationship' not in steps:
+                submit(
+                    'main_image_relationship',
+                    sku,
+                    elastic_connection.create_main_image_relationships,
+                    product_id=products_ids[sku],
+                    file_id=images_ids[sku],
+                )
 
-    products_ids = []
-    for product in menu:
-        product_creation_response = elastic_connection.create_product(
+        for product in menu:
+            sku = str(product['id'])
+            steps = journal.get_steps(sku)
+            if sku in store_products_ids:
+                products_ids[sku] = store_products_ids[sku]
+                if not steps:
+                    continue
+                if 'product' not in steps:
+                    # The product was created, but the journal was not updated
+                    journal.record(sku, 'product', products_ids[sku])
+            else:
+                if 'product' in steps:
+                    # The product was deleted from the store after the loading
+                    journal.record(sku, 'reset', None)
+                    steps = {}
+                submit(
+                    'product',
+                    sku,
+                    elastic_connection.create_product,
+                    name=product['name'],
+                    sku=sku,
+                    description=product['description'],
+                )
+
+            if 'image' in steps:
+                images_ids[sku] = steps['image']
+            else:
+                submit(
+                    'image',
+                    sku,
+                    elastic_connection.create_file,
+                    file_location=product['product_image']['url'],
+                )
+            if price_book_id and 'price' not in steps:
+                submit(
+                    'price',
+                    sku,
+                    elastic_connection.create_product_price,
+                    price_book_id=price_book_id,
+                    product_sku=sku,
+                    currency_code='RUB',
+                    amount=product['price'],
+                )
+            submit_relationships(sku)
+
+        while pending_steps:
+            done_steps, _ = wait(pending_steps, return_when=FIRST_COMPLETED)
+            for future in done_steps:
+                step, sku = pending_steps.pop(future)
+                try:
+                    step_response = future.result()
+                except requests.RequestException as error:
+                    failed_steps_number += 1
+                    print(f'Step {step} of the product {sku} failed: {error}')
+                    continue
+
+                entity_id = None
+                if step_response:
+                    entity_id = step_response['data']['id']
+                journal.record(sku, step, entity_id)
+                if step == 'product':
+                    products_ids[sku] = entity_id
+                elif step == 'image':
+                    images_ids[sku] = entity_id
+                else:
+                    continue
+                submit_relationships(sku)
+
+    loaded_products_ids = [
+        products_ids[str(product['id'])]
+        for product in menu
+        if str(product['id']) in products_ids
+    ]
+    return loaded_products_ids, failed_steps_number
+
+
+def get_product_changes(
+    product: Dict,
+    store_product: Dict,
+    store_image_url: Optional[str],
+    store_price: Optional[Dict],
+    price_book_id: Optional[str],
+) -> List[str]:
+    changes = []
+    attributes = store_product['attributes']
+    if (
+        attributes.get('name') != product['name']
+        or attributes.get('description') != product['description']
+    ):
+        changes.append('product')
+    if store_image_url != product['product_image']['url']:
+        changes.append('image')
+    if price_book_id:
+        store_amount = None
+        if store_price:
+            store_currencies = store_price['attributes']['currencies']
+            store_amount = store_currencies.get('RUB', {}).get('amount')
+        if store_amount != product['price']:
+            changes.append('price')
+    return changes
+
+
+def apply_product_changes(
+    elastic_connection: ElasticConnection,
+    product: Dict,
+    product_id: str,
+    store_price: Optional[Dict],
+    price_book_id: Optional[str],
+    changes: List[str],
+) -> None:
+    if 'product' in changes:
+        elastic_connection.update_product(
+            product_id=product_id,
             name=product['name'],
-            sku=str(product['id']),
-            description=product['description']
+            description=product['description'],
         )
-        product_id = product_creation_response['data']['id']
-        products_ids.append(product_id)
-
+    if 'image' in changes:
         image_creation_response = elastic_connection.create_file(
             file_location=product['product_image']['url']
         )
         image_id = image_creation_response['data']['id']
-
         elastic_connection.create_product_file_relationships(
             product_id=product_id, files_ids=[image_id]
         )
         elastic_connection.create_main_image_relationships(
             product_id=product_id, file_id=image_id
         )
-        if not args.price_book_id:
-            continue
-
+    if 'price' not in changes:
+        return
+    if store_price:
+        elastic_connection.update_product_price(
+            price_book_id=price_book_id,
+            price_id=store_price['id'],
+            currency_code='RUB',
+            amount=product['price'],
+        )
+    else:
         elastic_connection.create_product_price(
-            price_book_id=args.price_book_id,
-            product_sku=product_creation_response['data']['attributes']['sku'],
+            price_book_id=price_book_id,
+            product_sku=str(product['id']),
             currency_code='RUB',
-            amount=product['price']
+            amount=product['price'],
         )
 
-    if not (args.hierarchy_id and args.node_id):
-        return
 
-    elastic_connection.create_products_relationships(
-        hierarchy_id=args.hierarchy_id,
-        node_id=args.node_id,
-        products_ids=products_ids
+def delete_store_product(
+    elastic_connection: ElasticConnection,
+    product_id: str,
+    store_price: Optional[Dict],
+    price_book_id: Optional[str],
+) -> None:
+    elastic_connection.delete_product(product_id=product_id)
+    if price_book_id and store_price:
+        elastic_connection.delete_product_price(
+            price_book_id=price_book_id,
+            price_id=store_price['id'],
+        )
+
+
+def get_store_images_urls(
+    elastic_connection: ElasticConnection,
+) -> Dict[str, str]:
+    return {
+        store_file['id']: store_file['link']['href']
+        for store_file in elastic_connection.iter_files(prefetch=True)
+    }
+
+
+def get_store_prices(
+    elastic_connection: ElasticConnection,
+    price_book_id: str,
+) -> Dict[str, Dict]:
+    return {
+        store_price['attributes']['sku']: store_price
+        for store_price in elastic_connection.iter_product_prices(
+            price_book_id=price_book_id,
+            prefetch=True,
+        )
+    }
+
+
+def sync_products(
+    elastic_connection: ElasticConnection,
+    menu: List[Dict],
+    price_book_id: Optional[str],
+    workers: int,
+    journal: Journal,
+    store_products: List[Dict],
+    delete_missing: bool,
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Compares the menu with the store by SKU and makes only the requests
+    needed to bring the store up to date: the new products are loaded,
+    the changed names, descriptions, images and prices are updated.
+    If delete_missing is set, the store products absent
+    from the menu are deleted.
+    Returns the ids of the new products and the changes counters.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        store_images_urls = executor.submit(
+            get_store_images_urls,
+            elastic_connection=elastic_connection,
+        )
+        store_prices = {}
+        if price_book_id:
+            store_prices = executor.submit(
+                get_store_prices,
+                elastic_connection=elastic_connection,
+                price_book_id=price_book_id,
+            ).result()
+        store_images_urls = store_images_urls.result()
+
+    store_products = {
+        store_product['attributes']['sku']: store_product
+        for store_product in store_products
+    }
+    menu_skus = {str(product['id']) for product in menu}
+    stats = defaultdict(int)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending_changes = {}
+        for product in menu:
+            sku = str(product['id'])
+            store_product = store_products.get(sku)
+            if not store_product:
+                continue
+            main_image = (
+                store_product.get('relationships', {})
+                .get('main_image', {})
+                .get('data')
+            )
+            store_image_url = None
+            if main_image:
+                store_image_url = store_images_urls.get(main_image['id'])
+            changes = get_product_changes(
+                product=product,
+                store_product=store_product,
+                store_image_url=store_image_url,
+                store_price=store_prices.get(sku),
+                price_book_id=price_book_id,
+            )
+            if not changes:
+                stats['unchanged'] += 1
+                continue
+            future = executor.submit(
+                apply_product_changes,
+                elastic_connection=elastic_connection,
+                product=product,
+                product_id=store_product['id'],
+                store_price=store_prices.get(sku),
+                price_book_id=price_book_id,
+                changes=changes,
+            )
+            pending_changes[future] = (sku, 'updated')
+
+        if delete_missing:
+            for sku, store_product in store_products.items():
+                if sku in menu_skus:
+                    continue
+                future = executor.submit(
+                    delete_store_product,
+                    elastic_connection=elastic_connection,
+                    product_id=store_product['id'],
+                    store_price=store_prices.get(sku),
+                    price_book_id=price_book_id,
+                )
+                pending_changes[future] = (sku, 'deleted')
+
+        for future in as_completed(pending_changes):
+            sku, change = pending_changes[future]
+            try:
+                future.result()
+            except requests.RequestException as error:
+                stats['failed'] += 1
+                print(f'The product {sku} is not {change}: {error}')
+                continue
+            stats[change] += 1
+            if change == 'deleted':
+                journal.record(sku, 'reset', None)
+
+    new_products = [
+        product for product in menu
+        if str(product['id']) not in store_products
+    ]
+    new_products_ids, failed_steps_number = load_products(
+        elastic_connection=elastic_connection,
+        menu=new_products,
+        price_book_id=price_book_id,
+        workers=workers,
+        journal=journal,
+        store_products_ids={},
+    )
+    stats['created'] = len(new_products_ids)
+    stats['failed'] += failed_steps_number
+    return new_products_ids, stats
+
+
+def print_stats(
+    elastic_connection: ElasticConnection,
+    products_number: int,
+    elapsed_time: float,
+) -> None:
+    request_stats = elastic_connection.get_request_stats()
+    requests_number = request_stats['requests']
+    elapsed_time = max(elapsed_time, 1e-6)
+    print(
+        f'Loaded {products_number} products ({requests_number} requests) '
+        f'in {elapsed_time:.1f} s: '
+        f'{products_number / elapsed_time:.2f} products/s, '
+        f'{requests_number / elapsed_time:.2f} requests/s'
+    )
+    print(
+        f'Rate limit wait: {request_stats["rate_limit_wait_seconds"]:.1f} s, '
+        f'retries: {request_stats["retries"]}, '
+        f'retry wait: {request_stats["retry_wait_seconds"]:.1f} s'
+    )
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    env = Env()
+    env.read_env()
+    with env.prefixed('ELASTIC_'):
+        elastic_connection = ElasticConnection(
+            client_id=env('PATH_CLIENT_ID'),
+            client_secret=env('PATH_CLIENT_SECRET'),
+            pool_maxsize=args.workers,
+            requests_per_second=args.rate,
+        )
+
+    with open(args.file, 'r', encoding="UTF-8") as file:
+        menu = json.load(file)
+
+    journal = Journal(args.journal or f'{args.file}.journal')
+    started_at = time.monotonic()
+    store_products = list(elastic_connection.iter_products(prefetch=True))
+    if args.sync:
+        products_ids, sync_stats = sync_products(
+            elastic_connection=elastic_connection,
+            menu=menu,
+            price_book_id=args.price_book_id,
+            workers=args.workers,
+            journal=journal,
+            store_products=store_products,
+            delete_missing=args.delete_missing,
+        )
+        failed_steps_number = sync_stats['failed']
+        print(
+            f'Created: {sync_stats["created"]}, '
+            f'updated: {sync_stats["updated"]}, '
+            f'deleted: {sync_stats["deleted"]}, '
+            f'unchanged: {sync_stats["unchanged"]}'
+        )
+    else:
+        products_ids, failed_steps_number = load_products(
+            elastic_connection=elastic_connection,
+            menu=menu,
+            price_book_id=args.price_book_id,
+            workers=args.workers,
+            journal=journal,
+            store_products_ids={
+                store_product['attributes']['sku']: store_product['id']
+                for store_product in store_products
+            },
+        )
+    journal.close()
+
+    if (
+        args.hierarchy_id
+        and args.node_id
+        and products_ids
+        and not failed_steps_number
+    ):
+        elastic_connection.create_products_relationships(
+            hierarchy_id=args.hierarchy_id,
+            node_id=args.node_id,
+            products_ids=products_ids
+        )
+
+    print_stats(
+        elastic_connection=elastic_connection,
+        products_number=len(products_ids),
+        elapsed_time=time.monotonic() - started_at,
     )
+    elastic_connection.close()
+    if failed_steps_number:
+        sys.exit(
+            f'{failed_steps_number} steps failed, '
+            'run the script again to resume the loading'
+        )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from catalog_cache import CatalogCache, create_expiring_cache
+from elastic_api import ElasticConnection
+
+logger = logging.getLogger(__file__)
+
+
+class MenuPage():
+    __slots__ = ('page_offset', 'reply_markup', 'total_products_number')
+
+    def __init__(
+        self,
+        page_offset: int,
+        reply_markup: InlineKeyboardMarkup,
+        total_products_number: int,
+    ):
+        self.page_offset = page_offset
+        self.reply_markup = reply_markup
+        self.total_products_number = total_products_number
+
+
+def render_menu_page(
+    products_response: Dict,
+    page_limit: int,
+    page_offset: int,
+) -> MenuPage:
+    keyboard = []
+    total_products_number = 0
+    if products_response['data']:
+        for product in products_response['data']:
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        product['attributes']['name'],
+                        callback_data=product['id']
+                    )
+                ]
+            )
+        total_products_number = products_response['meta']['results']['total']
+        pagination_buttons = []
+        if page_offset > 0:
+            callback_data = f'pagination: {page_offset - page_limit}'
+            pagination_buttons.append(
+                InlineKeyboardButton(text='<<', callback_data=callback_data)
+            )
+        if total_products_number > page_offset + page_limit:
+            callback_data = f'pagination: {page_offset + page_limit}'
+            pagination_buttons.append(
+                InlineKeyboardButton(text='>>', callback_data=callback_data)
+            )
+        if pagination_buttons:
+            keyboard.append(pagination_buttons)
+    keyboard.append(
+        [InlineKeyboardButton(text='Корзина', callback_data='Cart')]
+    )
+    return MenuPage(
+        page_offset=page_offset,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        total_products_number=total_products_number,
+    )
+
+
+class MenuPages():
+    """
+    The menu pages rendered once and shared by all the chats.
+    The pages are kept in the catalog cache of the Elastic connection,
+    so they are keyed by the catalog release and rendered again
+    after a new release. Without the catalog cache the pages are kept
+    in an own cache for cache_ttl seconds. The neighbours of a page
+    can be rendered in the background before the user paginates to them.
+    """
+
+    def __init__(
+        self,
+        elastic_connection: ElasticConnection,
+        page_limit: int = 8,
+        prefetch_workers: int = 1,
+        cache_size: int = 256,
+        cache_ttl: float = 60,
+    ):
+        self.elastic_connection = elastic_connection
+        self.page_limit = page_limit
+        self.own_cache = create_expiring_cache(
+            maxsize=cache_size,
+            ttl=cache_ttl,
+        )
+        self.executor = None
+        if prefetch_workers:
+            self.executor = ThreadPoolExecutor(
+                max_workers=prefetch_workers,
+                thread_name_prefix='menu-pages-prefetch',
+            )
+        self.prefetched_keys = set()
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    def get_cache(self) -> CatalogCache:
+        return self.elastic_connection.catalog_cache or self.own_cache
+
+    def get_key(self, page_offset: int):
+        return ('menu_page', self.page_limit, page_offset)
+
+    def render(self, page_offset: int) -> MenuPage:
+        products_response = self.elastic_connection.get_products_page(
+            page_limit=self.page_limit,
+            page_offset=page_offset,
+        )
+        return render_menu_page(
+            products_response=products_response,
+            page_limit=self.page_limit,
+            page_offset=page_offset,
+        )
+
+    def get_page(self, page_offset: int, prefetch: bool = False) -> MenuPage:
+        menu_page = self.get_cache().get_or_fetch(
+            self.get_key(page_offset),
+            lambda: self.render(page_offset),
+        )
+        if prefetch and self.executor:
+            for adjacent_offset in (
+                page_offset - self.page_limit,
+                page_offset + self.page_limit,
+            ):
+                if 0 <= adjacent_offset < menu_page.total_products_number:
+                    self.prefetch(adjacent_offset)
+        return menu_page
+
+    def prefetch(self, page_offset: int) -> None:
+        key = self.get_key(page_offset)
+        cache = self.get_cache()
+        with self.lock:
+            if key in cache or key in self.prefetched_keys:
+                return
+            self.prefetched_keys.add(key)
+        self.executor.submit(self.prefetch_page, key, page_offset)
+
+    def prefetch_page(self, key, page_offset: int) -> None:
+        try:
+            self.get_cache().get_or_fetch(
+                key,
+                lambda: self.render(page_offset),
+            )
+        except requests.RequestException:
+            logger.exception('The menu page %s is not prefetched', page_offset)
+        finally:
+            with self.lock:
+                self.prefetched_keys.discard(key)
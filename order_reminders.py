@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+from redis import Redis
+from redis.exceptions import RedisError
+from telegram import Bot, ParseMode
+from telegram.error import BadRequest, NetworkError
+
+from send_queue import BACKGROUND, SendQueueClosed
+
+logger = logging.getLogger(__file__)
+
+REMINDERS_KEY = 'pizza_shop_reminders'
+
+
+class OrderReminders():
+    """
+    The reminders are kept in a Redis sorted set: the member is the chat id,
+    the score is the due time. Every bot process polls the due reminders
+    in batches and takes a reminder by removing it from the set, so one
+    reminder is sent by one process, and the pending reminders survive
+    the restarts. The reminders go to the send queue of the bot, at most
+    max_pending at a time, so a burst of the due reminders does not
+    overflow the memory. A reminder is taken before it is sent, so it can
+    be lost if the process is killed in between, but never sent twice.
+    """
+
+    def __init__(
+        self,
+        redis_connection: Redis,
+        bot: Bot,
+        text: str,
+        wait: float = 3600,
+        poll_interval: float = 1,
+        batch_size: int = 100,
+        max_pending: int = 1000,
+        retry_delay: float = 60,
+    ):
+        self.redis_connection = redis_connection
+        self.bot = bot
+        self.text = text
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.poll_thread = None
+
+    def schedule(self, chat_id: int) -> None:
+        self.redis_connection.zadd(
+            REMINDERS_KEY,
+            {str(chat_id): time.time() + self.wait},
+        )
+
+    def claim_due(self, limit: int) -> List[int]:
+        chat_ids = self.redis_connection.zrangebyscore(
+            REMINDERS_KEY,
+            '-inf',
+            time.time(),
+            start=0,
+            num=limit,
+        )
+        if not chat_ids:
+            return []
+        # The other processes may read the same batch,
+        # the reminder belongs to the one that removed it
+        pipeline = self.redis_connection.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipeline.zrem(REMINDERS_KEY, chat_id)
+        return [
+            int(chat_id)
+            for chat_id, is_removed in zip(chat_ids, pipeline.execute())
+            if is_removed
+        ]
+
+    def send(self, chat_id: int) -> None:
+        with self.lock:
+            self.pending += 1
+        future = self.bot.send_message(
+            chat_id,
+            text=self.text,
+            parse_mode=ParseMode.HTML,
+            priority=BACKGROUND,
+        )
+        future.add_done_callback(
+            lambda future: self.handle_result(chat_id, future)
+        )
+
+    def handle_result(self, chat_id: int, future: Future) -> None:
+        error = future.exception()
+        with self.lock:
+            self.pending -= 1
+            if error:
+                self.failed += 1
+            else:
+                self.sent += 1
+        if not error:
+            return
+        logger.warning('The reminder to %s is not sent: %r', chat_id, error)
+        # BadRequest is a NetworkError too, but it fails again
+        is_temporary = (
+            isinstance(error, (NetworkError, SendQueueClosed))
+            and not isinstance(error, BadRequest)
+        )
+        if is_temporary:
+            try:
+                self.redis_connection.zadd(
+                    REMINDERS_KEY,
+                    {str(chat_id): time.time() + self.retry_delay},
+                )
+            except RedisError:
+                logger.exception('The reminder to %s is lost', chat_id)
+
+    def poll(self) -> int:
+        with self.lock:
+            limit = min(self.batch_size, self.max_pending - self.pending)
+        if limit <= 0:
+            return 0
+        chat_ids = self.claim_due(limit)
+        for chat_id in chat_ids:
+            self.send(chat_id)
+        return len(chat_ids)
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                claimed = self.poll()
+            except RedisError:
+                logger.exception('The reminders are not polled')
+                claimed = 0
+            if claimed < self.batch_size:
+                self.stopped.wait(self.poll_interval)
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.poll_thread = threading.Thread(
+            target=self.run,
+            name='order-reminders',
+            daemon=True,
+        )
+        self.poll_thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.poll_thread:
+            self.poll_thread.join()
+            self.poll_thread = None
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = {
+                'pending': self.pending,
+                'sent': self.sent,
+                'failed': self.failed,
+            }
+        stats['scheduled'] = self.redis_connection.zcard(REMINDERS_KEY)
+        return stats
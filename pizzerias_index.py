@@ -0,0 +1,310 @@
+import hashlib
+import heapq
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+from geopy.distance import distance
+
+from elastic_api import ElasticConnection
+
+logger = logging.getLogger(__file__)
+
+EARTH_RADIUS_KM = 6371.0088
+# The geodesic distance on the WGS-84 ellipsoid differs
+# from the distance on the mean sphere by less than 0.6%
+SPHERE_ERROR = 0.01
+LEAF_SIZE = 8
+PIZZERIA_FIELDS = (
+    'id',
+    'alias',
+    'address',
+    'latitude',
+    'longitude',
+    'courier_tg_id',
+)
+
+
+def to_unit_vector(latitude: float, longitude: float) -> Tuple[float, ...]:
+    latitude = math.radians(latitude)
+    longitude = math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def km_to_chord(distance_km: float) -> float:
+    angle = min(distance_km / EARTH_RADIUS_KM, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+def chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1))
+
+
+def has_coordinates(pizzeria: Dict) -> bool:
+    try:
+        float(pizzeria['latitude'])
+        float(pizzeria['longitude'])
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def fetch_pizzerias(elastic_connection: ElasticConnection) -> List[Dict]:
+    """
+    Fetches all the pizzerias flow entries with the fields the bot needs,
+    the entries without coordinates are skipped.
+    """
+    pizzerias = []
+    for entry in elastic_connection.iter_custom_flow_entries(
+        slug='pizzerias',
+        prefetch=True,
+    ):
+        pizzeria = {field: entry.get(field) for field in PIZZERIA_FIELDS}
+        if not has_coordinates(pizzeria):
+            logger.warning(
+                'The pizzeria %s (%s) has no coordinates, it is skipped',
+                pizzeria['alias'],
+                pizzeria['id'],
+            )
+            continue
+        pizzerias.append(pizzeria)
+    return pizzerias
+
+
+def get_pizzerias_fingerprint(pizzerias: List[Dict]) -> str:
+    fingerprint = hashlib.sha1()
+    for pizzeria in pizzerias:
+        fingerprint.update(
+            repr(
+                (
+                    pizzeria.get('id'),
+                    pizzeria.get('alias'),
+                    pizzeria['latitude'],
+                    pizzeria['longitude'],
+                    pizzeria.get('address'),
+                    pizzeria.get('courier_tg_id'),
+                )
+            ).encode()
+        )
+    return fingerprint.hexdigest()
+
+
+class KDNode():
+    __slots__ = ('axis', 'split', 'left', 'right', 'points')
+
+    def __init__(
+        self,
+        axis=None,
+        split=None,
+        left=None,
+        right=None,
+        points=None,
+    ):
+        self.axis = axis
+        self.split = split
+        self.left = left
+        self.right = right
+        self.points = points
+
+
+def build_kd_tree(points: List[Tuple]) -> Optional[KDNode]:
+    """
+    The points are (x, y, z, pizzeria index) tuples.
+    """
+    if not points:
+        return None
+    if len(points) <= LEAF_SIZE:
+        return KDNode(points=points)
+
+    spreads = [
+        max(point[axis] for point in points)
+        - min(point[axis] for point in points)
+        for axis in range(3)
+    ]
+    axis = spreads.index(max(spreads))
+    points = sorted(points, key=lambda point: point[axis])
+    middle = len(points) // 2
+    return KDNode(
+        axis=axis,
+        split=points[middle][axis],
+        left=build_kd_tree(points[:middle]),
+        right=build_kd_tree(points[middle:]),
+    )
+
+
+class PizzeriasIndex():
+    """
+    k-d tree of the pizzerias on the unit sphere.
+    The candidates are found by the chord distance, which grows
+    with the great-circle distance, then the geodesic distance
+    is computed for the candidates only.
+    """
+
+    def __init__(self, pizzerias: List[Dict]):
+        self.pizzerias = pizzerias
+        self.fingerprint = get_pizzerias_fingerprint(pizzerias)
+        self.coordinates = [
+            (float(pizzeria['latitude']), float(pizzeria['longitude']))
+            for pizzeria in pizzerias
+        ]
+        points = [
+            (*to_unit_vector(latitude, longitude), index)
+            for index, (latitude, longitude) in enumerate(self.coordinates)
+        ]
+        self.root = build_kd_tree(points)
+        self.aliases = {
+            pizzeria['alias']: pizzeria
+            for pizzeria in pizzerias
+        }
+
+    def __len__(self):
+        return len(self.pizzerias)
+
+    def get_by_alias(self, alias: str) -> Optional[Dict]:
+        return self.aliases.get(alias)
+
+    def matches(self, pizzerias: List[Dict]) -> bool:
+        return self.fingerprint == get_pizzerias_fingerprint(pizzerias)
+
+    def search_nearest_chords(
+        self,
+        target: Tuple[float, ...],
+        k: int,
+    ) -> List[Tuple[float, int]]:
+        # Max-heap of the k nearest points by the squared chord
+        nearest = []
+
+        def visit(node):
+            if node is None:
+                return
+            if node.points is not None:
+                for x, y, z, index in node.points:
+                    squared_chord = (
+                        (x - target[0]) ** 2
+                        + (y - target[1]) ** 2
+                        + (z - target[2]) ** 2
+                    )
+                    if len(nearest) < k:
+                        heapq.heappush(nearest, (-squared_chord, index))
+                    elif squared_chord < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-squared_chord, index))
+                return
+            delta = target[node.axis] - node.split
+            near, far = (node.left, node.right)
+            if delta >= 0:
+                near, far = far, near
+            visit(near)
+            if len(nearest) < k or delta ** 2 < -nearest[0][0]:
+                visit(far)
+
+        visit(self.root)
+        return sorted(
+            (math.sqrt(-squared_chord), index)
+            for squared_chord, index in nearest
+        )
+
+    def search_chord_radius(
+        self,
+        target: Tuple[float, ...],
+        chord: float,
+    ) -> List[int]:
+        squared_radius = chord ** 2
+        found = []
+
+        def visit(node):
+            if node is None:
+                return
+            if node.points is not None:
+                for x, y, z, index in node.points:
+                    squared_chord = (
+                        (x - target[0]) ** 2
+                        + (y - target[1]) ** 2
+                        + (z - target[2]) ** 2
+                    )
+                    if squared_chord <= squared_radius:
+                        found.append(index)
+                return
+            delta = target[node.axis] - node.split
+            if delta < 0 or delta ** 2 <= squared_radius:
+                visit(node.left)
+            if delta >= 0 or delta ** 2 <= squared_radius:
+                visit(node.right)
+
+        visit(self.root)
+        return found
+
+    def get_exact_distances(
+        self,
+        latitude: float,
+        longitude: float,
+        indexes: List[int],
+    ) -> List[Tuple[float, Dict]]:
+        distances = [
+            (
+                distance((latitude, longitude), self.coordinates[index]).km,
+                index,
+            )
+            for index in indexes
+        ]
+        distances.sort()
+        return [
+            (distance_km, self.pizzerias[index])
+            for distance_km, index in distances
+        ]
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int = 1,
+    ) -> List[Tuple[float, Dict]]:
+        """
+        Returns up to k (geodesic distance in km, pizzeria) pairs,
+        the nearest first.
+        """
+        if not self.root:
+            return []
+        target = to_unit_vector(latitude, longitude)
+        nearest_chords = self.search_nearest_chords(target, k)
+        farthest_km = chord_to_km(nearest_chords[-1][0])
+        # Any pizzeria that can be nearer on the ellipsoid
+        # is within this distance on the sphere
+        candidates_radius_km = (
+            farthest_km * (1 + SPHERE_ERROR) / (1 - SPHERE_ERROR)
+        )
+        candidates = self.search_chord_radius(
+            target,
+            km_to_chord(candidates_radius_km),
+        )
+        return self.get_exact_distances(latitude, longitude, candidates)[:k]
+
+    def within_radius(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+    ) -> List[Tuple[float, Dict]]:
+        """
+        Returns the (geodesic distance in km, pizzeria) pairs
+        within the radius, the nearest first.
+        """
+        if not self.root:
+            return []
+        target = to_unit_vector(latitude, longitude)
+        candidates = self.search_chord_radius(
+            target,
+            km_to_chord(radius_km * (1 + SPHERE_ERROR)),
+        )
+        return [
+            (distance_km, pizzeria)
+            for distance_km, pizzeria in self.get_exact_distances(
+                latitude,
+                longitude,
+                candidates,
+            )
+            if distance_km <= radius_km
+        ]
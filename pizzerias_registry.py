@@ -0,0 +1,178 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from redis import Redis
+
+from delivery_grid import DeliveryGrid, get_delivery_tier
+from delivery_zones import DeliveryZone, DeliveryZones
+from elastic_api import ElasticConnection
+from pizzerias_index import PizzeriasIndex, fetch_pizzerias
+
+logger = logging.getLogger(__file__)
+
+INVALIDATION_CHANNEL = 'pizzerias_invalidated'
+
+
+def publish_pizzerias_invalidation(redis_connection: Redis) -> None:
+    redis_connection.publish(INVALIDATION_CHANNEL, 'pizzerias')
+
+
+class PizzeriasRegistry():
+    """
+    Process-local copy of the pizzerias flow entries with a spatial index.
+    The entries are reloaded in a background thread every refresh_interval
+    seconds and when an invalidation message comes through Redis pub/sub,
+    so the handlers read them without network requests.
+    If delivery_grid_cell_km is set, the delivery grid is taken from
+    delivery_grid_path (if it was built for the same pizzerias)
+    or built on every reload.
+    """
+
+    def __init__(
+        self,
+        elastic_connection: ElasticConnection,
+        refresh_interval: float = 300,
+        redis_connection: Optional[Redis] = None,
+        delivery_grid_cell_km: float = 0,
+        delivery_grid_path: Optional[str] = None,
+    ):
+        self.elastic_connection = elastic_connection
+        self.refresh_interval = refresh_interval
+        self.redis_connection = redis_connection
+        self.delivery_grid_cell_km = delivery_grid_cell_km
+        self.delivery_grid_path = delivery_grid_path
+        self.index = PizzeriasIndex([])
+        self.delivery_grid = None
+        self.refresh_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.refresh_thread = None
+        self.pubsub = None
+        self.pubsub_thread = None
+
+    def load(self) -> None:
+        pizzerias = fetch_pizzerias(self.elastic_connection)
+        if self.index.matches(pizzerias):
+            return
+        # The handlers keep using the old index until the new one is built
+        index = PizzeriasIndex(pizzerias)
+        delivery_grid = None
+        if self.delivery_grid_cell_km and pizzerias:
+            delivery_grid = self.load_delivery_grid(pizzerias)
+        self.index, self.delivery_grid = index, delivery_grid
+        logger.info('%s pizzerias are loaded', len(pizzerias))
+
+    def load_delivery_grid(self, pizzerias) -> Optional[DeliveryGrid]:
+        if self.delivery_grid_path and os.path.exists(
+            self.delivery_grid_path
+        ):
+            delivery_grid = DeliveryGrid.load(
+                self.delivery_grid_path,
+                pizzerias,
+            )
+            if delivery_grid:
+                return delivery_grid
+        try:
+            delivery_grid = DeliveryGrid.build(
+                pizzerias=pizzerias,
+                cell_size_km=self.delivery_grid_cell_km,
+            )
+        except ValueError as error:
+            # The lookups fall back to the spatial index
+            logger.warning('The delivery grid is not built: %s', error)
+            return None
+        logger.info(
+            'The delivery grid is built: %s x %s cells',
+            delivery_grid.rows,
+            delivery_grid.columns,
+        )
+        return delivery_grid
+
+    def find_nearest(
+        self,
+        latitude: float,
+        longitude: float,
+    ) -> Optional[Tuple[float, Dict, int]]:
+        """
+        Returns the distance in km to the nearest pizzeria,
+        the pizzeria and the delivery tier, or None if there are
+        no pizzerias.
+        """
+        delivery_grid = self.delivery_grid
+        if delivery_grid:
+            resolved = delivery_grid.resolve(latitude, longitude)
+            if resolved:
+                return resolved
+        nearest = self.index.nearest(latitude, longitude)
+        if not nearest:
+            return None
+        distance_km, pizzeria = nearest[0]
+        return distance_km, pizzeria, get_delivery_tier(distance_km)
+
+    def find_delivery_zone(
+        self,
+        latitude: float,
+        longitude: float,
+        delivery_zones: DeliveryZones,
+    ) -> Tuple[Optional[DeliveryZone], Optional[Dict]]:
+        """
+        Returns the cheapest zone that contains the point
+        and the pizzeria of the zone, or Nones if there are no such zones.
+        """
+        index = self.index
+        for delivery_zone in delivery_zones.find(latitude, longitude):
+            pizzeria = index.get_by_alias(delivery_zone.pizzeria_alias)
+            if pizzeria:
+                return delivery_zone, pizzeria
+        return None, None
+
+    def invalidate(self) -> None:
+        self.refresh_requested.set()
+
+    def start(self) -> None:
+        self.load()
+        self.stopped.clear()
+        self.refresh_thread = threading.Thread(
+            target=self.refresh,
+            name='pizzerias-registry-refresh',
+            daemon=True,
+        )
+        self.refresh_thread.start()
+        if not self.redis_connection:
+            return
+        self.pubsub = self.redis_connection.pubsub(
+            ignore_subscribe_messages=True
+        )
+        self.pubsub.subscribe(
+            **{INVALIDATION_CHANNEL: lambda message: self.invalidate()}
+        )
+        self.pubsub_thread = self.pubsub.run_in_thread(
+            sleep_time=1,
+            daemon=True,
+        )
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.refresh_requested.set()
+        if self.refresh_thread:
+            self.refresh_thread.join()
+            self.refresh_thread = None
+        if self.pubsub_thread:
+            self.pubsub_thread.stop()
+            self.pubsub_thread = None
+        if self.pubsub:
+            self.pubsub.close()
+            self.pubsub = None
+
+    def refresh(self) -> None:
+        while not self.stopped.is_set():
+            self.refresh_requested.wait(self.refresh_interval)
+            self.refresh_requested.clear()
+            if self.stopped.is_set():
+                return
+            # Any error keeps the loaded pizzerias and the thread alive
+            try:
+                self.load()
+            except Exception:
+                logger.exception('The pizzerias are not reloaded')
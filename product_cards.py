@@ -0,0 +1,148 @@
+import html
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable
+
+from elastic_api import ElasticConnection
+
+logger = logging.getLogger(__file__)
+
+
+class ProductCard():
+    __slots__ = ('product_id', 'caption', 'price', 'image_id')
+
+    def __init__(
+        self,
+        product_id: str,
+        caption: str,
+        price: float,
+        image_id: str,
+    ):
+        self.product_id = product_id
+        self.caption = caption
+        self.price = price
+        self.image_id = image_id
+
+
+def render_product_card(product: Dict) -> ProductCard:
+    price = product["attributes"]["price"]["RUB"]["amount"]
+    formatted_price = '{:.2f}'.format(price)
+    caption = (
+        f'<b>{html.escape(product["attributes"]["name"], quote=True)}</b>\n\n'
+        f'<em>{formatted_price} руб. за шт.</em>\n\n'
+        f'{html.escape(product["attributes"]["description"], quote=True)}'
+    )
+    return ProductCard(
+        product_id=product['id'],
+        caption=caption,
+        price=price,
+        image_id=product['relationships']['main_image']['data']['id'],
+    )
+
+
+class ProductCards():
+    """
+    The product cards (caption, price and main image id) rendered once
+    and shared by all the chats. The cards are kept until a new catalog
+    release is found by the catalog cache of the Elastic connection;
+    without the catalog cache they are rendered again every cache_ttl
+    seconds. The warm thread renders the cards of all the products
+    at startup and again after every new release or expiry,
+    so the steady state needs no Elastic requests.
+    """
+
+    def __init__(
+        self,
+        elastic_connection: ElasticConnection,
+        warm_workers: int = 4,
+        cache_ttl: float = 300,
+        warm_check_interval: float = 10,
+    ):
+        self.elastic_connection = elastic_connection
+        self.warm_workers = warm_workers
+        self.cache_ttl = cache_ttl
+        self.warm_check_interval = warm_check_interval
+        self.release_id = None
+        self.cards = {}
+        self.warmed_release_id = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.warm_thread = None
+
+    def get_release_id(self) -> Hashable:
+        catalog_cache = self.elastic_connection.catalog_cache
+        if catalog_cache:
+            return catalog_cache.get_release_id()
+        return int(time.time() // self.cache_ttl)
+
+    def get_cards(self) -> Dict[str, ProductCard]:
+        release_id = self.get_release_id()
+        with self.lock:
+            if release_id != self.release_id:
+                self.release_id = release_id
+                self.cards = {}
+            return self.cards
+
+    def render(self, product_id: str) -> ProductCard:
+        product = self.elastic_connection.get_product(product_id)['data']
+        return render_product_card(product)
+
+    def get_card(self, product_id: str) -> ProductCard:
+        # The cards of an old release go away with their dictionary
+        cards = self.get_cards()
+        product_card = cards.get(product_id)
+        if not product_card:
+            product_card = self.render(product_id)
+            cards[product_id] = product_card
+        return product_card
+
+    def warm(self) -> None:
+        release_id = self.get_release_id()
+        products_ids = [
+            product['id']
+            for product in self.elastic_connection.iter_products(
+                prefetch=True,
+            )
+        ]
+        with ThreadPoolExecutor(max_workers=self.warm_workers) as executor:
+            for product_id, future in [
+                (product_id, executor.submit(self.get_card, product_id))
+                for product_id in products_ids
+            ]:
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception(
+                        'The card of the product %s is not rendered',
+                        product_id,
+                    )
+        self.warmed_release_id = release_id
+        logger.info('%s product cards are rendered', len(products_ids))
+
+    def run_warming(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                if self.get_release_id() != self.warmed_release_id:
+                    self.warm()
+            except Exception:
+                logger.exception('The product cards are not warmed')
+            self.stopped.wait(self.warm_check_interval)
+
+    def start_warming(self) -> None:
+        if not self.warm_workers:
+            return
+        self.stopped.clear()
+        self.warm_thread = threading.Thread(
+            target=self.run_warming,
+            name='product-cards-warm',
+            daemon=True,
+        )
+        self.warm_thread.start()
+
+    def stop_warming(self) -> None:
+        self.stopped.set()
+        if self.warm_thread:
+            self.warm_thread.join()
+            self.warm_thread = None
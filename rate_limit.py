@@ -0,0 +1,42 @@
+import threading
+import time
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket: rate tokens are added per second,
+    at most capacity tokens are stored for bursts.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Takes the tokens and returns the delay (in seconds)
+        after which the caller is allowed to proceed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated_at) * self.rate,
+            )
+            self.updated_at = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Waits for the tokens and returns the waiting time (in seconds).
+        """
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
@@ -0,0 +1,354 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__file__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class SendQueueClosed(Exception):
+    pass
+
+
+class SendTask():
+    __slots__ = (
+        'priority', 'number', 'chat_id', 'function', 'args', 'kwargs',
+        'future', 'queued_at', 'retries', 'chat_reserved',
+    )
+
+    def __init__(
+        self,
+        priority: int,
+        number: int,
+        chat_id: Optional[Hashable],
+        function: Callable,
+        args: tuple,
+        kwargs: dict,
+    ):
+        self.priority = priority
+        self.number = number
+        self.chat_id = chat_id
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.monotonic()
+        self.retries = 0
+        self.chat_reserved = False
+
+    def __lt__(self, other: 'SendTask') -> bool:
+        return (self.priority, self.number) < (other.priority, other.number)
+
+
+class SendQueue():
+    """
+    The outgoing Telegram requests wait here for the global token bucket
+    (30 messages per second for a bot) and for the token bucket of their
+    chat (1 message per second). The interactive replies go before
+    the background ones (reminders, courier notifications), the requests
+    of one priority go in the order of submission. A request that waits
+    for its chat is put aside, so it does not hold the other chats.
+    The flood-wait answers (429 with retry_after) are retried later.
+    """
+
+    def __init__(
+        self,
+        rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        workers: int = 8,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.bucket = TokenBucket(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_chats = max_chats
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='tg-send',
+        )
+        self.numbers = itertools.count()
+        self.ready_tasks = []
+        self.delayed_tasks = []
+        self.condition = threading.Condition()
+        self.is_closed = False
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'flood_waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+        }
+        self.scheduler_thread = threading.Thread(
+            target=self.schedule,
+            name='tg-send-scheduler',
+            daemon=True,
+        )
+        self.scheduler_thread.start()
+
+    def close(self) -> None:
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+        self.scheduler_thread.join()
+        self.executor.shutdown(wait=True)
+        with self.condition:
+            tasks = self.ready_tasks + [
+                task for _, _, task in self.delayed_tasks
+            ]
+            self.ready_tasks = []
+            self.delayed_tasks = []
+        for task in tasks:
+            task.future.set_exception(SendQueueClosed())
+
+    def submit(
+        self,
+        chat_id: Optional[Hashable],
+        function: Callable,
+        *args,
+        priority: int = INTERACTIVE,
+        **kwargs,
+    ) -> Future:
+        task = SendTask(
+            priority,
+            next(self.numbers),
+            chat_id,
+            function,
+            args,
+            kwargs,
+        )
+        with self.condition:
+            if self.is_closed:
+                # Nobody would send it, so the waiting caller would hang
+                task.future.set_exception(SendQueueClosed())
+                return task.future
+            heapq.heappush(self.ready_tasks, task)
+            self.condition.notify()
+        return task.future
+
+    def delay(self, task: SendTask, delay: float) -> None:
+        with self.condition:
+            heapq.heappush(
+                self.delayed_tasks,
+                (time.monotonic() + delay, task.number, task),
+            )
+            self.condition.notify()
+
+    def get_chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        chat_bucket = self.chat_buckets.get(chat_id)
+        if chat_bucket:
+            return chat_bucket
+        if len(self.chat_buckets) >= self.max_chats:
+            # The buckets that are full again are the same as the new ones
+            refill_time = self.chat_burst / self.chat_rate
+            now = time.monotonic()
+            self.chat_buckets = {
+                bucket_chat_id: bucket
+                for bucket_chat_id, bucket in self.chat_buckets.items()
+                if now - bucket.updated_at < refill_time
+            }
+        chat_bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self.chat_buckets[chat_id] = chat_bucket
+        return chat_bucket
+
+    def get_next_task(self) -> Optional[SendTask]:
+        with self.condition:
+            while not self.is_closed:
+                now = time.monotonic()
+                while self.delayed_tasks and self.delayed_tasks[0][0] <= now:
+                    _, _, task = heapq.heappop(self.delayed_tasks)
+                    heapq.heappush(self.ready_tasks, task)
+                if self.ready_tasks:
+                    return heapq.heappop(self.ready_tasks)
+                timeout = None
+                if self.delayed_tasks:
+                    timeout = self.delayed_tasks[0][0] - now
+                self.condition.wait(timeout)
+        return None
+
+    def schedule(self) -> None:
+        while True:
+            task = self.get_next_task()
+            if not task:
+                break
+            if task.chat_id is not None and not task.chat_reserved:
+                task.chat_reserved = True
+                chat_delay = self.get_chat_bucket(task.chat_id).reserve()
+                if chat_delay:
+                    self.delay(task, chat_delay)
+                    continue
+            self.bucket.acquire()
+            self.executor.submit(self.send, task)
+
+    def send(self, task: SendTask) -> None:
+        wait_time = time.monotonic() - task.queued_at
+        try:
+            result = task.function(*task.args, **task.kwargs)
+        except RetryAfter as error:
+            with self.condition:
+                self.stats['flood_waits'] += 1
+            if task.retries < self.max_retries:
+                logger.warning(
+                    'Flood wait %s s for the chat %s',
+                    error.retry_after,
+                    task.chat_id,
+                )
+                task.retries += 1
+                self.delay(task, error.retry_after)
+                return
+            self.fail(task, error)
+        except Exception as error:
+            self.fail(task, error)
+        else:
+            task.future.set_result(result)
+            with self.condition:
+                self.stats['sent'] += 1
+                self.stats['wait_time'] += wait_time
+                self.stats['max_wait_time'] = max(
+                    self.stats['max_wait_time'],
+                    wait_time,
+                )
+
+    def fail(self, task: SendTask, error: Exception) -> None:
+        # The futures of the background requests are often not read,
+        # so the error is logged here
+        logger.warning(
+            'The request to the chat %s is not sent: %s: %s',
+            task.chat_id,
+            type(error).__name__,
+            error,
+        )
+        task.future.set_exception(error)
+        with self.condition:
+            self.stats['failed'] += 1
+
+    def get_stats(self) -> Dict:
+        with self.condition:
+            stats = dict(self.stats)
+            stats['ready'] = len(self.ready_tasks)
+            stats['delayed'] = len(self.delayed_tasks)
+        if stats['sent']:
+            stats['average_wait_time'] = stats['wait_time'] / stats['sent']
+        return stats
+
+
+def get_chat_id(args: tuple, kwargs: dict) -> Optional[Hashable]:
+    if 'chat_id' in kwargs:
+        return kwargs['chat_id']
+    return args[0] if args else None
+
+
+class QueuedBot(Bot):
+    """
+    The bot sends the messages through the send queue. The interactive
+    requests wait for the result as usual, the background ones
+    (priority=BACKGROUND) return the future at once.
+    """
+
+    def __init__(self, token: str, send_queue: SendQueue, **kwargs):
+        super().__init__(token, **kwargs)
+        self.send_queue = send_queue
+
+    def enqueue(
+        self,
+        function: Callable,
+        chat_id: Optional[Hashable],
+        args: tuple,
+        kwargs: dict,
+        priority: int,
+    ):
+        future = self.send_queue.submit(
+            chat_id,
+            function,
+            *args,
+            priority=priority,
+            **kwargs,
+        )
+        if priority == INTERACTIVE:
+            return future.result()
+        return future
+
+    def send_message(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().send_message,
+            get_chat_id(args, kwargs),
+            args,
+            kwargs,
+            priority,
+        )
+
+    def send_photo(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().send_photo,
+            get_chat_id(args, kwargs),
+            args,
+            kwargs,
+            priority,
+        )
+
+    def send_location(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().send_location,
+            get_chat_id(args, kwargs),
+            args,
+            kwargs,
+            priority,
+        )
+
+    def send_invoice(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().send_invoice,
+            get_chat_id(args, kwargs),
+            args,
+            kwargs,
+            priority,
+        )
+
+    # The edits and the deletions are not new messages of the chat,
+    # so they wait only for the global limit
+
+    def edit_message_text(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().edit_message_text,
+            None,
+            args,
+            kwargs,
+            priority,
+        )
+
+    def edit_message_reply_markup(
+        self,
+        *args,
+        priority: int = INTERACTIVE,
+        **kwargs,
+    ):
+        return self.enqueue(
+            super().edit_message_reply_markup,
+            None,
+            args,
+            kwargs,
+            priority,
+        )
+
+    def delete_message(self, *args, priority: int = INTERACTIVE, **kwargs):
+        return self.enqueue(
+            super().delete_message,
+            None,
+            args,
+            kwargs,
+            priority,
+        )
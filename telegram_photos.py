@@ -0,0 +1,73 @@
+import threading
+from typing import Optional
+
+from redis import Redis
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from elastic_api import ElasticConnection
+
+
+class PhotoFileIds():
+    """
+    Telegram file_id of the product images by the Elastic file id.
+    After the first upload Telegram serves the photo from its own storage,
+    so neither the file link nor the image itself is fetched again.
+    A new main image of a product is a new Elastic file,
+    so the stale file_id is never used for it.
+    """
+
+    def __init__(self, redis_connection: Optional[Redis] = None):
+        self.redis_connection = redis_connection
+        self.file_ids = {}
+        self.lock = threading.Lock()
+
+    def get(self, image_id: str) -> Optional[str]:
+        with self.lock:
+            if image_id in self.file_ids:
+                return self.file_ids[image_id]
+        if not self.redis_connection:
+            return None
+        file_id = self.redis_connection.get(f'tg_photo_{image_id}')
+        if file_id:
+            with self.lock:
+                self.file_ids[image_id] = file_id
+        return file_id
+
+    def set(self, image_id: str, file_id: str) -> None:
+        with self.lock:
+            self.file_ids[image_id] = file_id
+        if self.redis_connection:
+            self.redis_connection.set(f'tg_photo_{image_id}', file_id)
+
+    def delete(self, image_id: str) -> None:
+        with self.lock:
+            self.file_ids.pop(image_id, None)
+        if self.redis_connection:
+            self.redis_connection.delete(f'tg_photo_{image_id}')
+
+
+def send_product_photo(
+    bot: Bot,
+    chat_id: int,
+    image_id: str,
+    elastic_connection: ElasticConnection,
+    photo_file_ids: PhotoFileIds,
+    **kwargs,
+) -> Message:
+    """
+    Sends the image by the known file_id or by the link to the Elastic file,
+    then remembers the file_id of the uploaded photo.
+    """
+    file_id = photo_file_ids.get(image_id)
+    if file_id:
+        try:
+            return bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except BadRequest:
+            # The file_id was issued to another bot or has expired
+            photo_file_ids.delete(image_id)
+
+    image_link = elastic_connection.get_file_link(image_id)
+    message = bot.send_photo(chat_id=chat_id, photo=image_link, **kwargs)
+    photo_file_ids.set(image_id, message.photo[-1].file_id)
+    return message
@@ -0,0 +1,58 @@
+import pytest
+import requests
+
+
+def create_product(product_id):
+    return {
+        'id': product_id,
+        'attributes': {
+            'name': 'Пицца <Маргарита>',
+            'description': 'Томаты & сыр',
+            'price': {'RUB': {'amount': 500}},
+        },
+        'relationships': {
+            'main_image': {'data': {'id': f'image-{product_id}'}},
+        },
+    }
+
+
+class FakeElasticConnection():
+    """
+    The products and the flow entries are kept in memory,
+    the catalog cache is off as in the default configuration.
+    """
+
+    def __init__(self, products_number=20):
+        self.catalog_cache = None
+        self.products = [
+            create_product(f'product-{number}')
+            for number in range(products_number)
+        ]
+        self.flows_entries = {}
+        self.requested_offsets = []
+        self.requested_products_ids = []
+
+    def get_products_page(self, page_limit, page_offset):
+        self.requested_offsets.append(page_offset)
+        return {
+            'data': self.products[page_offset:page_offset + page_limit],
+            'meta': {'results': {'total': len(self.products)}},
+        }
+
+    def iter_products(self, prefetch=False):
+        yield from self.products
+
+    def get_product(self, product_id):
+        self.requested_products_ids.append(product_id)
+        for product in self.products:
+            if product['id'] == product_id:
+                return {'data': product}
+        raise requests.HTTPError(f'404 Not Found: {product_id}')
+
+    def iter_custom_flow_entries(self, slug, prefetch=False):
+        yield from self.flows_entries.get(slug, [])
+
+
+@pytest.fixture
+def elastic_connection():
+    return FakeElasticConnection()
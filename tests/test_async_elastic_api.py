@@ -0,0 +1,115 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from async_elastic_api import AsyncElasticConnection
+from elastic_api import ElasticConnection
+
+
+async def start_server(statuses):
+    """
+    Answers the carts requests with the given statuses, then with 200.
+    """
+    requests = []
+
+    async def answer(request):
+        requests.append(request.headers.get('Authorization'))
+        status = statuses.pop(0) if statuses else 200
+        if status != 200:
+            return web.json_response(
+                {'errors': []},
+                status=status,
+                headers={'Retry-After': '0'},
+            )
+        return web.json_response({'data': {'id': 'cart'}})
+
+    async def answer_token(request):
+        return web.json_response(
+            {'access_token': 'async-token', 'expires': time.time() + 3600}
+        )
+
+    app = web.Application()
+    app.router.add_route('*', '/v2/carts/{cart_id}/', answer)
+    app.router.add_post('/oauth/access_token/', answer_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    await web.SockSite(runner, sock).start()
+    host, port = sock.getsockname()
+    return runner, f'http://{host}:{port}', requests
+
+
+def test_throttled_request_is_retried():
+    async def run():
+        runner, base_url, requests = await start_server([429, 503])
+        async with AsyncElasticConnection(
+            'client_id',
+            'client_secret',
+            base_url=base_url,
+        ) as elastic_connection:
+            cart = await elastic_connection.get_cart('cart')
+            stats = elastic_connection.get_request_stats()
+        await runner.cleanup()
+        return cart, stats, requests
+
+    cart, stats, requests = asyncio.run(run())
+    assert cart == {'data': {'id': 'cart'}}
+    assert stats['retries'] == 2
+    assert stats['throttled_responses'] == 2
+    assert requests == ['Bearer async-token'] * 3
+
+
+def test_unavailable_post_is_not_retried():
+    async def run():
+        runner, base_url, requests = await start_server([503])
+        try:
+            async with AsyncElasticConnection(
+                'client_id',
+                'client_secret',
+                base_url=base_url,
+            ) as elastic_connection:
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await elastic_connection.request('POST', '/v2/carts/1/')
+        finally:
+            await runner.cleanup()
+        return requests
+
+    assert len(asyncio.run(run())) == 1
+
+
+def test_sync_connection_is_shared():
+    sync_connection = ElasticConnection(
+        'client_id',
+        'client_secret',
+        requests_per_second=1000,
+        requests_burst=1,
+    )
+    sync_connection.access_token = 'shared-token'
+    sync_connection.access_token_expiration_timestamp = time.time() + 3600
+
+    async def run():
+        runner, base_url, requests = await start_server([429])
+        async with AsyncElasticConnection(
+            'client_id',
+            'client_secret',
+            base_url=base_url,
+            sync_connection=sync_connection,
+        ) as elastic_connection:
+            assert elastic_connection.rate_limiter is (
+                sync_connection.rate_limiter
+            )
+            await elastic_connection.get_cart('cart')
+        await runner.cleanup()
+        return requests
+
+    requests = asyncio.run(run())
+    sync_connection.close()
+    assert requests == ['Bearer shared-token'] * 2
+    stats = sync_connection.get_request_stats()
+    assert stats['requests'] == 2
+    assert stats['retries'] == 1
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from redis.exceptions import LockNotOwnedError
+
+from chat_scheduler import ChatScheduler
+
+
+class ExpiredLock():
+    """
+    Redis lock that expired while the task was running.
+    """
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        raise LockNotOwnedError('The lock is no longer owned')
+
+
+class FakeRedisConnection():
+
+    def __init__(self):
+        self.locks = []
+
+    def lock(self, name, timeout):
+        self.locks.append(name)
+        return ExpiredLock()
+
+
+def test_tasks_of_chat_run_in_order():
+    chat_scheduler = ChatScheduler(workers=4)
+    handled = []
+    handled_lock = threading.Lock()
+
+    def handle(chat_id, number):
+        time.sleep(0.001)
+        with handled_lock:
+            handled.append((chat_id, number))
+
+    futures = [
+        chat_scheduler.submit(chat_id, handle, chat_id, number)
+        for number in range(20)
+        for chat_id in range(3)
+    ]
+    for future in futures:
+        future.result(timeout=5)
+    chat_scheduler.close()
+
+    for chat_id in range(3):
+        assert [
+            number
+            for handled_chat_id, number in handled
+            if handled_chat_id == chat_id
+        ] == list(range(20))
+
+
+def test_expired_lock_keeps_result():
+    redis_connection = FakeRedisConnection()
+    chat_scheduler = ChatScheduler(
+        workers=1,
+        redis_connection=redis_connection,
+    )
+
+    future = chat_scheduler.submit(1, lambda: 'HANDLE_MENU')
+
+    assert future.result(timeout=5) == 'HANDLE_MENU'
+    chat_scheduler.close()
+    assert redis_connection.locks == ['pizza_shop_lock_1']
+    assert chat_scheduler.get_stats()['failed'] == 0
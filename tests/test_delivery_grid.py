@@ -0,0 +1,38 @@
+import pytest
+
+from delivery_grid import DeliveryGrid
+from geo_distances import get_distance_km
+
+
+def create_pizzeria(alias, latitude, longitude):
+    return {'alias': alias, 'latitude': latitude, 'longitude': longitude}
+
+
+def test_grid_finds_nearest_pizzeria():
+    pizzerias = [
+        create_pizzeria('first', 55.75, 37.62),
+        create_pizzeria('second', 55.80, 37.50),
+    ]
+    delivery_grid = DeliveryGrid.build(pizzerias, cell_size_km=1)
+
+    distance_km, pizzeria, tier = delivery_grid.resolve(55.79, 37.51)
+    assert pizzeria['alias'] == 'second'
+    assert distance_km == pytest.approx(
+        get_distance_km(55.79, 37.51, 55.80, 37.50)
+    )
+    assert tier == 1
+
+
+def test_oversized_grid_is_rejected():
+    pizzerias = [
+        create_pizzeria('south', 45, 37),
+        create_pizzeria('north', 60, 40),
+    ]
+
+    with pytest.raises(ValueError):
+        DeliveryGrid.build(pizzerias, cell_size_km=0.1, max_cells=1000)
+
+
+def test_empty_pizzerias_are_rejected():
+    with pytest.raises(ValueError):
+        DeliveryGrid.build([])
@@ -0,0 +1,117 @@
+import math
+import random
+
+import numpy as np
+
+from delivery_zones import (NODE_SIZE, VECTORIZED_RING_SIZE, DeliveryZone,
+                            DeliveryZones, get_rings)
+
+
+def create_square_zone(name, longitude, latitude, size, fee=100):
+    return DeliveryZone(
+        name=name,
+        pizzeria_alias=name,
+        fee=fee,
+        rings=get_rings(
+            {
+                'type': 'Polygon',
+                'coordinates': [[
+                    [longitude, latitude],
+                    [longitude + size, latitude],
+                    [longitude + size, latitude + size],
+                    [longitude, latitude + size],
+                ]],
+            }
+        ),
+    )
+
+
+def test_hole_is_outside():
+    zone = DeliveryZone(
+        name='ring',
+        pizzeria_alias='ring',
+        fee=0,
+        rings=get_rings(
+            {
+                'type': 'Polygon',
+                'coordinates': [
+                    [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+                    [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]],
+                ],
+            }
+        ),
+    )
+
+    assert zone.contains(longitude=2, latitude=2)
+    assert not zone.contains(longitude=5, latitude=5)
+    assert not zone.contains(longitude=11, latitude=5)
+
+
+def test_vectorized_ring_matches_loop():
+    vertices_number = VECTORIZED_RING_SIZE * 2
+    circle = [
+        [
+            math.cos(2 * math.pi * number / vertices_number),
+            math.sin(2 * math.pi * number / vertices_number),
+        ]
+        for number in range(vertices_number)
+    ]
+    zone = DeliveryZone(
+        name='circle',
+        pizzeria_alias='circle',
+        fee=0,
+        rings=get_rings({'type': 'Polygon', 'coordinates': [circle]}),
+    )
+
+    assert zone.contains(longitude=0, latitude=0)
+    assert zone.contains(longitude=0.7, latitude=0.7)
+    assert not zone.contains(longitude=0.8, latitude=0.8)
+
+
+def test_tree_finds_same_zones_as_full_scan():
+    random.seed(1)
+    zones = [
+        create_square_zone(
+            f'zone-{number}',
+            longitude=random.uniform(37, 38),
+            latitude=random.uniform(55, 56),
+            size=random.uniform(0.01, 0.2),
+        )
+        for number in range(NODE_SIZE ** 2 + 5)
+    ]
+    delivery_zones = DeliveryZones(zones)
+    assert len(delivery_zones.levels) == 3
+
+    for _ in range(200):
+        latitude = random.uniform(55, 56.2)
+        longitude = random.uniform(37, 38.2)
+        found_names = {
+            zone.name
+            for zone in delivery_zones.find(latitude, longitude)
+        }
+        assert found_names == {
+            zone.name
+            for zone in zones
+            if zone.contains(longitude, latitude)
+        }
+
+
+def test_cheapest_zone_goes_first():
+    delivery_zones = DeliveryZones(
+        [
+            create_square_zone('far', 37, 55, 1, fee=300),
+            create_square_zone('near', 37.4, 55.4, 0.2, fee=0),
+        ]
+    )
+
+    found = delivery_zones.find(latitude=55.5, longitude=37.5)
+    assert [zone.name for zone in found] == ['near', 'far']
+    assert delivery_zones.find(latitude=54, longitude=37) == []
+
+
+def test_empty_zones():
+    delivery_zones = DeliveryZones([])
+
+    assert len(delivery_zones) == 0
+    assert delivery_zones.find(latitude=55, longitude=37) == []
+    assert isinstance(delivery_zones.search_boxes(37, 55), np.ndarray)
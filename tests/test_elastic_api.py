@@ -0,0 +1,73 @@
+import pytest
+
+from elastic_api import ElasticConnection
+
+
+def create_get_page(items_number, max_page_limit, with_total=True):
+    requested_offsets = []
+
+    def get_page(page_limit, page_offset):
+        requested_offsets.append(page_offset)
+        page_limit = min(page_limit, max_page_limit)
+        items = list(
+            range(page_offset, min(page_offset + page_limit, items_number))
+        )
+        page_response = {'data': items}
+        if with_total:
+            page_response['meta'] = {'results': {'total': items_number}}
+        return page_response
+
+    return get_page, requested_offsets
+
+
+@pytest.fixture
+def elastic_connection():
+    elastic_connection = ElasticConnection('client_id', 'client_secret')
+    yield elastic_connection
+    elastic_connection.close()
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_capped_pages_are_read_to_total(elastic_connection, prefetch):
+    get_page, requested_offsets = create_get_page(250, max_page_limit=25)
+
+    items = list(
+        elastic_connection.iter_pages(
+            get_page=get_page,
+            page_limit=100,
+            prefetch=prefetch,
+        )
+    )
+    assert items == list(range(250))
+    assert requested_offsets == list(range(0, 250, 25))
+
+
+def test_short_page_is_last_without_total(elastic_connection):
+    get_page, requested_offsets = create_get_page(
+        250,
+        max_page_limit=100,
+        with_total=False,
+    )
+
+    items = list(
+        elastic_connection.iter_pages(
+            get_page=get_page,
+            page_limit=100,
+            prefetch=False,
+        )
+    )
+    assert items == list(range(250))
+    assert requested_offsets == [0, 100, 200]
+
+
+def test_empty_page_stops_iteration(elastic_connection):
+    def get_page(page_limit, page_offset):
+        return {'data': [], 'meta': {'results': {'total': 10}}}
+
+    assert list(
+        elastic_connection.iter_pages(
+            get_page=get_page,
+            page_limit=100,
+            prefetch=False,
+        )
+    ) == []
@@ -0,0 +1,33 @@
+import numpy as np
+
+from delivery_grid import get_delivery_tier
+from geo_distances import PizzeriasArray, get_delivery_tiers, get_distance_km
+
+
+def test_vectorized_tiers_match_scalar_tiers():
+    distances_km = [0, 0.5, 0.51, 5, 5.01, 20, 20.01, 1000]
+
+    assert get_delivery_tiers(np.array(distances_km)).tolist() == [
+        get_delivery_tier(distance_km) for distance_km in distances_km
+    ]
+
+
+def test_vectorized_distances_match_scalar_distances():
+    pizzerias = [
+        {'latitude': 55.75, 'longitude': 37.62},
+        {'latitude': 55.80, 'longitude': 37.50},
+        {'latitude': 59.93, 'longitude': 30.31},
+    ]
+    distances_km = PizzeriasArray(pizzerias).get_distances_km(55.7, 37.6)
+
+    for pizzeria, distance_km in zip(pizzerias, distances_km):
+        assert np.isclose(
+            distance_km,
+            get_distance_km(
+                55.7,
+                37.6,
+                pizzeria['latitude'],
+                pizzeria['longitude'],
+            ),
+            rtol=1e-6,
+        )
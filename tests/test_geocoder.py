@@ -0,0 +1,55 @@
+import hashlib
+import json
+import time
+
+import pytest
+
+from geocoder import Geocoder, normalize_address
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def get_redis_key(address):
+    key = hashlib.sha1(normalize_address(address).encode()).hexdigest()
+    return f'geocode_{key}'
+
+
+def test_memory_entry_expires_with_redis_entry():
+    redis_connection = fakeredis.FakeRedis(decode_responses=True)
+    address = 'Москва, Красная площадь'
+    redis_connection.set(
+        get_redis_key(address),
+        json.dumps([55.75, 37.62]),
+        px=100,
+    )
+    geocoder = Geocoder('apikey', redis_connection=redis_connection)
+    requested_addresses = []
+
+    def request_coordinates(address):
+        requested_addresses.append(address)
+        return 55.0, 37.0
+
+    geocoder.request_coordinates = request_coordinates
+
+    assert geocoder.fetch_coordinates(address) == (55.75, 37.62)
+    assert geocoder.fetch_coordinates(address) == (55.75, 37.62)
+    assert requested_addresses == []
+    time.sleep(0.15)
+    assert geocoder.fetch_coordinates(address) == (55.0, 37.0)
+    assert requested_addresses == [address]
+    geocoder.close()
+
+
+def test_not_found_address_is_cached():
+    redis_connection = fakeredis.FakeRedis(decode_responses=True)
+    geocoder = Geocoder(
+        'apikey',
+        redis_connection=redis_connection,
+        negative_ttl=60,
+    )
+    geocoder.request_coordinates = lambda address: None
+
+    assert geocoder.fetch_coordinates('Нигде') is None
+    assert redis_connection.get(get_redis_key('Нигде')) == 'null'
+    assert 0 < redis_connection.ttl(get_redis_key('Нигде')) <= 60
+    geocoder.close()
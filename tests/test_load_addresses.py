@@ -0,0 +1,25 @@
+from load_addresses import get_new_addresses
+
+
+def create_address(alias, longitude, latitude):
+    return {
+        'alias': alias,
+        'address': {'full': f'Адрес {alias}'},
+        'coordinates': {'lon': longitude, 'lat': latitude},
+    }
+
+
+def test_loaded_pizzerias_are_not_added_again(elastic_connection):
+    elastic_connection.flows_entries['pizzerias'] = [
+        {'alias': 'Центральная', 'longitude': None, 'latitude': None},
+        {'alias': None, 'longitude': '37.5', 'latitude': '55.5'},
+    ]
+    addresses = [
+        create_address(' центральная ', '37.1', '55.1'),
+        create_address('Южная', '37.500000001', '55.5'),
+        create_address('Северная', '37.9', '55.9'),
+        create_address('северная', '37.8', '55.8'),
+    ]
+
+    new_addresses = get_new_addresses(elastic_connection, addresses)
+    assert [address['alias'] for address in new_addresses] == ['Северная']
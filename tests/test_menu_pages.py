@@ -0,0 +1,50 @@
+import time
+
+from menu_pages import MenuPages
+
+
+def wait_for_offsets(elastic_connection, offsets, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not offsets <= set(elastic_connection.requested_offsets):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_pages_are_cached(elastic_connection):
+    menu_pages = MenuPages(elastic_connection, prefetch_workers=0)
+
+    first_page = menu_pages.get_page(page_offset=0)
+    assert menu_pages.get_page(page_offset=0) is first_page
+    assert elastic_connection.requested_offsets == [0]
+
+
+def test_adjacent_pages_are_prefetched(elastic_connection):
+    menu_pages = MenuPages(elastic_connection)
+
+    menu_pages.get_page(page_offset=8, prefetch=True)
+    wait_for_offsets(elastic_connection, {0, 8, 16})
+    menu_pages.close()
+    menu_pages.get_page(page_offset=0)
+    menu_pages.get_page(page_offset=16)
+    assert sorted(elastic_connection.requested_offsets) == [0, 8, 16]
+
+
+def test_pages_expire(elastic_connection):
+    menu_pages = MenuPages(
+        elastic_connection,
+        prefetch_workers=0,
+        cache_ttl=0.05,
+    )
+
+    menu_pages.get_page(page_offset=0)
+    time.sleep(0.1)
+    menu_pages.get_page(page_offset=0)
+    assert elastic_connection.requested_offsets == [0, 0]
+
+
+def test_last_page_has_no_next_button(elastic_connection):
+    menu_pages = MenuPages(elastic_connection, prefetch_workers=0)
+
+    keyboard = menu_pages.get_page(page_offset=16).reply_markup.inline_keyboard
+    assert len(keyboard) == 4 + 2
+    assert [button.text for button in keyboard[-2]] == ['<<']
@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+from telegram.error import BadRequest, NetworkError
+
+from order_reminders import REMINDERS_KEY, OrderReminders
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+class FakeBot():
+    def __init__(self):
+        self.futures = {}
+
+    def send_message(self, chat_id, text, parse_mode, priority):
+        future = Future()
+        self.futures[chat_id] = future
+        return future
+
+
+@pytest.fixture
+def redis_connection():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def create_order_reminders(redis_connection, **kwargs):
+    return OrderReminders(
+        redis_connection,
+        FakeBot(),
+        'Приятного аппетита!',
+        **kwargs,
+    )
+
+
+def test_only_due_reminders_are_sent(redis_connection):
+    order_reminders = create_order_reminders(redis_connection)
+    redis_connection.zadd(
+        REMINDERS_KEY,
+        {'1': time.time() - 1, '2': time.time() + 3600},
+    )
+
+    assert order_reminders.poll() == 1
+    assert list(order_reminders.bot.futures) == [1]
+    assert redis_connection.zrange(REMINDERS_KEY, 0, -1) == ['2']
+    order_reminders.bot.futures[1].set_result(None)
+    assert order_reminders.get_stats() == {
+        'pending': 0,
+        'sent': 1,
+        'failed': 0,
+        'scheduled': 1,
+    }
+
+
+def test_reminder_is_claimed_once(redis_connection):
+    redis_connection.zadd(
+        REMINDERS_KEY,
+        {str(chat_id): time.time() - 1 for chat_id in range(500)},
+    )
+    claimed_chat_ids = []
+
+    def claim():
+        order_reminders = create_order_reminders(redis_connection)
+        while True:
+            chat_ids = order_reminders.claim_due(7)
+            if not chat_ids:
+                return
+            claimed_chat_ids.extend(chat_ids)
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed_chat_ids) == list(range(500))
+
+
+def test_pending_reminders_are_limited(redis_connection):
+    order_reminders = create_order_reminders(
+        redis_connection,
+        batch_size=10,
+        max_pending=3,
+    )
+    redis_connection.zadd(
+        REMINDERS_KEY,
+        {str(chat_id): time.time() - 1 for chat_id in range(5)},
+    )
+
+    assert order_reminders.poll() == 3
+    assert order_reminders.poll() == 0
+    order_reminders.bot.futures[0].set_result(None)
+    assert order_reminders.poll() == 1
+
+
+def test_temporary_error_is_retried(redis_connection):
+    order_reminders = create_order_reminders(
+        redis_connection,
+        retry_delay=60,
+    )
+    redis_connection.zadd(
+        REMINDERS_KEY,
+        {'1': time.time() - 1, '2': time.time() - 1},
+    )
+    order_reminders.poll()
+
+    order_reminders.bot.futures[1].set_exception(NetworkError('Timed out'))
+    order_reminders.bot.futures[2].set_exception(
+        BadRequest('Chat not found')
+    )
+    assert redis_connection.zrange(REMINDERS_KEY, 0, -1) == ['1']
+    assert redis_connection.zscore(REMINDERS_KEY, '1') > time.time() + 50
+    assert order_reminders.get_stats()['failed'] == 2
@@ -0,0 +1,107 @@
+from delivery_zones import DeliveryZone, DeliveryZones, get_rings
+from pizzerias_registry import PizzeriasRegistry
+
+
+def create_pizzeria(alias, latitude, longitude):
+    return {
+        'id': f'id-{alias}',
+        'alias': alias,
+        'address': f'Адрес {alias}',
+        'latitude': latitude,
+        'longitude': longitude,
+        'courier_tg_id': 1,
+    }
+
+
+def create_delivery_zones(pizzeria_alias):
+    return DeliveryZones(
+        [
+            DeliveryZone(
+                name='Центр',
+                pizzeria_alias=pizzeria_alias,
+                fee=0,
+                rings=get_rings(
+                    {
+                        'type': 'Polygon',
+                        'coordinates': [
+                            [[37, 55], [38, 55], [38, 56], [37, 56]],
+                        ],
+                    }
+                ),
+            ),
+        ]
+    )
+
+
+def test_renamed_alias_is_reloaded(elastic_connection):
+    elastic_connection.flows_entries['pizzerias'] = [
+        create_pizzeria('old', 55.5, 37.5),
+    ]
+    pizzerias_registry = PizzeriasRegistry(elastic_connection)
+    pizzerias_registry.load()
+    elastic_connection.flows_entries['pizzerias'] = [
+        dict(create_pizzeria('old', 55.5, 37.5), alias='new'),
+    ]
+    pizzerias_registry.load()
+
+    delivery_zone, pizzeria = pizzerias_registry.find_delivery_zone(
+        latitude=55.5,
+        longitude=37.5,
+        delivery_zones=create_delivery_zones('new'),
+    )
+    assert delivery_zone.name == 'Центр'
+    assert pizzeria['alias'] == 'new'
+
+
+def test_pizzeria_without_coordinates_is_skipped(elastic_connection):
+    elastic_connection.flows_entries['pizzerias'] = [
+        create_pizzeria('broken', None, 37.5),
+        create_pizzeria('central', 55.75, 37.62),
+    ]
+    pizzerias_registry = PizzeriasRegistry(elastic_connection)
+    pizzerias_registry.start()
+    pizzerias_registry.stop()
+
+    distance_km, pizzeria, _ = pizzerias_registry.find_nearest(55.7, 37.6)
+    assert pizzeria['alias'] == 'central'
+    assert len(pizzerias_registry.index) == 1
+
+
+def test_same_pizzerias_keep_index(elastic_connection):
+    elastic_connection.flows_entries['pizzerias'] = [
+        create_pizzeria('central', 55.75, 37.62),
+    ]
+    pizzerias_registry = PizzeriasRegistry(elastic_connection)
+    pizzerias_registry.load()
+    index = pizzerias_registry.index
+    pizzerias_registry.load()
+    assert pizzerias_registry.index is index
+
+    elastic_connection.flows_entries['pizzerias'] = [
+        dict(create_pizzeria('central', 55.75, 37.62), courier_tg_id=2),
+    ]
+    pizzerias_registry.load()
+    assert pizzerias_registry.index is not index
+
+
+def test_empty_registry_has_no_nearest(elastic_connection):
+    pizzerias_registry = PizzeriasRegistry(elastic_connection)
+    pizzerias_registry.load()
+
+    assert pizzerias_registry.find_nearest(55.7, 37.6) is None
+
+
+def test_oversized_grid_falls_back_to_index(elastic_connection):
+    elastic_connection.flows_entries['pizzerias'] = [
+        create_pizzeria('south', 40, 20),
+        create_pizzeria('north', 70, 60),
+    ]
+    pizzerias_registry = PizzeriasRegistry(
+        elastic_connection,
+        delivery_grid_cell_km=0.5,
+    )
+    pizzerias_registry.load()
+
+    assert pizzerias_registry.delivery_grid is None
+    distance_km, pizzeria, tier = pizzerias_registry.find_nearest(40, 20)
+    assert pizzeria['alias'] == 'south'
@@ -0,0 +1,88 @@
+import time
+
+from product_cards import ProductCards
+
+
+class FakeCatalogCache():
+
+    def __init__(self):
+        self.release_id = 'release-1'
+
+    def get_release_id(self):
+        return self.release_id
+
+
+def wait_for_requests(elastic_connection, requests_number, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(elastic_connection.requested_products_ids) < requests_number:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_cards_are_cached(elastic_connection):
+    product_cards = ProductCards(elastic_connection)
+
+    product_card = product_cards.get_card('product-1')
+    assert product_cards.get_card('product-1') is product_card
+    assert elastic_connection.requested_products_ids == ['product-1']
+    assert product_card.image_id == 'image-product-1'
+    assert '&lt;Маргарита&gt;' in product_card.caption
+
+
+def test_cards_are_warmed(elastic_connection):
+    product_cards = ProductCards(elastic_connection, warm_workers=2)
+
+    product_cards.start_warming()
+    wait_for_requests(elastic_connection, 20)
+    product_cards.stop_warming()
+    product_cards.get_card('product-1')
+    product_cards.get_card('product-19')
+    assert sorted(elastic_connection.requested_products_ids) == sorted(
+        f'product-{number}' for number in range(20)
+    )
+
+
+def test_broken_product_does_not_stop_warming(elastic_connection):
+    del elastic_connection.products[0]['relationships']
+    product_cards = ProductCards(elastic_connection, warm_workers=1)
+
+    product_cards.start_warming()
+    wait_for_requests(elastic_connection, 20)
+    product_cards.stop_warming()
+    assert 'product-0' not in product_cards.cards
+    assert len(product_cards.cards) == 19
+
+
+def test_cards_are_warmed_again_after_new_release(elastic_connection):
+    elastic_connection.catalog_cache = FakeCatalogCache()
+    product_cards = ProductCards(
+        elastic_connection,
+        warm_workers=2,
+        warm_check_interval=0.01,
+    )
+
+    product_cards.start_warming()
+    wait_for_requests(elastic_connection, 20)
+    product_cards.get_card('product-1')
+    assert len(elastic_connection.requested_products_ids) == 20
+
+    elastic_connection.catalog_cache.release_id = 'release-2'
+    wait_for_requests(elastic_connection, 40)
+    product_cards.stop_warming()
+    product_cards.get_card('product-1')
+    assert len(elastic_connection.requested_products_ids) == 40
+
+
+def test_cards_are_warmed_again_after_expiry(elastic_connection):
+    product_cards = ProductCards(
+        elastic_connection,
+        warm_workers=2,
+        cache_ttl=0.2,
+        warm_check_interval=0.01,
+    )
+
+    product_cards.start_warming()
+    # The second pass renders the cards again without the get_card calls
+    wait_for_requests(elastic_connection, 40)
+    product_cards.stop_warming()
+    assert product_cards.warmed_release_id is not None
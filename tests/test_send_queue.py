@@ -0,0 +1,47 @@
+import logging
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from send_queue import BACKGROUND, SendQueue, SendQueueClosed
+
+
+@pytest.fixture
+def send_queue():
+    send_queue = SendQueue(rate=1000, chat_rate=1000, chat_burst=1000)
+    yield send_queue
+    send_queue.close()
+
+
+def test_flood_wait_is_retried(send_queue):
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        return 'sent'
+
+    assert send_queue.submit(1, send).result(timeout=5) == 'sent'
+    assert len(attempts) == 2
+    assert send_queue.get_stats()['flood_waits'] == 1
+
+
+def test_failed_background_request_is_logged(send_queue, caplog):
+    def send():
+        raise BadRequest('Chat not found')
+
+    with caplog.at_level(logging.WARNING):
+        future = send_queue.submit(1, send, priority=BACKGROUND)
+        assert isinstance(future.exception(timeout=5), BadRequest)
+    assert 'Chat not found' in caplog.text
+    assert send_queue.get_stats()['failed'] == 1
+
+
+def test_request_after_close_fails():
+    send_queue = SendQueue()
+    send_queue.close()
+
+    future = send_queue.submit(1, lambda: 'sent')
+    with pytest.raises(SendQueueClosed):
+        future.result(timeout=1)
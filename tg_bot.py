@@ -1,39 +1,30 @@
 import functools
 import html
+import logging
 from textwrap import dedent
-from typing import Dict
+from typing import Callable, Dict, Optional, Tuple
 
-import requests
 from environs import Env
-from geopy.distance import distance
 from redis import Redis
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice,
                       ParseMode, Update)
 from telegram.ext import (CallbackContext, CallbackQueryHandler,
                           CommandHandler, Filters, MessageHandler,
                           PreCheckoutQueryHandler, Updater)
+from telegram.utils.request import Request
 
+from chat_scheduler import ChatScheduler
+from delivery_zones import DeliveryZone, DeliveryZones
 from elastic_api import ElasticConnection
+from geocoder import Geocoder
+from menu_pages import MenuPages
+from order_reminders import OrderReminders
+from pizzerias_registry import PizzeriasRegistry
+from product_cards import ProductCard, ProductCards
+from send_queue import BACKGROUND, QueuedBot, SendQueue
+from telegram_photos import PhotoFileIds, send_product_photo
 
-
-def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url,
-                            params={
-                                "geocode": address,
-                                "apikey": apikey,
-                                "format": "json",
-                            })
-    response.raise_for_status()
-    found_response = response.json()['response']
-    found_places = found_response['GeoObjectCollection']['featureMember']
-
-    if not found_places:
-        return None
-
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return float(lat), float(lon)
+logger = logging.getLogger(__file__)
 
 
 def get_menu_text():
@@ -43,46 +34,6 @@ def get_menu_text():
     )
 
 
-def get_menu_reply_markup(
-    elastic_connection: ElasticConnection,
-    page_offset: int
-) -> InlineKeyboardMarkup:
-    page_limit = 8
-    products_response = elastic_connection.get_products_page(
-        page_limit=page_limit,
-        page_offset=page_offset,
-    )
-    keyboard = []
-    if products_response['data']:
-        for product in products_response['data']:
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        product['attributes']['name'],
-                        callback_data=product['id']
-                    )
-                ]
-            )
-        total_products_number = products_response['meta']['results']['total']
-        pagination_buttons = []
-        if page_offset > 0:
-            callback_data = f'pagination: {page_offset - page_limit}'
-            pagination_buttons.append(
-                InlineKeyboardButton(text='<<', callback_data=callback_data)
-            )
-        if total_products_number > page_offset + page_limit:
-            callback_data = f'pagination: {page_offset + page_limit}'
-            pagination_buttons.append(
-                InlineKeyboardButton(text='>>', callback_data=callback_data)
-            )
-        if pagination_buttons:
-            keyboard.append(pagination_buttons)
-    keyboard.append(
-        [InlineKeyboardButton(text='Корзина', callback_data='Cart')]
-    )
-    return InlineKeyboardMarkup(keyboard)
-
-
 def get_cart_text(cart: Dict, cart_items: Dict) -> str:
     cart_text = '<b>Корзина:</b>\n\n'
     total = cart["data"]["meta"]["display_price"]["with_tax"]["formatted"]
@@ -129,33 +80,83 @@ def get_cart_reply_markup(cart_items: Dict) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
-def remind_about_order(
-    context: CallbackContext,
-    remind_order_ad: str,
-    remind_order_help: str,
-) -> None:
-    job = context.job
-    text = (
+def get_product_reply_markup(product_id: str) -> InlineKeyboardMarkup:
+    adding_button = InlineKeyboardButton(
+        text='Добавить в корзину',
+        callback_data=product_id
+    )
+    keyboard = [
+        [adding_button],
+        [InlineKeyboardButton(text='Корзина', callback_data='Cart')],
+        [InlineKeyboardButton('Назад', callback_data='Back')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_menu_message(
+    menu_pages: MenuPages,
+    page_offset: int = 0,
+    prefetch: bool = False,
+) -> Dict:
+    reply_markup = menu_pages.get_page(
+        page_offset=page_offset,
+        prefetch=prefetch,
+    ).reply_markup
+    return {
+        'text': get_menu_text(),
+        'reply_markup': reply_markup,
+        'parse_mode': ParseMode.HTML,
+    }
+
+
+def get_cart_message(cart: Dict, cart_items: Dict) -> Dict:
+    return {
+        'text': get_cart_text(cart=cart, cart_items=cart_items),
+        'reply_markup': get_cart_reply_markup(cart_items=cart_items),
+        'parse_mode': ParseMode.HTML,
+    }
+
+
+def get_product_message(product_card: ProductCard) -> Dict:
+    return {
+        'caption': product_card.caption,
+        'reply_markup': get_product_reply_markup(
+            product_id=product_card.product_id,
+        ),
+        'parse_mode': ParseMode.HTML,
+    }
+
+
+def get_email_request_message() -> Dict:
+    return {
+        'text': 'Пришлите адрес Вашей электронной почты:',
+        'reply_markup': InlineKeyboardMarkup([]),
+    }
+
+
+def get_page_offset(callback_data: str) -> Optional[int]:
+    if not callback_data.startswith('pagination: '):
+        return None
+    return int(callback_data.replace('pagination: ', ''))
+
+
+ADDED_TO_CART_TEXT = 'Товар был добавлен в корзину'
+
+
+def get_remind_order_text(remind_order_ad: str, remind_order_help: str) -> str:
+    return (
         f'<b>Приятного аппетита!</b>\n{html.escape(remind_order_ad)}\n\n'
         f'<em>{html.escape(remind_order_help)}</em>'
     )
-    context.bot.send_message(job.context, text=text, parse_mode=ParseMode.HTML)
 
 
 def start(
     update: Update,
     context: CallbackContext,
-    elastic_connection: ElasticConnection
+    elastic_connection: ElasticConnection,
+    menu_pages: MenuPages,
 ) -> str:
-    reply_markup = get_menu_reply_markup(
-        elastic_connection=elastic_connection,
-        page_offset=0
-    )
-    update.message.reply_text(
-        get_menu_text(),
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.HTML
-    )
+    update.message.reply_text(**get_menu_message(menu_pages))
 
     return 'HANDLE_MENU'
 
@@ -163,7 +164,10 @@ def start(
 def handle_menu(
     update: Update,
     context: CallbackContext,
-    elastic_connection: ElasticConnection
+    elastic_connection: ElasticConnection,
+    menu_pages: MenuPages,
+    photo_file_ids: PhotoFileIds,
+    product_cards: ProductCards,
 ) -> str:
     query = update.callback_query
     if not query:
@@ -178,57 +182,28 @@ def handle_menu(
     if query.data == 'Cart':
         cart = elastic_connection.get_cart(cart_id=chat_id)
         cart_items = elastic_connection.get_cart_items(cart_id=chat_id)
-        cart_text = get_cart_text(cart=cart, cart_items=cart_items)
-        reply_markup = get_cart_reply_markup(cart_items=cart_items)
-        query.message.edit_text(
-            text=cart_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
+        query.message.edit_text(**get_cart_message(cart, cart_items))
         return 'HANDLE_CART'
 
-    if query.data.startswith('pagination: '):
-        page_offset = int(query.data.replace('pagination: ', ''))
-        reply_markup = get_menu_reply_markup(
-            elastic_connection=elastic_connection,
-            page_offset=page_offset
-        )
+    page_offset = get_page_offset(query.data)
+    if page_offset is not None:
         query.message.edit_text(
-            text=get_menu_text(),
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
+            **get_menu_message(
+                menu_pages,
+                page_offset=page_offset,
+                prefetch=True,
+            )
         )
         return 'HANDLE_MENU'
 
-    product_id = query.data
-    product = elastic_connection.get_product(product_id)["data"]
-    main_image_id = product['relationships']['main_image']['data']['id']
-    image_link = elastic_connection.get_file_link(main_image_id)
-    price = product["attributes"]["price"]["RUB"]["amount"]
-    formatted_price = '{:.2f}'.format(price)
-    caption = (
-        f'<b>{html.escape(product["attributes"]["name"], quote=True)}</b>\n\n'
-        f'<em>{formatted_price} руб. за шт.</em>\n\n'
-        f'{html.escape(product["attributes"]["description"], quote=True)}'
-    )
-
-    adding_button = InlineKeyboardButton(
-        text='Добавить в корзину',
-        callback_data=product_id
-    )
-    keyboard = [
-        [adding_button],
-        [InlineKeyboardButton(text='Корзина', callback_data='Cart')],
-        [InlineKeyboardButton('Назад', callback_data='Back')]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    context.bot.send_photo(
+    product_card = product_cards.get_card(query.data)
+    send_product_photo(
+        bot=context.bot,
         chat_id=chat_id,
-        photo=image_link,
-        caption=caption,
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.HTML
+        image_id=product_card.image_id,
+        elastic_connection=elastic_connection,
+        photo_file_ids=photo_file_ids,
+        **get_product_message(product_card)
     )
     context.bot.delete_message(
         chat_id=chat_id,
@@ -241,7 +216,8 @@ def handle_menu(
 def handle_description(
     update: Update,
     context: CallbackContext,
-    elastic_connection: ElasticConnection
+    elastic_connection: ElasticConnection,
+    menu_pages: MenuPages,
 ) -> str:
     query = update.callback_query
     if not query:
@@ -250,15 +226,9 @@ def handle_description(
     chat_id = query.from_user.id
     if query.data == 'Back':
         query.answer()
-        reply_markup = get_menu_reply_markup(
-            elastic_connection=elastic_connection,
-            page_offset=0
-        )
         context.bot.send_message(
             chat_id=chat_id,
-            text=get_menu_text(),
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
+            **get_menu_message(menu_pages)
         )
         context.bot.delete_message(
             chat_id=chat_id,
@@ -270,13 +240,9 @@ def handle_description(
         query.answer()
         cart = elastic_connection.get_cart(cart_id=chat_id)
         cart_items = elastic_connection.get_cart_items(cart_id=chat_id)
-        cart_text = get_cart_text(cart=cart, cart_items=cart_items)
-        reply_markup = get_cart_reply_markup(cart_items=cart_items)
         context.bot.send_message(
             chat_id=chat_id,
-            text=cart_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
+            **get_cart_message(cart, cart_items)
         )
         context.bot.delete_message(
             chat_id=chat_id,
@@ -290,9 +256,7 @@ def handle_description(
         product_id=product_id,
         quantity=1
     )
-    query.answer(
-        text='Товар был добавлен в корзину'
-    )
+    query.answer(text=ADDED_TO_CART_TEXT)
 
     return 'HANDLE_DESCRIPTION'
 
@@ -300,7 +264,8 @@ def handle_description(
 def handle_cart(
     update: Update,
     context: CallbackContext,
-    elastic_connection: ElasticConnection
+    elastic_connection: ElasticConnection,
+    menu_pages: MenuPages,
 ) -> str:
     query = update.callback_query
     if not query:
@@ -308,37 +273,19 @@ def handle_cart(
     query.answer()
     chat_id = query.from_user.id
     if query.data == 'To menu':
-        menu_text = get_menu_text()
-        reply_markup = get_menu_reply_markup(
-            elastic_connection=elastic_connection,
-            page_offset=0
-        )
-        query.message.edit_text(
-            text=menu_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
+        query.message.edit_text(**get_menu_message(menu_pages))
 
         return 'HANDLE_MENU'
 
     if query.data == 'Order':
-        text = 'Пришлите адрес Вашей электронной почты:'
-        reply_markup = InlineKeyboardMarkup([])
-        query.message.edit_text(text=text, reply_markup=reply_markup)
+        query.message.edit_text(**get_email_request_message())
 
         return 'WAITING_EMAIL'
 
     elastic_connection.remove_cart_item(cart_id=chat_id, item_id=query.data)
     cart = elastic_connection.get_cart(cart_id=chat_id)
     cart_items = elastic_connection.get_cart_items(cart_id=chat_id)
-
-    query.message.edit_text(
-        text=get_cart_text(cart=cart, cart_items=cart_items),
-        parse_mode=ParseMode.HTML
-    )
-    query.message.edit_reply_markup(
-        reply_markup=get_cart_reply_markup(cart_items=cart_items)
-    )
+    query.message.edit_text(**get_cart_message(cart, cart_items))
 
     return 'HANDLE_CART'
 
@@ -405,15 +352,42 @@ def handle_successful_payment(
     return 'HANDLE_LOCATION'
 
 
-def get_pizzeria_distance_km(pizzeria):
-    return pizzeria['distance_km']
+def get_delivery_zone_text(
+    delivery_zone: Optional[DeliveryZone],
+    delivery_pizzeria: Optional[Dict],
+    nearest_pizzeria: Dict,
+) -> str:
+    if not delivery_zone:
+        return (f'''\
+        Простите, но сюда мы пиццу не доставляем.
+        Самовывоз возможен из ближайшей пиццерии.
+        Вот ее адрес: {nearest_pizzeria['address']}
+        ''')
+    if not delivery_zone.fee:
+        return (f'''\
+        Доставим бесплатно из пиццерии по адресу:
+        {delivery_pizzeria['address']}
+        Самовывоз возможен из ближайшей пиццерии.
+        Вот ее адрес: {nearest_pizzeria['address']}
+        Доставляем или самовывоз?
+        ''')
+    return (f'''\
+        Доставка будет стоить {delivery_zone.fee} рублей.
+        Оплата - курьеру на месте.
+        Доставим из пиццерии по адресу: {delivery_pizzeria['address']}
+        Самовывоз возможен из ближайшей пиццерии.
+        Вот ее адрес: {nearest_pizzeria['address']}
+        Доставляем или самовывоз?
+        ''')
 
 
 def handle_location(
     update: Update,
     context: CallbackContext,
     elastic_connection: ElasticConnection,
-    ya_api_key: str,
+    geocoder: Geocoder,
+    pizzerias_registry: PizzeriasRegistry,
+    delivery_zones: Optional[DeliveryZones],
 ):
     latitude = longitude = None
     if update.message.location:
@@ -421,8 +395,7 @@ def handle_location(
         longitude = update.message.location.longitude
 
     if update.message.text:
-        coordinates = fetch_coordinates(
-            apikey=ya_api_key,
+        coordinates = geocoder.fetch_coordinates(
             address=update.message.text
         )
         if coordinates:
@@ -436,19 +409,20 @@ def handle_location(
         update.message.reply_text(text=text)
         return 'HANDLE_LOCATION'
 
-    pizzerias_response = elastic_connection.get_custom_flow_entries(
-        slug='pizzerias'
+    nearest = pizzerias_registry.find_nearest(
+        latitude=latitude,
+        longitude=longitude,
     )
-    pizzerias = pizzerias_response['data']
-    for pizzeria in pizzerias:
-        pizzeria['distance_km'] = distance(
-            (latitude, longitude),
-            (pizzeria['latitude'], pizzeria['longitude'])
-        ).km
-
-    nearest_pizzeria = min(pizzerias, key=get_pizzeria_distance_km)
+    if not nearest:
+        logger.warning('There are no pizzerias to deliver from')
+        update.message.reply_text(
+            text='Простите, сейчас мы не можем принять заказ.'
+        )
+        return 'HANDLE_LOCATION'
+    distance_km, nearest_pizzeria, delivery_tier = nearest
+    nearest_pizzeria = {**nearest_pizzeria, 'distance_km': distance_km}
     delivery_is_possible = True
-    if nearest_pizzeria['distance_km'] <= 0.5:
+    if delivery_tier == 0:
         text = (f'''\
         Может, заберете пиццу из нашей пиццерии неподалеку?
         Она всего в {int(nearest_pizzeria['distance_km']*1000)} метрах от Вас!
@@ -456,7 +430,7 @@ def handle_location(
 
         А можем и бесплатно доставить, нам не сложно.
         ''')
-    elif nearest_pizzeria['distance_km'] <= 5:
+    elif delivery_tier == 1:
         text = (f'''\
         Похоже, придется ехать до Вас на самокате.
         Доставка будет стоить 100 рублей. Оплата - курьеру на месте.
@@ -464,7 +438,7 @@ def handle_location(
         Вот ее адрес: {nearest_pizzeria['address']}
         Доставляем или самовывоз?
         ''')
-    elif nearest_pizzeria['distance_km'] <= 20:
+    elif delivery_tier == 2:
         text = (f'''\
         Похоже, придется ехать до Вас...
         Доставка будет стоить 300 рублей. Оплата - курьеру на месте.
@@ -481,6 +455,22 @@ def handle_location(
         ''')
         delivery_is_possible = False
 
+    delivery_pizzeria = nearest_pizzeria
+    if delivery_zones:
+        delivery_zone, delivery_pizzeria = (
+            pizzerias_registry.find_delivery_zone(
+                latitude=latitude,
+                longitude=longitude,
+                delivery_zones=delivery_zones,
+            )
+        )
+        delivery_is_possible = delivery_zone is not None
+        text = get_delivery_zone_text(
+            delivery_zone=delivery_zone,
+            delivery_pizzeria=delivery_pizzeria,
+            nearest_pizzeria=nearest_pizzeria,
+        )
+
     name = f'Customer_{update.message.chat_id}'
     customers_response = elastic_connection.get_customers_by_name(name=name)
     customer = customers_response['data'][0]
@@ -500,7 +490,7 @@ def handle_location(
         delivery_key = InlineKeyboardButton(
             text='Доставка',
             callback_data=(
-                f'{nearest_pizzeria["courier_tg_id"]},'
+                f'{delivery_pizzeria["courier_tg_id"]},'
                 f'{latitude},'
                 f'{longitude}'
             )
@@ -520,9 +510,7 @@ def handle_delivery_choice(
     update: Update,
     context: CallbackContext,
     elastic_connection: ElasticConnection,
-    remind_order_ad: str,
-    remind_order_help: str,
-    remind_order_wait: str,
+    order_reminders: OrderReminders,
 ) -> str:
     query = update.callback_query
     if not query:
@@ -553,25 +541,16 @@ def handle_delivery_choice(
     context.bot.send_message(
         chat_id=int(courier_tg_id),
         text=cart_text,
-        parse_mode=ParseMode.HTML
+        parse_mode=ParseMode.HTML,
+        priority=BACKGROUND,
     )
     context.bot.send_location(
         chat_id=int(courier_tg_id),
         latitude=float(latitude),
         longitude=float(longitude),
+        priority=BACKGROUND,
     )
-    reminder_handler = functools.partial(
-        remind_about_order,
-        remind_order_ad=remind_order_ad,
-        remind_order_help=remind_order_help,
-    )
-
-    context.job_queue.run_once(
-        reminder_handler,
-        when=remind_order_wait,
-        context=chat_id,
-        name=str(chat_id)
-    )
+    order_reminders.schedule(chat_id)
 
     text = dedent(
         '''\
@@ -589,24 +568,43 @@ def handle_delivery_choice(
     return 'START'
 
 
+def get_chat_id(update: Update) -> int:
+    if update.message:
+        return update.message.chat_id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return update.effective_user.id
+
+
+def schedule_users_reply(
+    update: Update,
+    context: CallbackContext,
+    chat_scheduler: ChatScheduler,
+    users_reply_handler: Callable,
+) -> None:
+    chat_scheduler.submit(
+        get_chat_id(update),
+        users_reply_handler,
+        update,
+        context,
+    )
+
+
 def handle_users_reply(
         update: Update,
         context: CallbackContext,
         redis_connection: Redis,
         elastic_connection: ElasticConnection,
-        ya_api_key: str,
-        remind_order_ad: str,
-        remind_order_help: str,
-        remind_order_wait: str,
+        geocoder: Geocoder,
+        order_reminders: OrderReminders,
         payment_token: str,
+        pizzerias_registry: PizzeriasRegistry,
+        delivery_zones: Optional[DeliveryZones],
+        menu_pages: MenuPages,
+        photo_file_ids: PhotoFileIds,
+        product_cards: ProductCards,
 ) -> None:
-    if update.message:
-        chat_id = update.message.chat_id
-    elif update.callback_query:
-        chat_id = update.callback_query.from_user.id
-    else:
-        chat_id = update.effective_user.id
-
+    chat_id = get_chat_id(update)
     redis_customer_id = f'pizza_shop_{chat_id}'
 
     if update.message and update.message.text == '/start':
@@ -617,15 +615,27 @@ def handle_users_reply(
     if not user_state:
         user_state = 'START'
 
+    start_handler = functools.partial(start, menu_pages=menu_pages)
+    menu_handler = functools.partial(
+        handle_menu,
+        menu_pages=menu_pages,
+        photo_file_ids=photo_file_ids,
+        product_cards=product_cards,
+    )
+    description_handler = functools.partial(
+        handle_description,
+        menu_pages=menu_pages,
+    )
+    cart_handler = functools.partial(handle_cart, menu_pages=menu_pages)
     location_handler = functools.partial(
         handle_location,
-        ya_api_key=ya_api_key,
+        geocoder=geocoder,
+        pizzerias_registry=pizzerias_registry,
+        delivery_zones=delivery_zones,
     )
     delivery_choice_handler = functools.partial(
         handle_delivery_choice,
-        remind_order_ad=remind_order_ad,
-        remind_order_help=remind_order_help,
-        remind_order_wait=remind_order_wait,
+        order_reminders=order_reminders,
     )
     email_handler = functools.partial(
         handle_email,
@@ -633,10 +643,10 @@ def handle_users_reply(
     )
 
     states_functions = {
-        'START': start,
-        'HANDLE_MENU': handle_menu,
-        'HANDLE_DESCRIPTION': handle_description,
-        'HANDLE_CART': handle_cart,
+        'START': start_handler,
+        'HANDLE_MENU': menu_handler,
+        'HANDLE_DESCRIPTION': description_handler,
+        'HANDLE_CART': cart_handler,
         'WAITING_EMAIL': email_handler,
         'HANDLE_PAYMENT_PRECHECKOUT': handle_payment_precheckout,
         'HANDLE_SUCCESSFUL_PAYMENT': handle_successful_payment,
@@ -648,10 +658,48 @@ def handle_users_reply(
     redis_connection.set(redis_customer_id, next_state)
 
 
-def main():
-    env = Env()
-    env.read_env()
+def log_elastic_stats(
+    context: CallbackContext,
+    elastic_connection: ElasticConnection,
+    chat_scheduler: Optional[ChatScheduler] = None,
+    send_queue: Optional[SendQueue] = None,
+    order_reminders: Optional[OrderReminders] = None,
+) -> None:
+    logger.info(
+        'Elastic requests stats: %s',
+        elastic_connection.get_request_stats(),
+    )
+    if elastic_connection.catalog_cache:
+        logger.info(
+            'Catalog cache stats: %s',
+            elastic_connection.catalog_cache.get_stats(),
+        )
+    if chat_scheduler:
+        logger.info('Chat scheduler stats: %s', chat_scheduler.get_stats())
+    if send_queue:
+        logger.info('Send queue stats: %s', send_queue.get_stats())
+    if order_reminders:
+        logger.info('Order reminders stats: %s', order_reminders.get_stats())
+
+
+def setup_logging(env: Env) -> None:
+    logging.basicConfig(
+        format=(
+            '%(process)d %(levelname)s %(asctime)s %(filename)s '
+            '%(funcName)s %(lineno)d %(message)s'
+        ),
+    )
+    logger.setLevel(logging.INFO)
+    if env.bool('DEBUG_MODE', False):
+        logger.setLevel(logging.DEBUG)
 
+
+def create_updater(env: Env) -> Tuple[Updater, Callable[[], None]]:
+    """
+    Creates the updater with the handlers and the jobs, it is shared
+    by the polling and the webhook modes. The returned function stops
+    the background threads and closes the connections.
+    """
     with env.prefixed('REDIS_'):
         redis_connection = Redis(
             host=env('HOST'),
@@ -664,26 +712,130 @@ def main():
         elastic_connection = ElasticConnection(
             client_id=env('PATH_CLIENT_ID'),
             client_secret=env('PATH_CLIENT_SECRET'),
+            timeout=env.float('TIMEOUT', 30),
+            pool_maxsize=env.int('POOL_MAXSIZE', 10),
+            redis_connection=redis_connection,
+            requests_per_second=env.float('REQUESTS_PER_SECOND', 0),
+            requests_burst=env.int('REQUESTS_BURST', 1),
+            max_retries=env.int('MAX_RETRIES', 3),
         )
+        elastic_stats_interval = env.int('STATS_INTERVAL', 0)
+        catalog_cache_size = env.int('CATALOG_CACHE_SIZE', 0)
+        if catalog_cache_size:
+            elastic_connection.enable_catalog_cache(
+                catalog_id=env('CATALOG_ID'),
+                maxsize=catalog_cache_size,
+                release_check_interval=env.float('CATALOG_CACHE_TTL', 60),
+            )
+    elastic_connection.start_access_token_renewal()
+
+    pizzerias_registry = PizzeriasRegistry(
+        elastic_connection=elastic_connection,
+        refresh_interval=env.float('PIZZERIAS_REFRESH_INTERVAL', 300),
+        redis_connection=redis_connection,
+        delivery_grid_cell_km=env.float('DELIVERY_GRID_CELL_SIZE', 0),
+        delivery_grid_path=env('DELIVERY_GRID_FILE', None),
+    )
+    pizzerias_registry.start()
+
+    delivery_zones = None
+    delivery_zones_path = env('DELIVERY_ZONES_FILE', None)
+    if delivery_zones_path:
+        delivery_zones = DeliveryZones.from_geojson(delivery_zones_path)
+        logger.info('%s delivery zones are loaded', len(delivery_zones))
+
+    geocoder = Geocoder(
+        apikey=env('YA_API_KEY'),
+        redis_connection=redis_connection,
+        ttl=env.int('GEOCODER_CACHE_TTL', 30 * 24 * 3600),
+        negative_ttl=env.int('GEOCODER_NEGATIVE_CACHE_TTL', 24 * 3600),
+        maxsize=env.int('GEOCODER_CACHE_SIZE', 4096),
+    )
+
+    menu_pages = MenuPages(
+        elastic_connection=elastic_connection,
+        prefetch_workers=env.int('MENU_PREFETCH_WORKERS', 1),
+    )
+
+    product_cards = ProductCards(
+        elastic_connection=elastic_connection,
+        warm_workers=env.int('PRODUCT_CARDS_WARM_WORKERS', 4),
+    )
+    product_cards.start_warming()
+
+    chat_workers = env.int('CHAT_WORKERS', 0)
+    with env.prefixed('TG_SEND_'):
+        send_workers = env.int('WORKERS', 8)
+        send_queue = SendQueue(
+            rate=env.float('RATE', 30),
+            chat_rate=env.float('CHAT_RATE', 1),
+            chat_burst=env.float('CHAT_BURST', 3),
+            workers=send_workers,
+            max_retries=env.int('MAX_RETRIES', 3),
+        )
+    bot = QueuedBot(
+        env('PIZZA_BOT_TOKEN'),
+        send_queue=send_queue,
+        request=Request(con_pool_size=send_workers + chat_workers + 8),
+    )
 
     with env.prefixed('REMIND_ORDER_'):
-        remind_order_ad = env('AD', 'Заказывайте снова!')
-        remind_order_help = env('HELP', 'Если заказ не доставлен - звоните!')
-        remind_order_wait = env.int('WAIT', 3600)
+        order_reminders = OrderReminders(
+            redis_connection=redis_connection,
+            bot=bot,
+            text=get_remind_order_text(
+                remind_order_ad=env('AD', 'Заказывайте снова!'),
+                remind_order_help=env(
+                    'HELP',
+                    'Если заказ не доставлен - звоните!',
+                ),
+            ),
+            wait=env.int('WAIT', 3600),
+            poll_interval=env.float('POLL_INTERVAL', 1),
+            batch_size=env.int('BATCH_SIZE', 100),
+            max_pending=env.int('MAX_PENDING', 1000),
+        )
+    order_reminders.start()
 
     users_reply_handler = functools.partial(
         handle_users_reply,
         redis_connection=redis_connection,
         elastic_connection=elastic_connection,
-        ya_api_key=env('YA_API_KEY'),
-        remind_order_ad=remind_order_ad,
-        remind_order_help=remind_order_help,
-        remind_order_wait=remind_order_wait,
+        geocoder=geocoder,
+        order_reminders=order_reminders,
         payment_token=env('PAYMENT_TOKEN'),
+        pizzerias_registry=pizzerias_registry,
+        delivery_zones=delivery_zones,
+        menu_pages=menu_pages,
+        photo_file_ids=PhotoFileIds(redis_connection=redis_connection),
+        product_cards=product_cards,
     )
 
-    updater = Updater(env('PIZZA_BOT_TOKEN'))
+    chat_scheduler = None
+    if chat_workers:
+        chat_scheduler = ChatScheduler(
+            workers=chat_workers,
+            redis_connection=(
+                redis_connection if env.bool('CHAT_REDIS_LOCK', False)
+                else None
+            ),
+        )
+        users_reply_handler = functools.partial(
+            schedule_users_reply,
+            chat_scheduler=chat_scheduler,
+            users_reply_handler=users_reply_handler,
+        )
+
+    updater = Updater(bot=bot)
     dispatcher = updater.dispatcher
+    # The caches and the queues are shared with the async pipeline
+    dispatcher.bot_data.update(
+        elastic_connection=elastic_connection,
+        menu_pages=menu_pages,
+        product_cards=product_cards,
+        send_queue=send_queue,
+        chat_scheduler=chat_scheduler,
+    )
     dispatcher.add_handler(
         MessageHandler(
             filters=(
@@ -695,9 +847,40 @@ def main():
     dispatcher.add_handler(CommandHandler('start', users_reply_handler))
     dispatcher.add_handler(CallbackQueryHandler(users_reply_handler))
     dispatcher.add_handler(PreCheckoutQueryHandler(users_reply_handler))
+    if elastic_stats_interval:
+        updater.job_queue.run_repeating(
+            functools.partial(
+                log_elastic_stats,
+                elastic_connection=elastic_connection,
+                chat_scheduler=chat_scheduler,
+                send_queue=send_queue,
+                order_reminders=order_reminders,
+            ),
+            interval=elastic_stats_interval,
+        )
+
+    def close_bot():
+        if chat_scheduler:
+            chat_scheduler.close()
+        order_reminders.stop()
+        send_queue.close()
+        pizzerias_registry.stop()
+        product_cards.stop_warming()
+        menu_pages.close()
+        geocoder.close()
+        elastic_connection.close()
 
+    return updater, close_bot
+
+
+def main():
+    env = Env()
+    env.read_env()
+    setup_logging(env)
+    updater, close_bot = create_updater(env)
     updater.start_polling()
     updater.idle()
+    close_bot()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+import argparse
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Dict, Hashable, List, Optional
+
+from environs import Env
+from telegram import Bot, Update
+from telegram.error import NetworkError
+
+from tg_bot import create_updater, get_chat_id, setup_logging
+
+logger = logging.getLogger(__file__)
+
+
+def get_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardsRing():
+    """
+    Consistent hashing of the chat ids: every shard has a number
+    of points on the ring, a chat belongs to the first point after
+    the hash of its id. When a shard is added or removed, only the chats
+    of its points move, the other shards keep their chats (and caches).
+    """
+
+    def __init__(self, shards: List[Hashable], replicas: int = 100):
+        self.points = sorted(
+            (get_hash(f'{shard}-{replica}'), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        self.hashes = [point_hash for point_hash, _ in self.points]
+
+    def get_shard(self, chat_id: int) -> Hashable:
+        point_index = bisect.bisect(self.hashes, get_hash(str(chat_id)))
+        _, shard = self.points[point_index % len(self.points)]
+        return shard
+
+
+def run_worker(shard: int, updates_queue: multiprocessing.Queue) -> None:
+    """
+    The worker is an ordinary bot without the polling: it takes
+    the updates of its shard from the router one by one, so the updates
+    of a chat are handled in order.
+    """
+    # Ctrl+C reaches the whole process group, the router stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    env = Env()
+    env.read_env()
+    setup_logging(env)
+    updater, close_bot = create_updater(env)
+    updater.job_queue.start()
+    logger.info('The shard %s is started', shard)
+    while True:
+        update_json = updates_queue.get()
+        if update_json is None:
+            break
+        try:
+            updater.dispatcher.process_update(
+                Update.de_json(update_json, updater.bot)
+            )
+        except Exception:
+            logger.exception('The update %s is not handled', update_json)
+    updater.job_queue.stop()
+    close_bot()
+
+
+def start_worker(
+    shard: int,
+    updates_queue: multiprocessing.Queue,
+) -> multiprocessing.Process:
+    worker = multiprocessing.Process(
+        target=run_worker,
+        args=(shard, updates_queue),
+        name=f'tg-shard-{shard}',
+    )
+    worker.start()
+    return worker
+
+
+def get_shard_key(update: Update) -> int:
+    if update.message or update.effective_user:
+        return get_chat_id(update)
+    return update.update_id
+
+
+def route_updates(
+    bot: Bot,
+    ring: ShardsRing,
+    queues: Dict[int, multiprocessing.Queue],
+    workers: Dict[int, multiprocessing.Process],
+    polling_timeout: int = 30,
+) -> None:
+    offset = None
+    try:
+        while True:
+            offset = route_next_updates(
+                bot,
+                ring,
+                queues,
+                workers,
+                offset,
+                polling_timeout,
+            )
+    finally:
+        # The routed updates are confirmed, so Telegram does not send
+        # them again after the restart
+        if offset:
+            try:
+                bot.get_updates(offset=offset, timeout=0)
+            except NetworkError:
+                logger.exception('The routed updates are not confirmed')
+
+
+def route_next_updates(
+    bot: Bot,
+    ring: ShardsRing,
+    queues: Dict[int, multiprocessing.Queue],
+    workers: Dict[int, multiprocessing.Process],
+    offset: Optional[int],
+    polling_timeout: int,
+) -> Optional[int]:
+    for shard, worker in workers.items():
+        if not worker.is_alive():
+            logger.warning(
+                'The shard %s exited with %s, restarting',
+                shard,
+                worker.exitcode,
+            )
+            workers[shard] = start_worker(shard, queues[shard])
+    try:
+        updates = bot.get_updates(offset=offset, timeout=polling_timeout)
+    except NetworkError:
+        logger.exception('The updates are not received')
+        time.sleep(1)
+        return offset
+    for update in updates:
+        offset = update.update_id + 1
+        shard = ring.get_shard(get_shard_key(update))
+        queues[shard].put(update.to_dict())
+    return offset
+
+
+def create_parser():
+    description = (
+        'The script runs the Telegram shop bot in several processes: '
+        'the router polls Telegram and passes every update to the worker '
+        'process of its chat, the chats are spread over the workers '
+        'by consistent hashing of the chat id.'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='{workers number}',
+        help='number of the worker processes, default: number of CPUs',
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        '--queue_size',
+        type=int,
+        metavar='{updates number}',
+        help=(
+            'updates waiting for a worker, the router waits when the queue '
+            'is full, default: 1000'
+        ),
+        default=1000,
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    env = Env()
+    env.read_env()
+    setup_logging(env)
+    bot = Bot(env('PIZZA_BOT_TOKEN'))
+    shards = list(range(args.workers))
+    ring = ShardsRing(shards)
+    queues = {
+        shard: multiprocessing.Queue(maxsize=args.queue_size)
+        for shard in shards
+    }
+    workers = {shard: start_worker(shard, queues[shard]) for shard in shards}
+    try:
+        route_updates(bot, ring, queues, workers)
+    except KeyboardInterrupt:
+        logger.info('The workers are stopping')
+    finally:
+        for shard in shards:
+            queues[shard].put(None)
+        for worker in workers.values():
+            worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import atexit
+import hmac
+import logging
+
+from environs import Env
+from flask import Flask, request
+from telegram import Bot, Update
+
+from tg_bot import create_updater, setup_logging
+
+logger = logging.getLogger(__file__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def create_app() -> Flask:
+    """
+    Every worker process of the WSGI server creates its own updater,
+    the customers states and the shared caches live in Redis,
+    so any worker can handle any update.
+    """
+    env = Env()
+    env.read_env()
+    setup_logging(env)
+    with env.prefixed('TG_WEBHOOK_'):
+        webhook_path = env('PATH', '/telegram')
+        secret_token = env('SECRET_TOKEN')
+
+    updater, close_bot = create_updater(env)
+    updater.job_queue.start()
+    atexit.register(updater.job_queue.stop)
+    atexit.register(close_bot)
+
+    app = Flask(__name__)
+
+    @app.route(webhook_path, methods=['POST'])
+    def handle_webhook():
+        request_secret_token = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(request_secret_token, secret_token):
+            logger.warning('The webhook request with a wrong secret token')
+            return 'Forbidden', 403
+        update = Update.de_json(request.get_json(force=True), updater.bot)
+        updater.dispatcher.process_update(update)
+        return 'ok', 200
+
+    return app
+
+
+def create_parser():
+    description = (
+        'The script sets or deletes the webhook of the Telegram shop bot, '
+        'without options it runs the webhook with the Flask server '
+        '(use gunicorn "tg_webhook:create_app()" in production).'
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--set_webhook',
+        action='store_true',
+        help='register TG_WEBHOOK_URL + TG_WEBHOOK_PATH in Telegram and exit',
+    )
+    parser.add_argument(
+        '--delete_webhook',
+        action='store_true',
+        help='delete the webhook (to get back to polling) and exit',
+    )
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    env = Env()
+    env.read_env()
+    bot = Bot(env('PIZZA_BOT_TOKEN'))
+    if args.delete_webhook:
+        bot.delete_webhook()
+        print('The webhook is deleted')
+        return
+
+    with env.prefixed('TG_WEBHOOK_'):
+        if args.set_webhook:
+            webhook_url = env('URL').rstrip('/') + env('PATH', '/telegram')
+            bot.set_webhook(
+                url=webhook_url,
+                secret_token=env('SECRET_TOKEN'),
+                max_connections=env.int('MAX_CONNECTIONS', 40),
+            )
+            print(f'The webhook is set: {webhook_url}')
+            return
+        listen = env('LISTEN', '127.0.0.1')
+        port = env.int('PORT', 8000)
+
+    create_app().run(host=listen, port=port)
+
+
+if __name__ == '__main__':
+    main()